@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# STERM, a serial communication terminal with server capabilities        #
+# Copyright (C) 2013-2023  Ralf Stemmer (ralf.stemmer@gmx.net)           #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
+
+# This script benchmarks the receive path of sterm (UART.Receive → Terminal.Write → ReceiveData).
+# Instead of real hardware, a pseudo terminal pair (os.openpty) is used.
+# The master side gets fed with synthetic data, the UART class opens the slave side.
+# The results get written as JSON so that they can be compared between different versions of sterm.
+# Also the time to import sterm.cli gets measured (python -X importtime), because sterm often gets started
+# by scripts just to read a few lines. With --importbudget, the benchmark fails when the import is too slow.
+
+import os
+import sys
+import time
+import json
+import tty
+import subprocess
+import argparse
+import platform
+import resource
+import tempfile
+import itertools
+import tracemalloc
+from threading      import Thread
+from sterm          import cli
+from sterm.uart     import UART, UARTMode
+from sterm.terminal import Terminal
+
+
+TEXTLINE = "[  42.133742] usb 1-1: new high-speed USB device number 3 using xhci_hcd – äöü €\n".encode("utf-8")
+
+argparser = argparse.ArgumentParser(
+    description="Benchmark the receive path of sterm with a pseudo terminal instead of hardware.",
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+argparser.add_argument("--modes",      default="text,binary",            type=str,
+    help="Comma separated list of UART modes (text, binary, hexdump).")
+argparser.add_argument("--logging",    default="off,on",                 type=str,
+    help="Comma separated list of logging settings (off, on).")
+argparser.add_argument("--chunksizes", default="16,256,4096",            type=str,
+    help="Comma separated list of chunk sizes in bytes written to the pseudo terminal at once.")
+argparser.add_argument("--baudrates",  default="115200,921600,0",        type=str,
+    help="Comma separated list of synthetic baud rates. 0 means as fast as possible.")
+argparser.add_argument("--duration",   default=1.0,                      type=float,
+    help="Duration of each scenario in seconds.")
+argparser.add_argument("--importruns", default=5,                      type=int,
+    help="Number of runs to measure the import time of sterm.cli. The median gets reported.")
+argparser.add_argument("--importbudget", metavar="ms",                 type=float,
+    help="Fail (exit code 1) when importing sterm.cli takes longer than the given number of milliseconds.")
+argparser.add_argument("--output",     metavar="path",                   type=str,
+    help="Write the JSON results into a file instead of stdout.")
+
+
+
+class Screen(object):
+    """
+    Replaces *stdout* of the ``Terminal``.
+    It records when data got written and how many bytes were received from the UART device at that time.
+    """
+    def __init__(self):
+        self.received = 0   # Updated by a UART listener
+        self.written  = 0
+        self.frames   = []  # (time, received bytes)
+
+    def Listener(self, data):
+        self.received += len(data)
+
+    def write(self, data):
+        self.frames.append((time.perf_counter(), self.received))
+        self.written += len(data)
+
+    def flush(self):
+        pass
+
+
+
+def Percentile(values, percent):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values)-1, int(len(values) * percent / 100))]
+
+
+
+def GenerateData(mode, size):
+    if mode == "text":
+        return (TEXTLINE * (size // len(TEXTLINE) + 1))[:size]
+    return bytes(itertools.islice(itertools.cycle(range(256)), size))
+
+
+
+def Feed(masterfd, data, baudrate, duration, writes):
+    """
+    Writes ``data`` again and again into the pseudo terminal for ``duration`` seconds.
+    When ``baudrate`` is not 0, the rate gets limited to ``baudrate/10`` bytes per second (8N1).
+    Each write gets recorded in ``writes`` as tuple of time and number of bytes written so far.
+    """
+    total = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        written = os.write(masterfd, data)
+        total  += written
+        writes.append((time.perf_counter(), total))
+        if baudrate:
+            delay = start + total / (baudrate / 10) - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+
+
+def MeasureImportTime(module, runs):
+    """
+    Imports ``module`` in ``runs`` fresh Python processes with ``-X importtime``.
+    Returns the median of the cumulative import time of the module in milliseconds (``None`` when ``runs`` is 0)
+    and the ten slowest modules (self time) of the last run.
+    """
+    totals  = []
+    modules = []        # (self time, name)
+    for run in range(runs):
+        process = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module],
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+        modules = []
+        for line in process.stderr.splitlines():
+            if not line.startswith("import time:") or "self [us]" in line:
+                continue
+            selftime, cumulative, name = line[len("import time:"):].split("|")
+            modules.append((int(selftime), name.strip()))
+            if name.strip() == module:
+                totals.append(int(cumulative) / 1000)
+    slowest = sorted(modules, reverse=True)[:10]
+    return Percentile(totals, 50), [{"module": name, "self_ms": selftime / 1000} for selftime, name in slowest]
+
+
+
+def RunScenario(mode, logging, chunksize, baudrate, duration, logdirectory):
+    masterfd, slavefd = os.openpty()
+    tty.setraw(masterfd)
+    uartmode = {"text": UARTMode.TEXT, "binary": UARTMode.BINARY, "hexdump": UARTMode.HEXDUMP}[mode]
+    logpath  = os.path.join(logdirectory, "benchmark.log") if logging == "on" else None
+
+    uart   = UART(os.ttyname(slavefd), 115200, "8N1", uartmode=uartmode, logpath=logpath)
+    screen = Screen()
+    uart.AddListener(screen.Listener)
+    term   = Terminal()
+    term.output = screen
+
+    # Run the receiver loop in a thread and measure its CPU time
+    usage = {}
+    def Receiver(shutdownfd):
+        before = resource.getrusage(resource.RUSAGE_THREAD)
+        cli.ReceiveData([uart], term, shutdownfd)
+        after  = resource.getrusage(resource.RUSAGE_THREAD)
+        usage["cpu"] = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+
+    shutdownread, shutdownwrite = os.pipe()
+    receiver = Thread(target=Receiver, args=(shutdownread,))
+    receiver.start()
+
+    writes = []
+    data   = GenerateData(mode, chunksize)
+    start  = time.perf_counter()
+    Feed(masterfd, data, baudrate, duration, writes)
+
+    # Wait until all data got received
+    total    = writes[-1][1] if writes else 0
+    deadline = time.perf_counter() + 10
+    while screen.received < total and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    term.Flush()
+    elapsed = time.perf_counter() - start
+
+    os.write(shutdownwrite, b"\0")
+    receiver.join()
+    os.close(shutdownread)
+    os.close(shutdownwrite)
+
+    # Latency: time from writing a chunk into the pseudo terminal until it got written to the screen
+    latencies = []
+    frame     = 0
+    for writetime, offset in writes:
+        while frame < len(screen.frames) and screen.frames[frame][1] < offset:
+            frame += 1
+        if frame == len(screen.frames):
+            break
+        latencies.append(screen.frames[frame][0] - writetime)
+
+    # Allocations: peak memory allocated while one chunk gets received and rendered
+    tracemalloc.start()
+    peaks = []
+    for i in range(50):
+        os.write(masterfd, data)
+        time.sleep(0.001)
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        string  = uart.Receive()
+        if string:
+            term.Write(string)
+        peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    tracemalloc.stop()
+
+    uart.Disconnect()
+    os.close(masterfd)
+    if logpath:
+        os.remove(logpath)
+
+    megabytes = screen.received / (1024*1024)
+    return {
+        "mode":           mode,
+        "logging":        logging,
+        "chunksize":      chunksize,
+        "baudrate":       baudrate,
+        "bytes":          screen.received,
+        "bytes_per_s":    screen.received / elapsed,
+        "cpu_s_per_mb":   usage.get("cpu", 0) / megabytes if megabytes else None,
+        "screen_writes":  len(screen.frames),
+        "latency_p50_ms": Percentile(latencies, 50) * 1000 if latencies else None,
+        "latency_p99_ms": Percentile(latencies, 99) * 1000 if latencies else None,
+        "alloc_bytes_per_chunk": Percentile(peaks, 50),
+        }
+
+
+
+def main():
+    args = argparser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as logdirectory:
+        for mode, logging, chunksize, baudrate in itertools.product(
+                args.modes.split(","),
+                args.logging.split(","),
+                [int(x) for x in args.chunksizes.split(",")],
+                [int(x) for x in args.baudrates.split(",")]):
+            result = RunScenario(mode, logging, chunksize, baudrate, args.duration, logdirectory)
+            results.append(result)
+            print("%-7s log=%-3s chunk=%5d baud=%7d: %10.0f B/s  %7.3f CPU-s/MB  p50 %7.3f ms  p99 %7.3f ms  %6d B alloc/chunk"%(
+                mode, logging, chunksize, baudrate,
+                result["bytes_per_s"],
+                result["cpu_s_per_mb"] or 0,
+                result["latency_p50_ms"] or 0,
+                result["latency_p99_ms"] or 0,
+                result["alloc_bytes_per_chunk"] or 0), file=sys.stderr)
+
+    importtime, slowest = MeasureImportTime("sterm.cli", args.importruns)
+    if importtime is None:
+        print("import sterm.cli: not measured", file=sys.stderr)
+    else:
+        print("import sterm.cli: %.1f ms (slowest: %s)"%(importtime,
+            ", ".join("%s %.1f ms"%(entry["module"], entry["self_ms"]) for entry in slowest[:3])), file=sys.stderr)
+
+    report = {
+        "sterm":     cli.VERSION,
+        "python":    platform.python_version(),
+        "platform":  platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "import_ms": importtime,
+        "import_slowest": slowest,
+        "results":   results,
+        }
+
+    if args.output:
+        with open(args.output, "w") as jsonfile:
+            json.dump(report, jsonfile, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.importbudget is not None and importtime is not None and importtime > args.importbudget:
+        print("Importing sterm.cli takes %.1f ms, the budget is %.1f ms"%(importtime, args.importbudget), file=sys.stderr)
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
@@ -25,6 +25,7 @@ setuptools.setup(
         entry_points={
                 "console_scripts": [
                     "sterm=sterm.cli:main",
+                    "sterm-log=sterm.logtool:main",
                     ],
                 },
         install_requires= ["pyserial"],
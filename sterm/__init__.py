@@ -1,2 +1,2 @@
-__all__ = ["terminal", "uart", "config", "cli"]
+__all__ = ["terminal", "uart", "config", "cli", "formatter", "logger", "server", "transmitter", "capture", "logtool", "replay", "stats", "scrollback", "trigger", "automation", "transfer", "framing", "hotplug", "reader", "governor"]
 
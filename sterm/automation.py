@@ -0,0 +1,237 @@
+# STERM, a serial communication terminal with server capabilities        #
+# Copyright (C) 2013-2023  Ralf Stemmer (ralf.stemmer@gmx.net)           #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
+
+import re
+import time
+import select
+
+
+# Maximum length of a match of a regular expression.
+# After new data arrived, only the new data and this many bytes in front of it get searched again.
+REGEXWINDOW = 4096
+
+
+class Session(object):
+    r"""
+    This class automates the interaction with a UART device, similar to *expect*.
+
+    Received data gets collected in a bounded receive buffer.
+    ``Expect`` searches this buffer for patterns and waits for more data until one of them matches.
+    After new data arrived, only the new data gets searched
+    (plus ``len(pattern)-1`` bytes, or ``REGEXWINDOW`` bytes for regular expressions, in front of it),
+    so a long session does not get slower with each call.
+    When a pattern matches, the buffer gets consumed up to the end of the match.
+
+    The data gets read by ``UART.ReceiveInto``, so it does not get decoded or formatted for a terminal.
+    Logging and all listeners of the device (like triggers or the scrollback buffer) keep working,
+    the log file gets the raw received data.
+    The buffer gets searched in place, without copying it.
+
+    .. code-block::
+
+        session = Session(UART("/dev/ttyUSB0", 115200, "8N1"))
+        session.Expect("login: ", timeout=60)
+        session.SendLine("root")
+        index = session.Expect(["# ", re.compile(rb"Login incorrect")], timeout=10)
+
+    Args:
+        uart: Instance of the ``UART`` class.
+        buffersize (int): Maximum number of bytes in the receive buffer. Older data gets discarded. Default is 1 MiB
+        linebreak (str, bytes): Line break appended by ``SendLine``. Default is ``"\r\n"``
+        output: (Optional) A binary file object (like ``sys.stdout.buffer``) all received data gets written to
+    """
+    def __init__(self, uart, *, buffersize=1024*1024, linebreak="\r\n", output=None):
+        self.uart       = uart
+        self.buffersize = buffersize
+        self.linebreak  = linebreak
+        self.output     = output
+
+        self.buffer = bytearray()
+        self.eof    = False
+        self.before = b""   # Data in front of the last match
+        self.match  = None  # The last match: bytes for literal patterns, re.Match for regular expressions
+
+        self.uart.AddListener(self.__Append)
+
+
+
+    def Close(self):
+        """
+        Detaches the session from the UART device.
+        The device does not get disconnected.
+
+        Returns:
+            *Nothing*
+        """
+        self.uart.RemoveListener(self.__Append)
+        return
+
+
+
+    def Expect(self, patterns, timeout=None):
+        """
+        This method waits until one of the patterns appears in the received data.
+
+        A pattern can be a string (gets UTF-8 encoded), bytes or a regular expression compiled from bytes
+        (``re.compile(rb"...")``).
+        When more than one pattern matches, the pattern with the earliest match wins.
+
+        After a match, the data in front of the match is available in ``before`` and the match in ``match``.
+        The receive buffer gets consumed up to the end of the match.
+
+        Args:
+            patterns: A pattern or a list of patterns
+            timeout (float): (Optional) Maximum number of seconds to wait. ``None`` waits forever.
+
+        Returns:
+            The index of the matching pattern in ``patterns`` (``0`` for a single pattern)
+
+        Raises:
+            TypeError: When a pattern has an invalid type
+            TimeoutError: When no pattern matched within ``timeout`` seconds
+            EOFError: When the connection to the device got lost before a pattern matched
+        """
+        if type(patterns) not in (list, tuple):
+            patterns = [patterns]
+
+        searches = []
+        for pattern in patterns:
+            if type(pattern) is str:
+                pattern = pattern.encode("utf-8")
+            if type(pattern) is bytes:
+                searches.append(self.__SearchLiteral(pattern))
+            elif isinstance(pattern, re.Pattern) and type(pattern.pattern) is bytes:
+                searches.append(self.__SearchRegex(pattern))
+            else:
+                raise TypeError("Expect patterns must be str, bytes or compiled bytes regular expressions!")
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        scanned  = 0    # Data in front of this position got searched already
+        while True:
+            best = None
+            for index, search in enumerate(searches):
+                found = search(scanned)
+                if found and (best is None or found[0] < best[1][0]):
+                    best = (index, found)
+
+            if best:
+                index, (start, end, match) = best
+                self.before = bytes(self.buffer[:start])
+                self.match  = match
+                # A new buffer, because a regular expression match still refers to the old one
+                self.buffer = self.buffer[end:]
+                return index
+
+            scanned = len(self.buffer)
+            if self.eof:
+                raise EOFError("Connection to device %s lost"%(self.uart.devpath))
+
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                raise TimeoutError("Timeout while waiting for %s"%(", ".join(repr(pattern) for pattern in patterns)))
+
+            discarded = self.__Fill(remaining)
+            scanned   = max(0, scanned - discarded)
+
+
+
+    def Send(self, string):
+        """
+        Transmits data to the device. See ``UART.Transmit``.
+
+        Args:
+            string (str, bytes): The data to transmit
+
+        Returns:
+            *Nothing*
+        """
+        self.uart.Transmit(string)
+        return
+
+
+
+    def SendLine(self, string=""):
+        """
+        Transmits data followed by a line break (``linebreak``).
+
+        Args:
+            string (str, bytes): The data to transmit
+
+        Returns:
+            *Nothing*
+        """
+        if type(string) is str and type(self.linebreak) is str:
+            self.uart.Transmit(string + self.linebreak)
+        else:
+            self.uart.Transmit(self.__Bytes(string) + self.__Bytes(self.linebreak))
+        return
+
+
+
+    def __Bytes(self, string):
+        if type(string) is str:
+            return string.encode("utf-8")
+        return string
+
+
+
+    def __SearchLiteral(self, pattern):
+        def Search(scanned):
+            start = self.buffer.find(pattern, max(0, scanned - len(pattern) + 1))
+            if start < 0:
+                return None
+            return start, start + len(pattern), pattern
+        return Search
+
+
+
+    def __SearchRegex(self, expression):
+        def Search(scanned):
+            match = expression.search(self.buffer, max(0, scanned - REGEXWINDOW))
+            if match is None:
+                return None
+            return match.start(), match.end(), match
+        return Search
+
+
+
+    def __Append(self, data):
+        self.buffer += data
+        if self.output:
+            self.output.write(data)
+            self.output.flush()
+
+
+
+    def __Fill(self, timeout):
+        """
+        Waits for new data and appends it to the buffer.
+
+        Returns:
+            The number of bytes that got discarded from the front of the buffer because it became too large
+        """
+        readable, _, _ = select.select([self.uart], [], [], timeout)
+        if readable and self.uart.ReceiveInto() is None:
+            self.eof = True # Readable but no data: the device got lost
+
+        discarded = max(0, len(self.buffer) - self.buffersize)
+        if discarded:
+            del self.buffer[:discarded]
+        return discarded
+
+
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,301 @@
+# STERM, a serial communication terminal with server capabilities        #
+# Copyright (C) 2013-2023  Ralf Stemmer (ralf.stemmer@gmx.net)           #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
+
+# The capture format stores each received chunk as a record with a timestamp.
+#
+# Capture file:
+#   Header: magic "STERMCAP", version (uint16), 6 bytes padding, start time (float64, seconds since epoch)
+#   Records: timestamp (uint64, nanoseconds since start time), length (uint32), data
+#
+# Index file (capture file path + ".idx"):
+#   Header: magic "STERMIDX", version (uint16), 6 bytes padding
+#   Entries: timestamp (uint64, nanoseconds since start time), offset of a record in the capture file (uint64)
+#
+# All numbers are little endian.
+# The index is sparse. There is at most one entry per INDEXINTERVAL nanoseconds or INDEXSTEP bytes.
+
+import os
+import time
+import mmap
+import struct
+import bisect
+from sterm.logger import LogWriter
+
+
+CAPTUREHEADER = struct.Struct("<8sH6xd")
+RECORDHEADER  = struct.Struct("<QI")
+INDEXHEADER   = struct.Struct("<8sH6x")
+INDEXENTRY    = struct.Struct("<QQ")
+
+CAPTUREMAGIC  = b"STERMCAP"
+INDEXMAGIC    = b"STERMIDX"
+VERSION       = 1
+
+INDEXINTERVAL = 1000000000  # 1 s
+INDEXSTEP     = 1024*1024   # 1 MiB
+
+
+class CaptureWriter(LogWriter):
+    """
+    This class writes a log file in the capture format.
+    Each chunk given to ``Write`` becomes one record with the time when ``Write`` got called.
+    Next to the capture file, a sparse index gets written that maps the time to the position of a record.
+
+    When data gets appended to an existing capture file, the timestamps continue relative to the start time
+    stored in the header of that file.
+
+    The arguments are the same as of ``sterm.logger.LogWriter``.
+    Rotated files keep their index (``rotatedpath + ".idx"``).
+    Compressed capture files cannot be read by ``CaptureReader`` before they get decompressed.
+    """
+    def __init__(self, path, **kwargs):
+        self.indexfile = None
+        super().__init__(path, **kwargs)
+
+
+
+    def OpenSegment(self):
+        if self.filesize == 0:
+            self.starttime = time.time()
+            self.file.write(CAPTUREHEADER.pack(CAPTUREMAGIC, VERSION, self.starttime))
+            self.filesize = CAPTUREHEADER.size
+        else:
+            with open(self.path, "rb") as capturefile:
+                header = capturefile.read(CAPTUREHEADER.size)
+            if len(header) < CAPTUREHEADER.size or header[:len(CAPTUREMAGIC)] != CAPTUREMAGIC:
+                raise ValueError("%s exists and is not a capture file!"%(self.path))
+            magic, version, self.starttime = CAPTUREHEADER.unpack(header)
+
+        # Timestamps are monotonic, but aligned to the start time of the capture file
+        self.origin = time.monotonic_ns() - int((time.time() - self.starttime) * 1e9)
+
+        self.indexfile = open(self.path + ".idx", "ab")
+        if self.indexfile.tell() == 0:
+            self.indexfile.write(INDEXHEADER.pack(INDEXMAGIC, VERSION))
+        self.lastindextime   = -INDEXINTERVAL
+        self.lastindexoffset = -INDEXSTEP
+
+
+
+    def CloseSegment(self, rotatedpath):
+        self.indexfile.close()
+        if rotatedpath:
+            os.rename(self.path + ".idx", rotatedpath + ".idx")
+
+
+
+    def Encode(self, timestamp, data, offset):
+        if type(data) is str:
+            data = data.encode("utf-8", "surrogateescape")
+
+        timestamp = max(0, timestamp - self.origin)
+        if timestamp - self.lastindextime >= INDEXINTERVAL or offset - self.lastindexoffset >= INDEXSTEP:
+            self.indexfile.write(INDEXENTRY.pack(timestamp, offset))
+            self.indexfile.flush()
+            self.lastindextime   = timestamp
+            self.lastindexoffset = offset
+
+        return RECORDHEADER.pack(timestamp, len(data)) + data
+
+
+
+class CaptureReader(object):
+    """
+    This class reads a capture file written by ``CaptureWriter``.
+    The file gets memory mapped, so only the parts that get accessed are loaded.
+    When an index file exists, it gets used to find records by their time without reading the whole file.
+
+    Timestamps are integers with nanoseconds since the start time of the capture (``starttime``).
+
+    Args:
+        path (str): Path to the capture file
+
+    Raises:
+        ValueError: When the file is not a capture file
+        OSError: When the file cannot be opened
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.file.close()
+            raise ValueError("%s is empty!"%(path))
+
+        if len(self.map) < CAPTUREHEADER.size:
+            self.Close()
+            raise ValueError("%s is not a capture file!"%(path))
+        magic, version, self.starttime = CAPTUREHEADER.unpack_from(self.map, 0)
+        if magic != CAPTUREMAGIC or version != VERSION:
+            self.Close()
+            raise ValueError("%s is not a capture file!"%(path))
+
+        # Load the sparse index
+        self.indextimes   = []
+        self.indexoffsets = []
+        try:
+            with open(path + ".idx", "rb") as indexfile:
+                header = indexfile.read(INDEXHEADER.size)
+                if len(header) == INDEXHEADER.size and INDEXHEADER.unpack(header)[0] == INDEXMAGIC:
+                    entries = indexfile.read()
+                    entries = entries[:len(entries) - len(entries) % INDEXENTRY.size]
+                    for timestamp, offset in INDEXENTRY.iter_unpack(entries):
+                        self.indextimes.append(timestamp)
+                        self.indexoffsets.append(offset)
+        except FileNotFoundError:
+            pass
+
+
+
+    def Close(self):
+        """
+        Closes the capture file.
+
+        Returns:
+            *Nothing*
+        """
+        self.map.close()
+        self.file.close()
+        return
+
+
+
+    def WallTime(self, timestamp):
+        """
+        Args:
+            timestamp (int): Timestamp of a record
+
+        Returns:
+            The time of the record in seconds since epoch
+        """
+        return self.starttime + timestamp / 1e9
+
+
+
+    def Timestamp(self, walltime):
+        """
+        Args:
+            walltime (float): Time in seconds since epoch
+
+        Returns:
+            The timestamp relative to the start of the capture in nanoseconds
+        """
+        return int((walltime - self.starttime) * 1e9)
+
+
+
+    def Seek(self, timestamp):
+        """
+        This method finds the first record that was received at or after ``timestamp``.
+        The index is used to skip the records before the last index entry in front of ``timestamp``.
+
+        Args:
+            timestamp (int): Timestamp in nanoseconds since the start of the capture
+
+        Returns:
+            The offset of the record in the capture file
+        """
+        offset = CAPTUREHEADER.size
+        entry  = bisect.bisect_right(self.indextimes, timestamp) - 1
+        if entry >= 0:
+            offset = self.indexoffsets[entry]
+
+        for recordtime, recordoffset, length in self.__Headers(offset, None):
+            if recordtime >= timestamp:
+                return recordoffset
+        return len(self.map)
+
+
+
+    def __Headers(self, offset, end):
+        size = len(self.map)
+        while offset + RECORDHEADER.size <= size:
+            timestamp, length = RECORDHEADER.unpack_from(self.map, offset)
+            if offset + RECORDHEADER.size + length > size:
+                break   # Record not completely written yet
+            if end is not None and timestamp >= end:
+                break
+            yield timestamp, offset, length
+            offset += RECORDHEADER.size + length
+
+
+
+    def Records(self, start=None, end=None):
+        """
+        This generator yields all records between ``start`` and ``end``.
+        A record that is not completely written yet gets ignored.
+        Only the data of the yielded records gets read from the file.
+
+        Args:
+            start (int): (Optional) Timestamp of the first record
+            end (int): (Optional) Records at or after this timestamp are not yielded
+
+        Yields:
+            Tuples of the timestamp, the offset of the record in the file and its data as ``bytes``.
+        """
+        offset = self.Seek(start) if start is not None else CAPTUREHEADER.size
+        for timestamp, offset, length in self.__Headers(offset, end):
+            datastart = offset + RECORDHEADER.size
+            yield timestamp, offset, self.map[datastart:datastart+length]
+
+
+
+    def Search(self, pattern, start=None, end=None):
+        """
+        This generator searches for a byte pattern in the data of all records between ``start`` and ``end``.
+        The search runs directly on the memory mapped file, the data does not get copied.
+        Matches that span two or more records are found as well.
+
+        Args:
+            pattern (bytes): The bytes to search for
+            start (int): (Optional) Timestamp of the first record to search
+            end (int): (Optional) Records at or after this timestamp are not searched
+
+        Yields:
+            Tuples of the timestamp of the record where the match starts and the offset of the match in the file.
+        """
+        if not pattern:
+            return
+
+        offset = self.Seek(start) if start is not None else CAPTUREHEADER.size
+        tail   = []   # (timestamp, file offset) of the last len(pattern)-1 bytes of data
+        for timestamp, offset, length in self.__Headers(offset, end):
+            datastart = offset + RECORDHEADER.size
+            dataend   = datastart + length
+
+            # Matches that started in previous records
+            if tail:
+                joined = b"".join([self.map[position:position+1] for _, position in tail])
+                joined += self.map[datastart:min(dataend, datastart + len(pattern) - 1)]
+                index  = joined.find(pattern)
+                while 0 <= index < len(tail):
+                    yield tail[index]
+                    index = joined.find(pattern, index + 1)
+
+            # Matches inside this record
+            index = self.map.find(pattern, datastart, dataend)
+            while index >= 0:
+                yield timestamp, index
+                index = self.map.find(pattern, index + 1, dataend)
+
+            if len(pattern) > 1:
+                tail += [(timestamp, position) for position in range(max(datastart, dataend - len(pattern) + 1), dataend)]
+                tail  = tail[-(len(pattern) - 1):]
+
+
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
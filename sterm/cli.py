@@ -17,56 +17,279 @@
 # You should have received a copy of the GNU General Public License      #
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
 
-import time
+import os
+import re
 import argparse
 import termios
+import selectors
 import sys
 import tty
+import time
 from threading      import Thread
 from sterm.uart     import UART, UARTMode
 from sterm.terminal import Terminal
+from sterm.stats    import Statistics, StatsWriter, FormatText
+# Optional subsystems (server, replay, scrollback, triggers, automation) get imported in main
+# only when they are used, so that starting sterm stays fast.
 
 
 
 VERSION = "6.0.3"
 
+# Maximum number of bytes read from stdin at once in headless mode
+PIPEREADSIZE = 64*1024
+
+# Minimum number of seconds between two updates of the progress of a file transfer
+PROGRESSINTERVAL = 0.25
+
+# Escape commands that transmit a file, and the protocol they use
+TRANSFERCOMMANDS = {"send": "raw", "xmodem": "XMODEM", "xmodem1k": "XMODEM-1K", "ymodem": "YMODEM"}
+
+
+def ParseSize(string):
+    """
+    This function translates a size string like ``"64M"`` into a number of bytes.
+    The suffixes ``K``, ``M`` and ``G`` are supported (factor 1024).
+    A string without suffix is a number of bytes.
+
+    Args:
+        string (str): Size with optional suffix
+
+    Returns:
+        The size in bytes as integer
+
+    Raises:
+        ValueError: When the string is not a valid size
+    """
+    factors = {"K": 1024, "M": 1024**2, "G": 1024**3}
+    string  = string.strip().upper()
+    if string and string[-1] in factors:
+        return int(float(string[:-1]) * factors[string[-1]])
+    return int(string)
+
+
 
-# This global variable is used to shutdown the thread used
-# for the ReceiveData function.
-ShutdownReceiver = False
+def CommandLineParser():
+    """
+    This function creates the parser for the command line arguments of *sterm*.
+    It is not created when this module gets imported, so that importing ``sterm.cli`` stays fast.
+
+    Returns:
+        An ``argparse.ArgumentParser`` instance
+    """
+    cli = argparse.ArgumentParser(
+        description="A minimal serial terminal. To exit the program, press the escape key and enter 'exit' followed by enter.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+        )
 
+    cli.add_argument(      "--binary",      default=False,                action="store_true",
+        help="Display raw data instead of UTF-8 encoded. (read only)")
+    cli.add_argument(      "--hexdump",     default=False,                action="store_true",
+        help="Display raw data in hexdump layout with offsets and an ASCII column. (read only)")
+    cli.add_argument(      "--frames",      metavar="framing",  type=str, action="store",
+        help="Split the received data into frames and display one frame per line with a timestamp. Framing: slip, cobs, length[:SIZE[:big|little]] or delimiter:SEQUENCE.")
+    cli.add_argument(      "--framecrc",    default=None,       type=str, action="store", choices=["crc16", "crc16-xmodem", "crc32"],
+        help="Check the CRC at the end of each frame.")
+    cli.add_argument(      "--decodeerrors", default="escape",  type=str, action="store", choices=["replace", "escape", "passthrough"],
+        help="How to display invalid UTF-8 data: as replacement character, as [0xNN] marker per byte or unchanged.")
+    cli.add_argument("-n", "--noecho",      default=False,                action="store_true",
+        help="Direct character transmission. Does not echo the user input to stdout.")
+    cli.add_argument(      "--escape",      default="\033",     type=str, action="store",
+        help="Change the default escape character (␛).")
+    cli.add_argument(      "--pace",        metavar="bytes/ms", type=float, action="store",
+        help="Limit the transmission rate to protect slow devices (bytes per millisecond).")
+    cli.add_argument(      "--linedelay",   metavar="ms",       type=float, action="store",
+        help="Wait the given number of milliseconds after transmitting a line break.")
+    cli.add_argument(      "--rtscts",      default=False,                action="store_true",
+        help="Enable hardware flow control (RTS/CTS).")
+    cli.add_argument(      "--xonxoff",     default=False,                action="store_true",
+        help="Enable software flow control (XON/XOFF).")
+    cli.add_argument("-b", "--baudrate",    default=115200,     type=int, action="store",
+        help="The baudrate used for the communication.")
+    cli.add_argument("-f", "--format",      default="8N1",      type=str, action="store",
+        help="Configuration-triple: xyz with x=bytelength in bits {5,6,7,8}, y=parity {N,E,O}, z=stopbits {1,2}.")
+    cli.add_argument("-w", "--write",       metavar="logfile",  type=str, action="store",
+        help="Write received data into a file.")
+    cli.add_argument(      "--logsize",     metavar="size",     type=ParseSize, action="store",
+        help="Rotate the log file when it becomes larger than the given size. Suffixes K, M and G are supported (like 100M).")
+    cli.add_argument(      "--loginterval", metavar="seconds",  type=float, action="store",
+        help="Rotate the log file after the given number of seconds.")
+    cli.add_argument(      "--logcompress", default=None,       type=str, action="store", choices=["gz", "xz"],
+        help="Compress rotated log files.")
+    cli.add_argument(      "--logformat",   default="plain",    type=str, action="store", choices=["plain", "capture"],
+        help="Format of the log file. The capture format stores the raw received data with timestamps and can be read with sterm-log.")
+    cli.add_argument(      "--listen",      metavar="host:port", type=str, action="store",
+        help="Make the (first) device accessible for network clients via TCP. Only one client can write at a time.")
+    cli.add_argument(      "--readonly",    default=False,                action="store_true",
+        help="Network clients can only watch. Data send by them gets discarded.")
+    cli.add_argument(      "--replay",      metavar="logfile",  type=str, action="store",
+        help="Replay a log file instead of connecting to a device. Capture files get replayed with their original timing.")
+    cli.add_argument(      "--speed",       default=1.0,        type=float, action="store",
+        help="Replay speed relative to the original timing. 0 replays as fast as possible.")
+    cli.add_argument(      "--scrollback",  metavar="size",     type=ParseSize, action="store",
+        help="Keep the given amount of received data of each device in memory to search it with the find and findre commands. Suffixes K, M and G are supported (like 64M).")
+    cli.add_argument(      "--trigger",     metavar="pattern=action", type=str, action="append", default=[],
+        help="Execute an action when the pattern gets received. Actions: highlight, mark (write a marker into the log file), send:TEXT, exec:COMMAND. Can be given multiple times.")
+    cli.add_argument(      "--script",      metavar="path",     type=str, action="store",
+        help="Run a Python script that controls the devices via the variables session and sessions (see sterm.automation) instead of the interactive terminal.")
+    cli.add_argument(      "--headless",    default=False,                action="store_true",
+        help="Pass raw bytes from the device to stdout and from stdin to the device, without terminal handling and escape commands. Gets enabled automatically when stdin or stdout is not a terminal.")
+    cli.add_argument(      "--oneshot",     default=False,                action="store_true",
+        help="Connect, write the received raw data to stdout until the device is idle (--idle) or the time is up (--timeout) and exit.")
+    cli.add_argument(      "--idle",        default=1.0,        type=float, action="store",
+        help="Seconds without received data that end --oneshot.")
+    cli.add_argument(      "--timeout",     metavar="seconds",  type=float, action="store",
+        help="Maximum number of seconds --oneshot waits for data.")
+    cli.add_argument(      "--readerprocess", metavar="size", type=ParseSize, action="store",
+        help="Read the devices in a separate process into a shared memory ring buffer of the given size, so that slow rendering cannot delay reading. Suffixes K, M and G are supported (like 16M).")
+    cli.add_argument(      "--nothrottle",  default=False,                action="store_true",
+        help="Render all received data, even when the terminal cannot keep up. By default, output floods get summarized until the rate drops (the log file still gets everything).")
+    cli.add_argument(      "--noreconnect", default=False,                action="store_true",
+        help="Do not wait for a lost device to reappear. By default, a lost device gets reopened as soon as its device node exists again.")
+    cli.add_argument(      "--statsfile",   metavar="path",     type=str, action="store",
+        help="Write runtime statistics periodically into a file. JSON format, or OpenMetrics when the file name ends with .prom.")
+    cli.add_argument(      "--statsinterval", default=10.0,     type=float, action="store",
+        help="Seconds between two updates of the statistics file.")
+    cli.add_argument("device",              nargs="*",          type=str, action="store",
+        help="Path to the serial communication device. Multiple devices can be given. Then the output of each device gets prefixed by its name.")
+    return cli
 
-cli = argparse.ArgumentParser(
-    description="A minimal serial terminal. To exit the program, press the escape key and enter 'exit' followed by enter.",
-    formatter_class=argparse.ArgumentDefaultsHelpFormatter
-    )
 
-cli.add_argument(      "--binary",      default=False,                action="store_true",
-    help="Display raw data instead of UTF-8 encoded. (read only)")
-cli.add_argument("-n", "--noecho",      default=False,                action="store_true",
-    help="Direct character transmission. Does not echo the user input to stdout.")
-cli.add_argument(      "--escape",      default="\033",     type=str, action="store",
-    help="Change the default escape character (␛).")
-cli.add_argument("-b", "--baudrate",    default=115200,     type=int, action="store",
-    help="The baudrate used for the communication.")
-cli.add_argument("-f", "--format",      default="8N1",      type=str, action="store",
-    help="Configuration-triple: xyz with x=bytelength in bits {5,6,7,8}, y=parity {N,E,O}, z=stopbits {1,2}.")
-cli.add_argument("-w", "--write",       metavar="logfile",  type=str, action="store",
-    help="Write received data into a file.")
-cli.add_argument("device",                                  type=str, action="store",
-    help="Path to the serial communication device.")
 
 ESCAPECHAR  = "\033"     # Escape character to start an escape command sequence
 
 
-def ReceiveData(uart, term):
+
+def DevicePrefix(uart, index):
+    """
+    This function returns the colored prefix that tags the output of a UART device
+    when multiple devices are connected.
+
+    Args:
+        uart: Instance of the ``UART`` class.
+        index (int): Index of the device in the list of connected devices
+
+    Returns:
+        A string like ``"[ttyUSB0] "`` with ANSI color codes
+    """
+    color = 31 + (index % 6)
+    return "\033[1;%dm[%s]\033[0m "%(color, os.path.basename(uart.devpath))
+
+
+
+def DeviceLogPath(logpath, devpath):
+    """
+    This function returns the path of the log file of a device when multiple devices are connected.
+    The name of the device gets inserted in front of the file extension.
+    For example ``"capture.log"`` becomes ``"capture.ttyUSB0.log"``.
+
+    Args:
+        logpath (str): Path to the log file given by the user
+        devpath (str): Path to the UART device
+
+    Returns:
+        Path to the log file of the device
+    """
+    base, extension = os.path.splitext(logpath)
+    return base + "." + os.path.basename(devpath) + extension
+
+
+
+def DroppedNotice(uart, reported):
+    """
+    This function checks if received data got lost because the ring buffer of the reader process of a device
+    was full (see ``UART.Dropped``).
+
+    Args:
+        uart: Instance of the ``UART`` class.
+        reported (dict): Number of lost bytes of each device that got reported already. Gets updated.
+
+    Returns:
+        A notice string when more data got lost since the last call, otherwise ``None``
+    """
+    dropped = uart.Dropped()[0]
+    if dropped == reported.get(uart, 0):
+        return None
+    notice = "\033[1;31m[sterm: %d bytes of device %s got lost, the receive ring buffer is full]\033[0m\n"%(
+        dropped - reported.get(uart, 0), uart.devpath)
+    reported[uart] = dropped
+    return notice
+
+
+
+def WatchDevice(selector, uart, data, notify):
+    """
+    This function waits for a lost UART device to reappear and reopens it (see ``UART.Reconnect``).
+    Instead of retrying periodically, the device node gets watched by a ``sterm.hotplug.DeviceWatcher``
+    that gets registered at the ``selector``.
+    Its key data is a callback, like the one of the sockets of a ``Server``, that must be called with the event mask.
+    As soon as the device can be opened again, the watcher gets removed and the device gets registered again
+    at the ``selector`` with ``data``.
+
+    The device must not be registered at the ``selector`` anymore when this function gets called.
+    Its handle gets closed immediately (see ``UART.Hangup``).
+
+    Args:
+        selector: The selector of the receiver loop
+        uart: Instance of the ``UART`` class that got lost
+        data: Data of the selector key of the device
+        notify: A callable that gets called with a message string when the device got reconnected
+
+    Returns:
+        ``True`` when the device gets watched, ``False`` when watching is not possible (like without *inotify*)
+    """
+    from sterm.hotplug import DeviceWatcher
+    uart.Hangup()
+    try:
+        watcher = DeviceWatcher(uart.devpath)
+    except OSError:
+        return False
+
+    def Reconnect(mask=None):
+        if not watcher.Read():
+            return
+        try:
+            uart.Reconnect()
+        except OSError:
+            return # Not ready yet (like before udev set the permissions), wait for the next event
+        selector.unregister(watcher)
+        selector.register(uart, selectors.EVENT_READ, data)
+        notify("[sterm: Reconnected to device %s]"%(uart.devpath))
+        watcher.Close() # Closing an inotify instance takes some milliseconds, so do it last
+
+    selector.register(watcher, selectors.EVENT_READ, Reconnect)
+    Reconnect() # The device may have reappeared already
+    return True
+
+
+
+def ReceiveData(uarts, term, shutdownfd, servers=(), stats=None, triggers=None, reconnect=False, governor=None):
     """
-    This function reads every 0.01 seconds all data from the serial input buffer.
+    This function waits for incoming data on the UART devices and reads all data from their serial input buffers.
     The read data then gets printed to the screen (stdout).
+    When more than one device is connected, each line gets prefixed by the colored name of the device
+    (see ``DevicePrefix``).
     After writing to the output buffer, the buffer gets flushed so that the data is visible to the user
     as soon as possible.
-    The function is blocking and runs until the global variable ``ShutdownReveiver`` get set to ``False``
-    or when reading from the input buffer raises an exception.
+
+    Instead of polling the devices, the function sleeps inside ``select`` (epoll on Linux) until a UART device
+    or the ``shutdownfd`` becomes readable.
+    So there is no additional latency for received data and no CPU wake ups while the line is idle.
+    The sockets of the ``servers`` get served by the same selector.
+    While output is buffered by the terminal, the function only sleeps until the next frame is due
+    and then flushes the terminal.
+    The function is blocking and runs until the ``shutdownfd`` becomes readable (something got written into the pipe)
+    or all UART devices got lost.
+    With ``reconnect``, lost devices get reopened as soon as they reappear (see ``WatchDevice``)
+    and the function only returns by the ``shutdownfd``.
+    With a ``governor``, the received data gets rendered through it, so that output floods get summarized
+    instead of overloading the terminal (see ``sterm.governor.RenderGovernor``).
+    Notices always get written to the terminal directly.
+
+    The wake ups of the loop, the number of events per wake up and the wake ups only for flushing the terminal
+    get counted in ``stats``.
+    The notices of ``triggers`` get written behind the received data that caused them.
+    Data that got lost because the ring buffer of a reader process was full gets reported (see ``DroppedNotice``).
 
     This function is intended to run in a separate thread.
     The following example shows how to handle this function.
@@ -74,33 +297,97 @@ def ReceiveData(uart, term):
     .. code-block::
 
         # Start receiver thread
-        ReceiverThread = Thread(target=ReceiveData, args=(uart, term))
+        shutdownread, shutdownwrite = os.pipe()
+        ReceiverThread = Thread(target=ReceiveData, args=(uarts, term, shutdownread))
         ReceiverThread.start()
 
         # …
 
         # Shutdown receiver thread
-        ShutdownReceiver = True
+        os.write(shutdownwrite, b"\\0")
         if ReceiverThread.is_alive():
             ReceiverThread.join()
 
 
     Args:
-        uart: Instance of the ``UART`` class.
+        uarts: List of instances of the ``UART`` class.
         term: Instance of the ``Terminal`` class.
+        shutdownfd (int): Read-end of a pipe. When it becomes readable, the function returns.
+        servers: (Optional) List of instances of the ``Server`` class.
+        stats: (Optional) Instance of the ``sterm.stats.Statistics`` class.
+        triggers: (Optional) Dictionary with the ``sterm.trigger.Triggers`` instance of each UART device.
+        reconnect (bool): (Optional) Wait for lost devices to reappear. Default is ``False``
+        governor: (Optional) Instance of the ``sterm.governor.RenderGovernor`` class.
 
 
     Returns:
         *Nothing*
     """
 
-    data = ""
-    while not ShutdownReceiver:
+    if stats is None:
+        stats = Statistics("receiver")
+    if triggers is None:
+        triggers = {}
+    reported = {}
+    render   = governor or term
 
-        string = uart.Receive()
-        if string:
-            term.Write(string)
-        time.sleep(0.01)
+    selector = selectors.DefaultSelector()
+    selector.register(shutdownfd, selectors.EVENT_READ)
+    for index, uart in enumerate(uarts):
+        prefix = DevicePrefix(uart, index) if len(uarts) > 1 else None
+        selector.register(uart, selectors.EVENT_READ, prefix)
+    for server in servers:
+        server.Register(selector)
+
+    try:
+        connected = len(uarts)
+        while connected > 0:
+            events = selector.select(render.FlushTimeout())
+            stats.Count("wakeups")
+            if not events:
+                stats.Count("frame_flushes")
+                render.Flush()
+                continue
+            stats.Observe("events_per_wakeup", len(events))
+
+            if any(key.fileobj == shutdownfd for key, mask in events):
+                break
+
+            for key, mask in events:
+                # Sockets of the servers have a callback as data
+                if callable(key.data):
+                    key.data(mask)
+                    continue
+
+                uart   = key.fileobj
+                string = uart.Receive()
+                if string is not None:
+                    # The string is empty when the data is not complete yet (like a part of a multibyte character or frame).
+                    # Only None means that the device got lost.
+                    if string:
+                        render.Write(string, key.data)
+                    if uart in triggers:
+                        notices = triggers[uart].Notices()
+                        if notices:
+                            term.Write(notices if term.linestart else "\n" + notices, key.data)
+                    notice = DroppedNotice(uart, reported)
+                    if notice:
+                        term.Write(notice if term.linestart else "\n" + notice, key.data)
+                else:
+                    # The device signaled readable but there was no data.
+                    # This happens when the device got lost (hang up).
+                    selector.unregister(uart)
+                    prefix = key.data
+                    def Notify(message, prefix=prefix):
+                        term.Write((message if term.linestart else "\n" + message) + "\n", prefix)
+                    if reconnect and WatchDevice(selector, uart, prefix, Notify):
+                        term.Write("\n[sterm: Connection to device %s lost, waiting for it to reappear]\n"%(uart.devpath), prefix)
+                    else:
+                        term.Write("\n[sterm: Connection to device %s lost]\n"%(uart.devpath), prefix)
+                        connected -= 1
+    finally:
+        selector.close()
+        term.Flush()
 
 
 
@@ -117,6 +404,7 @@ def ReadCommand(term):
     command = ""
     if not term.echo:
         term.Write("␛") # Print ESC Unicode character then user hits escape key
+        term.Flush()
 
     while True:
         char = term.ReadCharacter(echo=True)
@@ -135,10 +423,104 @@ def ReadCommand(term):
 
 
 
-def HandleUserInput(uart, term):
+def ShowMatches(term, scrollback, pattern, regex):
+    """
+    This function searches the scrollback buffer backwards and prints the matches with two lines of context.
+    The newest matches get printed last, so they are next to the prompt.
+    The matching data gets highlighted.
+
+    Args:
+        term: Instance of the ``Terminal`` class.
+        scrollback: Instance of the ``Scrollback`` class or ``None`` when the scrollback buffer is disabled.
+        pattern (str): Text or regular expression to search for
+        regex (bool): Interpret ``pattern`` as regular expression
+
+    Returns:
+        *Nothing*
+    """
+    if scrollback is None:
+        term.Write("Scrollback buffer is disabled (see --scrollback)\n")
+        return
+
+    try:
+        matches = scrollback.Find(pattern.encode("utf-8"), regex=regex)
+    except re.error as e:
+        term.Write("Invalid regular expression: %s\n"%(str(e)))
+        return
+
+    if not matches:
+        term.Write("No match for \"%s\"\n"%(pattern))
+        return
+
+    for position, length in reversed(matches):
+        before, match, after = scrollback.Context(position, length)
+        term.Write("\n\033[1m[sterm: match %d bytes ago]\033[0m\n"%(scrollback.total - position))
+        term.Write(before.decode("utf-8", "replace"))
+        term.Write("\033[7m" + match.decode("utf-8", "replace") + "\033[0m")
+        term.Write(after.decode("utf-8", "replace").rstrip("\r\n") + "\n")
+    return
+
+
+
+def SendFile(term, uart, path, protocol="raw"):
+    """
+    This function transmits a file to a UART device and shows the progress and throughput on the terminal.
+    See ``sterm.transfer.FileTransfer`` for details.
+    The receiver thread keeps on receiving and rendering data while the file gets transmitted.
+    The user can abort the transfer with the escape key. All other input gets discarded during the transfer.
+
+    Args:
+        term: Instance of the ``Terminal`` class.
+        uart: Instance of the ``UART`` class.
+        path (str): Path to the file
+        protocol (str): ``"raw"`` (default), ``"XMODEM"``, ``"XMODEM-1K"`` or ``"YMODEM"``
+
+    Returns:
+        *Nothing*
+    """
+    from sterm.transfer import FileTransfer
+
+    path       = os.path.expanduser(path.strip())
+    lastupdate = 0.0
+    def Progress(transfer):
+        nonlocal lastupdate
+        now = time.monotonic()
+        if now - lastupdate < PROGRESSINTERVAL and transfer.sent < transfer.size:
+            return
+        lastupdate = now
+        term.Write("\033[1G\033[K\033[1m[sterm: %s: %d of %d KiB, %.1f KiB/s]\033[0m"%(
+            os.path.basename(path), transfer.sent // 1024, transfer.size // 1024, transfer.Throughput() / 1024))
+        term.Flush()
+
+    def Cancel():
+        return ESCAPECHAR in term.PollInput()
+
+    try:
+        transfer = FileTransfer(uart, path, progress=Progress, cancel=Cancel)
+        term.Write("\033[1m[sterm: Sending %s (%d bytes, %s). Press the escape key to abort]\033[0m\n"%(path, transfer.size, protocol))
+        term.Flush()
+        if protocol == "XMODEM":
+            transfer.SendXMODEM(128)
+        elif protocol == "XMODEM-1K":
+            transfer.SendXMODEM(1024)
+        elif protocol == "YMODEM":
+            transfer.SendYMODEM()
+        else:
+            transfer.Send()
+    except OSError as e:
+        term.Write("\n\033[1m[sterm: Sending %s failed: %s]\033[0m\n"%(path, str(e)))
+        return
+    term.Write("\n\033[1m[sterm: Sent %d bytes in %.1f s]\033[0m\n"%(transfer.sent, time.monotonic() - transfer.starttime))
+    return
+
+
+
+def HandleUserInput(uarts, term, statistics=(), scrollbacks=None):
     r"""
     This function handles the user input.
-    It reads the input from *stdin* byte by byte and sends it directly UTF-8 encoded to the UART device.
+    It reads all available input from *stdin* at once and sends it directly UTF-8 encoded to the UART device.
+    So pasted text gets transmitted with one write call instead of one write per character.
+    The transmission can be paced by the ``--pace`` and ``--linedelay`` command line parameters.
 
     When the escape character gets entered, the function starts to record a command instead of sending
     the data to the UART device.
@@ -149,96 +531,604 @@ def HandleUserInput(uart, term):
     or ``version`` to print the version number of ``sterm`` to *stdout*.
     Enter the escape character twice send one escape character to the UART device.
 
+    When multiple UART devices are connected, the input gets send to the first device.
+    The escape command ``device`` lists all connected devices,
+    ``device x`` sends all following input to the device with number or name *x*.
+    The escape command ``stats`` prints the runtime ``statistics``.
+    The escape commands ``find text`` and ``findre regex`` search the scrollback buffer of the current device
+    (see ``ShowMatches``).
+    The escape commands ``send path``, ``xmodem path``, ``xmodem1k path`` and ``ymodem path``
+    transmit a file to the current device (see ``SendFile``).
+
     This function takes care the ``"\r\n"`` sequences and ``"\n"``-only line breaks are handled correctly.
     Currently, it always send ``"\r\n"``
 
     The function expects UTF-8 encoded input.
 
     Args:
-        uart: Instance of the ``UART`` class.
+        uarts: List of instances of the ``UART`` class.
         term: Instance of the ``Terminal`` class.
+        statistics: (Optional) List of instances of the ``sterm.stats.Statistics`` class.
+        scrollbacks: (Optional) Dictionary with the ``Scrollback`` instance of each UART device.
 
     Returns:
         *Nothing*
     """
-    char = ""
+    uart = uarts[0]
+    if scrollbacks is None:
+        scrollbacks = {}
 
     while True:
-        char = term.ReadCharacter()
+        string = term.ReadInput()
+        index  = string.find(ESCAPECHAR)
+        if index >= 0:
+            term.Unread(string[index+1:])
+            string = string[:index]
+
+        # Send characters to UART-Device
+        if string:
+            if term.echo:
+                term.Write(string)
+                term.Flush()
+            # In this mode, \n needs to be added manually to get a new line
+            try:
+                uart.Transmit(string.replace("\r", "\r\n"))
+            except OSError:
+                pass    # The device got lost, the receiver thread reports it
 
         # Handle escape sequences
-        if char == ESCAPECHAR:
+        if index >= 0:
+            if term.echo:
+                term.Write("␛") # Print ESC Unicode character then user hits escape key
+                term.Flush()
             command = ReadCommand(term)
 
             if command == ESCAPECHAR:
-                uart.Transmit(ESCAPECHAR.encode("utf-8"))
+                try:
+                    uart.Transmit(ESCAPECHAR.encode("utf-8"))
+                except OSError:
+                    pass
 
             if command == "exit":
                 break
 
             elif command == "version":
-                print("Version: " + VERSION, end="\r\n")
+                term.Write("Version: " + VERSION + "\n")
+                term.Flush()
+
+            elif command == "stats":
+                term.Write(FormatText(statistics))
+                term.Flush()
+
+            elif command.startswith("find "):
+                ShowMatches(term, scrollbacks.get(uart), command[len("find "):], regex=False)
+                term.Flush()
+
+            elif command.startswith("findre "):
+                ShowMatches(term, scrollbacks.get(uart), command[len("findre "):], regex=True)
+                term.Flush()
+
+            elif command.partition(" ")[0] in TRANSFERCOMMANDS:
+                command, _, path = command.partition(" ")
+                SendFile(term, uart, path, TRANSFERCOMMANDS[command])
+                term.Flush()
+
+            elif command == "device":
+                for number, device in enumerate(uarts, 1):
+                    marker = "*" if device is uart else " "
+                    term.Write("%s %d: %s\n"%(marker, number, device.devpath))
+                term.Flush()
+
+            elif command.startswith("device "):
+                name = command[len("device "):].strip()
+                for number, device in enumerate(uarts, 1):
+                    if name in (str(number), device.devpath, os.path.basename(device.devpath)):
+                        uart = device
+                        term.Write("Sending input to %s\n"%(uart.devpath))
+                        break
+                else:
+                    term.Write("Unknown device \"%s\"\n"%(name))
+                term.Flush()
+
+    return
+
 
-        # Send character to UART-Device
+
+def RunScript(path, uarts):
+    """
+    This function runs a Python script that automates the interaction with the UART devices.
+    The script gets the global variables ``sessions``, a list with one ``sterm.automation.Session`` for each device,
+    and ``session``, the session of the first device.
+    All data received while the script is running gets written to *stdout*.
+
+    .. code-block::
+
+        session.Expect("login: ", timeout=60)
+        session.SendLine("root")
+        session.Expect("# ")
+
+    Args:
+        path (str): Path to the script
+        uarts: List of instances of the ``UART`` class.
+
+    Returns:
+        The exit code of the script: ``0`` on success, ``1`` when an exception was raised,
+        or the code given to ``exit``.
+    """
+    import runpy
+    import traceback
+    from sterm.automation import Session
+
+    sessions = [Session(uart, output=sys.stdout.buffer) for uart in uarts]
+    try:
+        runpy.run_path(path, init_globals={"session": sessions[0], "sessions": sessions}, run_name="__main__")
+        exitcode = 0
+    except SystemExit as e:
+        if e.code is None or type(e.code) is int:
+            exitcode = e.code or 0
         else:
-            # In this mode, \n needs to be added manually to get a new line
-            if char == "\r":
-                char += "\n"
-            uart.Transmit(char)
+            print(e.code, file=sys.stderr)
+            exitcode = 1
+    except Exception as e:
+        traceback.print_exc()
+        exitcode = 1
+
+    for session in sessions:
+        session.Close()
+    return exitcode
+
+
+
+def PipeData(uart, stats=None, servers=(), triggers=None, reconnect=False):
+    """
+    This function connects a UART device with *stdin* and *stdout* for the use in pipelines (headless mode).
+    Received data gets written to *stdout* as raw bytes directly from the receive buffer (see ``UART.ReceiveInto``),
+    without decoding, line ending handling or frame based flushing.
+    All data of one wake up gets written with one ``write`` call to the file descriptor of *stdout*.
+    Data read from *stdin* gets transmitted to the device as it is, in blocks of up to ``PIPEREADSIZE`` bytes,
+    by a separate thread (see ``ForwardInput``), so that a paced or stopped transmission does not stall the reception.
+    There are no escape commands.
+
+    In *binary mode* and *hexdump mode* the formatted data gets written instead of the raw bytes.
+    The notices of ``triggers`` and about lost data (see ``DroppedNotice``) get written to *stderr*,
+    so that they do not get mixed into the data.
+
+    The function returns when the device got lost, *stdout* got closed (broken pipe)
+    or the user pressed Ctrl-C.
+    With ``reconnect``, a lost device gets reopened as soon as it reappears (see ``WatchDevice``).
+    When *stdin* reaches its end, the function keeps on receiving.
+
+    Args:
+        uart: Instance of the ``UART`` class.
+        stats: (Optional) Instance of the ``sterm.stats.Statistics`` class.
+        servers: (Optional) List of instances of the ``Server`` class.
+        triggers: (Optional) Dictionary with the ``sterm.trigger.Triggers`` instance of each UART device.
+        reconnect (bool): (Optional) Wait for a lost device to reappear. Default is ``False``
+
+    Returns:
+        *Nothing*
+    """
+    if stats is None:
+        stats = Statistics("receiver")
+    if triggers is None:
+        triggers = {}
+
+    def Notify(message):
+        print(message, file=sys.stderr)
+    reported = {}
+
+    stdinfd  = sys.stdin.fileno()
+    stdoutfd = sys.stdout.fileno()
+    sys.stdout.flush()
 
+    Thread(target=ForwardInput, args=(uart, stdinfd), name="ForwardInput", daemon=True).start()
+
+    selector = selectors.DefaultSelector()
+    selector.register(uart, selectors.EVENT_READ)
+    for server in servers:
+        server.Register(selector)
+
+    try:
+        while True:
+            events = selector.select()
+            stats.Count("wakeups")
+            stats.Observe("events_per_wakeup", len(events))
+
+            for key, mask in events:
+                if callable(key.data):
+                    key.data(mask)
+
+                else:
+                    data = ReceiveBytes(uart)
+                    if data is None:
+                        selector.unregister(uart)
+                        if reconnect and WatchDevice(selector, uart, None, Notify):
+                            Notify("[sterm: Connection to device %s lost, waiting for it to reappear]"%(uart.devpath))
+                            continue
+                        Notify("[sterm: Connection to device %s lost]"%(uart.devpath))
+                        return
+                    WriteBytes(stdoutfd, data)
+
+                    if uart in triggers:
+                        notices = triggers[uart].Notices()
+                        if notices:
+                            sys.stderr.write(notices)
+                            sys.stderr.flush()
+                    notice = DroppedNotice(uart, reported)
+                    if notice:
+                        sys.stderr.write(notice)
+                        sys.stderr.flush()
+    except (BrokenPipeError, KeyboardInterrupt):
+        pass
+    finally:
+        selector.close()
+
+
+
+def ForwardInput(uart, stdinfd):
+    """
+    This function transmits the data read from *stdin* to a UART device, until *stdin* reaches its end.
+    It runs in its own thread (see ``PipeData``), so *stdin* can be anything, also a regular file,
+    and ``UART.Transmit`` may block as long as the transmission takes.
+    The blocking provides backpressure: *stdin* gets only read when the previous block got transmitted.
+
+    Data that cannot be transmitted (for example while a lost device did not reappear yet)
+    gets discarded and counted as ``tx_errors`` in ``UART.stats``.
+
+    Args:
+        uart: Instance of the ``UART`` class.
+        stdinfd (int): File descriptor of *stdin*
+
+    Returns:
+        *Nothing*
+    """
+    for data in iter(lambda: os.read(stdinfd, PIPEREADSIZE), b""):
+        try:
+            uart.Transmit(data)
+        except OSError:
+            uart.stats.Count("tx_errors")
     return
 
 
 
-def main():
-    print("\n\033[1;31m --[ \033[1;34msterm \033[1;31m//\033[1;34m " + VERSION + "\033[1;31m ]-- \033[0m\n")
+def CaptureData(uart, idle, timeout=None, stats=None):
+    """
+    This function writes the data received from a UART device to *stdout*, until the device stays silent
+    for ``idle`` seconds, the ``timeout`` is reached or the device got lost (``--oneshot`` mode).
+    Like in ``PipeData``, the raw data gets written without decoding.
+    The local terminal is not touched and *stdin* is not read.
+
+    Args:
+        uart: Instance of the ``UART`` class.
+        idle (float): Seconds without received data after which the function returns.
+        timeout (float): (Optional) Maximum number of seconds the function runs. ``None`` for no limit.
+        stats: (Optional) Instance of the ``sterm.stats.Statistics`` class.
+
+    Returns:
+        *Nothing*
+    """
+    if stats is None:
+        stats = Statistics("receiver")
+
+    stdoutfd = sys.stdout.fileno()
+    sys.stdout.flush()
+    deadline = None if timeout is None else time.monotonic() + timeout
+
+    selector = selectors.DefaultSelector()
+    selector.register(uart, selectors.EVENT_READ)
+    try:
+        while True:
+            wait = idle
+            if deadline is not None:
+                wait = min(wait, deadline - time.monotonic())
+            if wait <= 0 or not selector.select(wait):
+                return
+            stats.Count("wakeups")
 
+            data = ReceiveBytes(uart)
+            if data is None:
+                print("[sterm: Connection to device %s lost]"%(uart.devpath), file=sys.stderr)
+                return
+            WriteBytes(stdoutfd, data)
+    except (BrokenPipeError, KeyboardInterrupt):
+        pass
+    finally:
+        selector.close()
+
+
+
+def ReceiveBytes(uart):
+    """
+    Reads the available data of a UART device for writing it to a pipe.
+    In *text mode*, this is the raw data (``UART.ReceiveInto``).
+    In *binary mode* and *hexdump mode*, this is the formatted data, UTF-8 encoded.
+
+    Returns:
+        A bytes-like object or ``None`` when no data is available (device lost).
+    """
+    if uart.uartmode == UARTMode.TEXT:
+        return uart.ReceiveInto()
+    string = uart.Receive()
+    return string.encode("utf-8") if string is not None else None
+
+
+
+def WriteBytes(fd, data):
+    """
+    Writes all data to a file descriptor, even if the operating system accepts only a part with one ``write`` call.
+
+    Returns:
+        *Nothing*
+    """
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+    return
+
+
+
+def RestoreTerminal(stdinfd, settings):
+    """
+    This function restores the settings of the local terminal, if they got changed.
+
+    Args:
+        stdinfd (int): File descriptor of *stdin*
+        settings: Settings returned by ``termios.tcgetattr``, or ``None`` when the settings did not get changed
+
+    Returns:
+        *Nothing*
+    """
+    if settings is not None:
+        termios.tcsetattr(stdinfd, termios.TCSADRAIN, settings)
+    return
+
+
+
+def Shutdown(args, uarts, servers, replay, statswriter, triggers):
+    """
+    This function closes the servers, the triggers and all UART devices, stops the replay and the statistics writer
+    and prints a summary of problems with the log files to *stderr*.
+
+    Returns:
+        *Nothing*
+    """
+    for server in servers:
+        server.Close()
+    for trigger in triggers.values():
+        trigger.Close()
+    for uart in uarts:
+        uart.Disconnect()
+    if replay:
+        replay.Stop()
+
+    if statswriter:
+        try:
+            statswriter.Close()
+        except OSError as e:
+            print("Writing statistics file %s failed with exception \"%s\""%(args.statsfile, str(e)), file=sys.stderr)
+
+    for uart in uarts:
+        logwriter = uart.logfile
+        if logwriter and logwriter.error:
+            print("Writing log file %s failed with exception \"%s\""%(logwriter.path, str(logwriter.error)), file=sys.stderr)
+        if logwriter and logwriter.dropped:
+            print("Log file %s is incomplete: %d chunks (%d bytes) got dropped because writing was too slow"%(
+                logwriter.path, logwriter.dropped, logwriter.droppedbytes), file=sys.stderr)
+        for path, error in logwriter.compresserrors if logwriter else []:
+            print("Compressing log file %s failed with exception \"%s\", it was kept uncompressed"%(path, str(error)), file=sys.stderr)
+        droppedbytes, overflows = uart.Dropped()
+        if droppedbytes:
+            print("Receive ring buffer of device %s overflowed %d times: %d bytes got lost"%(
+                uart.devpath, overflows, droppedbytes), file=sys.stderr)
+
+
+
+def main():
     # Handle command line arguments
+    cli        = CommandLineParser()
     args       = cli.parse_args()
+    if not args.script and not args.oneshot and not (sys.stdin.isatty() and sys.stdout.isatty()):
+        args.headless = True
+    if not args.script and not args.headless and not args.oneshot:
+        print("\n\033[1;31m --[ \033[1;34msterm \033[1;31m//\033[1;34m " + VERSION + "\033[1;31m ]-- \033[0m\n")
+    if args.script and args.listen:
+        cli.error("argument --listen: not allowed with --script")
+    if args.script and args.headless:
+        cli.error("argument --headless: not allowed with --script")
+    if args.headless and len(args.device) > 1:
+        cli.error("headless mode supports only one device")
+    if not args.device and not args.replay:
+        cli.error("the following arguments are required: device")
+    if args.device and args.replay:
+        cli.error("argument --replay: not allowed with device")
+    if args.oneshot and (args.script or args.headless):
+        cli.error("argument --oneshot: not allowed with --script or --headless")
+    if args.oneshot and len(args.device) > 1:
+        cli.error("argument --oneshot: supports only one device")
+    if args.oneshot and args.listen:
+        cli.error("argument --listen: not allowed with --oneshot")
+    definitions = []
+    if args.trigger:
+        from sterm.trigger import Triggers, ParseTrigger
+        try:
+            definitions = [ParseTrigger(definition) for definition in args.trigger]
+        except ValueError as e:
+            cli.error("argument --trigger: " + str(e))
     global ESCAPECHAR
     ESCAPECHAR = args.escape
 
-    if args.binary:
+    # A replayed log file does not come back once it ended
+    reconnect = not args.noreconnect and not args.replay
+
+    if args.frames:
+        from sterm.framing import ParseFraming
+        try:
+            ParseFraming(args.frames)
+        except ValueError as e:
+            cli.error("argument --frames: " + str(e))
+        if args.binary or args.hexdump:
+            cli.error("argument --frames: not allowed with --binary or --hexdump")
+
+    if args.frames:
+        uartmode = UARTMode.FRAMES
+    elif args.hexdump:
+        uartmode = UARTMode.HEXDUMP
+    elif args.binary:
         uartmode = UARTMode.BINARY
     else:
         uartmode = UARTMode.TEXT
 
-    # Setup local terminal
+    # Replay a log file through a pseudo terminal instead of a real device
+    replay = None
+    if args.replay:
+        from sterm.replay import Replay
+        try:
+            replay = Replay(args.replay, args.speed)
+        except Exception as e:
+            print("Replaying %s failed with exception \"%s\""%(args.replay, str(e)), file=sys.stderr)
+            exit(1)
+        args.device = [replay.devpath]
+
+    # Setup local terminal, not needed when a script controls the devices or in headless mode
     stdinfd          = sys.stdin.fileno()
-    oldstdinsettings = termios.tcgetattr(stdinfd)
-    tty.setraw(stdinfd) # from now on, end-line must be "\r\n"
+    oldstdinsettings = None
+    if not args.script and not args.headless and not args.oneshot:
+        oldstdinsettings = termios.tcgetattr(stdinfd)
+        tty.setraw(stdinfd) # from now on, end-line must be "\r\n"
 
-    # Open remote terminal device
-    try:
-        uart = UART(args.device, args.baudrate, args.format, uartmode=uartmode, logpath=args.write)
-    except Exception as e:
-        print("Connection to device %s failed with exception \"%s\""%(args.device, str(e)), file=sys.stderr)
-        termios.tcsetattr(stdinfd, termios.TCSADRAIN, oldstdinsettings)
-        exit(1)
+    # Open remote terminal devices
+    uarts = []
+    for devpath in args.device:
+        logpath = args.write
+        if logpath and len(args.device) > 1:
+            logpath = DeviceLogPath(logpath, devpath)
+
+        try:
+            uart = UART(devpath, args.baudrate, args.format, uartmode=uartmode,
+                logpath         = logpath,
+                logmaxsize      = args.logsize,
+                loginterval     = args.loginterval,
+                logcompression  = args.logcompress,
+                logformat       = args.logformat,
+                decodeerrors    = args.decodeerrors,
+                txpace          = args.pace,
+                txlinedelay     = args.linedelay / 1000 if args.linedelay else None,
+                framing         = args.frames or "slip",
+                framecrc        = args.framecrc,
+                rtscts          = args.rtscts,
+                xonxoff         = args.xonxoff,
+                readersize      = args.readerprocess)
+        except Exception as e:
+            print("Connection to device %s failed with exception \"%s\""%(devpath, str(e)), file=sys.stderr)
+            for uart in uarts:
+                uart.Disconnect()
+            if replay:
+                replay.Stop()
+            RestoreTerminal(stdinfd, oldstdinsettings)
+            exit(1)
+        uarts.append(uart)
+
+    # Start the server for network clients
+    servers = []
+    if args.listen:
+        from sterm.server import Server
+        try:
+            host, port = args.listen.rsplit(":", 1)
+            servers.append(Server((host, int(port)), uarts[0], readonly=args.readonly))
+        except Exception as e:
+            print("Listening on %s failed with exception \"%s\""%(args.listen, str(e)), file=sys.stderr)
+            for uart in uarts:
+                uart.Disconnect()
+            if replay:
+                replay.Stop()
+            RestoreTerminal(stdinfd, oldstdinsettings)
+            exit(1)
+
+    # Keep the last received data of each device in memory
+    scrollbacks = {}
+    if args.scrollback:
+        from sterm.scrollback import Scrollback
+        for uart in uarts:
+            scrollbacks[uart] = Scrollback(args.scrollback)
+            uart.AddListener(scrollbacks[uart].Write)
+
+    # Watch the received data for trigger patterns
+    triggers = {}
+    if definitions:
+        for uart in uarts:
+            triggers[uart] = Triggers(uart, definitions)
+            uart.AddListener(triggers[uart].Scan)
+
+    # Collect the statistics of all components
+    receiverstats = Statistics("receiver")
+    statistics    = [receiverstats]
+    for uart in uarts:
+        statistics.append(uart.stats)
+        if uart.logfile:
+            statistics.append(uart.logfile.stats)
+
+    statswriter = None
+    if args.statsfile:
+        statswriter = StatsWriter(args.statsfile, statistics, args.statsinterval)
+
+    if args.script:
+        if replay:
+            replay.Start()
+        exitcode = RunScript(args.script, uarts)
+        Shutdown(args, uarts, servers, replay, statswriter, triggers)
+        exit(exitcode)
+
+    if args.headless:
+        if replay:
+            replay.Start()
+        PipeData(uarts[0], receiverstats, servers, triggers, reconnect)
+        Shutdown(args, uarts, servers, replay, statswriter, triggers)
+        return
+
+    if args.oneshot:
+        if replay:
+            replay.Start()
+        CaptureData(uarts[0], args.idle, args.timeout, receiverstats)
+        Shutdown(args, uarts, servers, replay, statswriter, triggers)
+        return
 
     term = Terminal(echo= not args.noecho, escape=args.escape)
+    statistics.insert(1, term.stats)
+
+    # Summarize output floods instead of letting the terminal fall behind
+    governor = None
+    if not args.nothrottle:
+        from sterm.governor import RenderGovernor
+        governor = RenderGovernor(term)
+        statistics.insert(2, governor.stats)
 
     # Start receiver thread
-    ReceiverThread = Thread(target=ReceiveData, args=(uart, term))
+    shutdownread, shutdownwrite = os.pipe()
+    ReceiverThread = Thread(target=ReceiveData, args=(uarts, term, shutdownread, servers, receiverstats, triggers, reconnect, governor))
     ReceiverThread.start()
+    if replay:
+        replay.Start()
 
     # this is the main loop of this software
+    error = None
     try:
-        HandleUserInput(uart, term);
+        HandleUserInput(uarts, term, statistics, scrollbacks);
     except Exception as e:
-        print("sterm exits after following error occurred: \"%s\""%(args.device, str(e)), file=sys.stderr)
-        termios.tcsetattr(stdinfd, termios.TCSADRAIN, oldstdinsettings)
-        exit(1)
+        error = e   # Shut down as usual, so that the queued log data gets written
 
     # Shutdown receiver thread
-    global ShutdownReceiver
-    ShutdownReceiver = True
+    os.write(shutdownwrite, b"\0")
     if ReceiverThread.is_alive():
         ReceiverThread.join()
+    os.close(shutdownread)
+    os.close(shutdownwrite)
 
-    # Clean up everything
-    uart.Disconnect()
-    termios.tcsetattr(stdinfd, termios.TCSADRAIN, oldstdinsettings)
+    RestoreTerminal(stdinfd, oldstdinsettings)
+    if error is not None:
+        print("sterm exits after following error occurred: \"%s\""%(str(error)), file=sys.stderr)
+    Shutdown(args, uarts, servers, replay, statswriter, triggers)
+    if error is not None:
+        exit(1)
 
 
 if __name__ == '__main__':
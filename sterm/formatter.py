@@ -0,0 +1,200 @@
+# STERM, a serial communication terminal                                 #
+# Copyright (C) 2013-2023  Ralf Stemmer (ralf.stemmer@gmx.net)           #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
+
+import codecs
+import threading
+
+
+# Translation table for the ASCII column of the hexdump.
+# Printable ASCII characters stay as they are, all other bytes become a dot.
+ASCIITABLE = bytes(b if 0x20 <= b < 0x7F else ord(".") for b in range(256))
+
+
+# Number of invalid bytes seen by the error handlers below, counted per thread.
+# The TextFormatter compares the value before and after decoding a chunk.
+INVALIDBYTES = threading.local()
+
+
+
+def EscapeDecodeError(error):
+    """
+    Error handler for the codecs module that replaces each invalid byte by one ``"[0xNN]"`` marker.
+    It gets registered as ``"sterm-escape"``.
+    """
+    invalid = error.object[error.start:error.end]
+    INVALIDBYTES.count = getattr(INVALIDBYTES, "count", 0) + len(invalid)
+    return ("".join(["[0x%02x]"%(byte) for byte in invalid]), error.end)
+
+
+
+def CountingDecodeError(handler):
+    """
+    Wraps an error handler of the codecs module so that the invalid bytes get counted.
+    """
+    def Handler(error):
+        INVALIDBYTES.count = getattr(INVALIDBYTES, "count", 0) + error.end - error.start
+        return handler(error)
+    return Handler
+
+codecs.register_error("sterm-escape",      EscapeDecodeError)
+codecs.register_error("sterm-replace",     CountingDecodeError(codecs.replace_errors))
+codecs.register_error("sterm-passthrough", CountingDecodeError(codecs.lookup_error("surrogateescape")))
+
+# Mapping the decode error policies (--decodeerrors) to the codecs error handlers.
+DECODEERRORS = {}
+DECODEERRORS["replace"]     = "sterm-replace"       # U+FFFD replacement character
+DECODEERRORS["escape"]      = "sterm-escape"        # [0xNN] marker for each invalid byte
+DECODEERRORS["passthrough"] = "sterm-passthrough"   # Invalid bytes get written unchanged (surrogateescape)
+
+
+
+class TextFormatter(object):
+    """
+    This class decodes UTF-8 encoded text.
+
+    The decoder is incremental.
+    When a multi-byte character is split over two chunks, the first part gets hold back
+    until the rest of the character arrives with the next call of ``Format``.
+
+    The ``errors`` argument defines how invalid bytes get handled:
+
+        * ``"replace"``: Each invalid sequence becomes the replacement character ``"�"``
+        * ``"escape"``: Each invalid byte becomes a marker like ``"[0xff]"``
+        * ``"passthrough"``: Invalid bytes get passed unchanged to the terminal and the log file.
+          They are represented as surrogates (``"surrogateescape"`` error handler),
+          so the receiver of the string must encode it with ``errors="surrogateescape"``.
+
+    The number of invalid bytes gets counted in ``invalidbytes``.
+
+    Args:
+        errors (str): Policy how to handle invalid bytes. Default is ``"escape"``
+
+    Raises:
+        ValueError: When ``errors`` is not one of the policies listed above
+    """
+    def __init__(self, errors="escape"):
+        if errors not in DECODEERRORS:
+            raise ValueError("Unknown decode error policy \"%s\"! Valid policies are: %s"%(errors, ", ".join(DECODEERRORS)))
+
+        self.errors  = errors
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors=DECODEERRORS[errors])
+        self.invalidbytes = 0
+
+
+
+    def Format(self, data):
+        """
+        Decodes a chunk of UTF-8 encoded data.
+
+        Args:
+            data (bytes): The data to decode
+
+        Returns:
+            A string with all complete characters of ``data`` and previous incomplete characters.
+        """
+        before = getattr(INVALIDBYTES, "count", 0)
+        string = self.decoder.decode(data)
+        self.invalidbytes += getattr(INVALIDBYTES, "count", 0) - before
+        return string
+
+
+
+    def Flush(self):
+        """
+        Returns the incomplete characters that are still hold back.
+        This method should be called when no more data is expected.
+        Incomplete characters are handled like invalid bytes.
+
+        Returns:
+            A string, usually empty.
+        """
+        before = getattr(INVALIDBYTES, "count", 0)
+        string = self.decoder.decode(b"", final=True)
+        self.invalidbytes += getattr(INVALIDBYTES, "count", 0) - before
+        return string
+
+
+
+class HexFormatter(object):
+    """
+    This class renders binary data as one byte hexadecimal numbers with ``0x`` prefix,
+    space separated and a space at the end of the byte stream.
+    So when formatting the two bytes ``23``, ``42`` the output is ``"0x23 0x42 "``.
+
+    The whole chunk gets formatted in one pass by ``bytes.hex`` and one ``str.replace``.
+    There is no per-byte work done in Python.
+    """
+    def Format(self, data):
+        """
+        Formats a chunk of binary data.
+
+        Args:
+            data (bytes): The data to format
+
+        Returns:
+            A string with the formatted data. An empty string when ``data`` is empty.
+        """
+        if not data:
+            return ""
+        return "0x" + data.hex(" ").replace(" ", " 0x") + " "
+
+
+
+class HexdumpFormatter(object):
+    """
+    This class renders binary data in the classic hexdump layout (like ``hexdump -C``)
+    with offsets, 16 bytes per line and an ASCII column.
+
+    .. code-block:: none
+
+        00000000  48 65 6c 6c 6f 20 57 6f  72 6c 64 0a              |Hello World.|
+
+    The offset continues over multiple calls of ``Format``.
+    To not delay the output, the last line of a chunk gets printed even if it has less than 16 bytes.
+    The next chunk then starts with a new line.
+    The data gets formatted line by line, not byte by byte.
+    """
+    def __init__(self):
+        self.offset = 0
+
+
+
+    def Format(self, data):
+        """
+        Formats a chunk of binary data.
+
+        Args:
+            data (bytes): The data to format
+
+        Returns:
+            A string with one or more complete lines (including ``"\\n"``). An empty string when ``data`` is empty.
+        """
+        lines  = []
+        offset = self.offset
+        for i in range(0, len(data), 16):
+            row = bytes(data[i:i+16])
+            lines.append("%08x  %-23s  %-23s  |%s|\n"%(
+                offset + i,
+                row[:8].hex(" "),
+                row[8:].hex(" "),
+                row.translate(ASCIITABLE).decode("ascii")))
+
+        self.offset += len(data)
+        return "".join(lines)
+
+
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
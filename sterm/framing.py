@@ -0,0 +1,332 @@
+# STERM, a serial communication terminal with server capabilities        #
+# Copyright (C) 2013-2023  Ralf Stemmer (ralf.stemmer@gmx.net)           #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
+
+import re
+import time
+import zlib
+import codecs
+import binascii
+
+
+# Maximum size of a frame in bytes.
+# When more data arrives without completing a frame, the data gets discarded and counted as error.
+MAXFRAMESIZE = 64*1024
+
+# SLIP control bytes (RFC 1055)
+SLIPEND    = 0xC0
+SLIPESC    = 0xDB
+SLIPESCEND = 0xDC
+SLIPESCESC = 0xDD
+
+# Mapping the CRC names (--framecrc) to the size of the CRC in bytes, its byte order and the function calculating it.
+# The CRC is expected in the last bytes of a frame and covers all bytes in front of it.
+CRCS = {}
+CRCS["crc16"]        = (2, "big",    lambda data: binascii.crc_hqx(data, 0xFFFF))  # CRC-16/CCITT-FALSE
+CRCS["crc16-xmodem"] = (2, "big",    lambda data: binascii.crc_hqx(data, 0))       # CRC-16/XMODEM
+CRCS["crc32"]        = (4, "little", zlib.crc32)                                    # CRC-32 as used by Ethernet and zlib
+
+
+class FrameDecoder(object):
+    """
+    Base class of the incremental frame decoders.
+    A decoder gets fed with the received chunks and returns all frames that got completed by a chunk.
+    Frames can be split over any number of chunks.
+    The chunks can be ``bytes``, ``bytearray`` or ``memoryview`` objects.
+
+    Decoders for frames that end with a delimiter only need to implement the ``Decode`` hook,
+    see ``DelimiterDecoder``.
+
+    The number of invalid frames and discarded oversized frames gets counted in ``errors``.
+    """
+    def __init__(self):
+        self.buffer = bytearray()
+        self.errors = 0
+
+
+
+    def Feed(self, data):
+        """
+        Args:
+            data (bytes): A chunk of received data
+
+        Returns:
+            A list of the complete frames (``bytes``). An empty list when no frame got completed.
+        """
+        raise NotImplementedError()
+
+
+
+class DelimiterDecoder(FrameDecoder):
+    """
+    This decoder splits the data at a delimiter (like ``b"\\n"``).
+    The delimiter is not part of the frames. Empty frames get skipped.
+
+    The received data gets searched with ``bytearray.find``, so there is no per-byte work done in Python.
+
+    Args:
+        delimiter (bytes): The byte sequence that ends a frame
+    """
+    def __init__(self, delimiter):
+        super().__init__()
+        if not delimiter:
+            raise ValueError("Frame delimiter must not be empty!")
+        self.delimiter = bytes(delimiter)
+
+
+
+    def Feed(self, data):
+        buffer  = self.buffer
+        scanned = max(0, len(buffer) - len(self.delimiter) + 1)
+        buffer += data
+
+        frames = []
+        start  = 0
+        while True:
+            end = buffer.find(self.delimiter, scanned)
+            if end < 0:
+                break
+            if end > start:
+                frame = self.Decode(bytes(buffer[start:end]))
+                if frame is None:
+                    self.errors += 1
+                else:
+                    frames.append(frame)
+            start   = end + len(self.delimiter)
+            scanned = start
+        del buffer[:start]
+
+        if len(buffer) > MAXFRAMESIZE:
+            buffer.clear()
+            self.errors += 1
+        return frames
+
+
+
+    def Decode(self, frame):
+        """
+        Hook for decoders that encode the content of the frames.
+
+        Args:
+            frame (bytes): The data between two delimiters, without the delimiters
+
+        Returns:
+            The decoded frame, or ``None`` when the frame is invalid
+        """
+        return frame
+
+
+
+class SLIPDecoder(DelimiterDecoder):
+    """
+    This decoder handles frames of the Serial Line Internet Protocol (RFC 1055).
+    Frames end with ``0xC0``. Inside a frame, ``0xDB 0xDC`` stands for ``0xC0`` and ``0xDB 0xDD`` for ``0xDB``.
+    Frames with other escape sequences are invalid.
+    """
+    def __init__(self):
+        super().__init__(bytes([SLIPEND]))
+        self.invalid = re.compile(bytes([SLIPESC]) + b"(?![" + bytes([SLIPESCEND, SLIPESCESC]) + b"])")
+
+
+
+    def Decode(self, frame):
+        if SLIPESC not in frame:
+            return frame
+        if self.invalid.search(frame):
+            return None
+        frame = frame.replace(bytes([SLIPESC, SLIPESCEND]), bytes([SLIPEND]))
+        return frame.replace(bytes([SLIPESC, SLIPESCESC]), bytes([SLIPESC]))
+
+
+
+class COBSDecoder(DelimiterDecoder):
+    """
+    This decoder handles frames with Consistent Overhead Byte Stuffing.
+    Frames end with ``0x00``.
+    Inside a frame, each code byte gives the distance to the next code byte,
+    the position of a code byte below ``0xFF`` stands for a ``0x00``.
+    The frame gets decoded block by block, not byte by byte.
+    """
+    def __init__(self):
+        super().__init__(b"\x00")
+
+
+
+    def Decode(self, frame):
+        decoded  = bytearray()
+        position = 0
+        while position < len(frame):
+            code = frame[position]
+            end  = position + code
+            if end > len(frame):
+                return None
+            decoded += frame[position+1:end]
+            position = end
+            if code < 0xFF and position < len(frame):
+                decoded.append(0)
+        return bytes(decoded)
+
+
+
+class LengthDecoder(FrameDecoder):
+    """
+    This decoder handles frames that start with their length.
+    The length field has ``size`` bytes and does not count itself.
+    It is not part of the returned frames.
+
+    Length prefixed framing cannot resynchronize after an error.
+    When a length is larger than ``MAXFRAMESIZE``, all buffered data gets discarded.
+
+    Args:
+        size (int): Size of the length field in bytes: 1, 2 or 4. Default is 2
+        byteorder (str): ``"big"`` (default) or ``"little"``
+
+    Raises:
+        ValueError: When size or byte order are invalid
+    """
+    def __init__(self, size=2, byteorder="big"):
+        super().__init__()
+        if size not in (1, 2, 4):
+            raise ValueError("Size of the length field must be 1, 2 or 4!")
+        if byteorder not in ("big", "little"):
+            raise ValueError("Byte order must be big or little!")
+        self.size      = size
+        self.byteorder = byteorder
+
+
+
+    def Feed(self, data):
+        buffer  = self.buffer
+        buffer += data
+
+        frames   = []
+        position = 0
+        while len(buffer) - position >= self.size:
+            length = int.from_bytes(buffer[position:position+self.size], self.byteorder)
+            if length > MAXFRAMESIZE:
+                self.errors += 1
+                position = len(buffer)
+                break
+            end = position + self.size + length
+            if end > len(buffer):
+                break
+            frames.append(bytes(buffer[position+self.size:end]))
+            position = end
+        del buffer[:position]
+        return frames
+
+
+
+def ParseFraming(definition):
+    r"""
+    This function creates a frame decoder from a definition string (``--frames``).
+
+        * ``slip``: SLIP frames (``SLIPDecoder``)
+        * ``cobs``: COBS frames (``COBSDecoder``)
+        * ``length[:SIZE[:ORDER]]``: Length prefixed frames with a length field of *SIZE* bytes (1, 2, 4; default 2)
+          in *ORDER* ``big`` (default) or ``little`` endian (``LengthDecoder``)
+        * ``delimiter:SEQUENCE``: Frames ending with *SEQUENCE*.
+          Escape sequences like ``\n`` or ``\x00`` can be used (``DelimiterDecoder``)
+
+    Args:
+        definition (str): The framing definition
+
+    Returns:
+        An instance of a ``FrameDecoder`` subclass
+
+    Raises:
+        ValueError: When the definition is invalid
+    """
+    name, _, argument = definition.partition(":")
+    if name == "slip" and not argument:
+        return SLIPDecoder()
+    if name == "cobs" and not argument:
+        return COBSDecoder()
+    if name == "delimiter" and argument:
+        return DelimiterDecoder(codecs.escape_decode(argument.encode("utf-8"))[0])
+    if name == "length":
+        size, _, byteorder = argument.partition(":")
+        try:
+            return LengthDecoder(int(size) if size else 2, byteorder or "big")
+        except ValueError as e:
+            raise ValueError("Invalid framing \"%s\"! %s"%(definition, str(e)))
+    raise ValueError("Invalid framing \"%s\"! Expected slip, cobs, length[:SIZE[:big|little]] or delimiter:SEQUENCE"%(definition))
+
+
+
+class FrameFormatter(object):
+    """
+    This class renders the frames found by a ``FrameDecoder`` in the received data.
+    Each frame becomes one line with the time the frame got completed, its length and its content in hexadecimal:
+
+    .. code-block:: none
+
+        [14:03:27.512]    5: 01 02 03 04 05
+        [14:03:27.519]    7: 01 02 03 04 05 8b 3a CRC error
+
+    When ``crc`` is given, the last bytes of each frame are expected to be a CRC over the rest of the frame
+    (see ``CRCS``). Frames with wrong CRC get marked. Frames shorter than the CRC count as CRC errors.
+
+    It can be used as formatter of the ``UART`` class (``UARTMode.FRAMES``).
+    The number of frames and the number of CRC errors get counted in ``frames`` and ``crcerrors``.
+
+    Args:
+        decoder: Instance of a ``FrameDecoder`` subclass
+        crc (str): (Optional) Name of the CRC in ``CRCS``
+
+    Raises:
+        ValueError: When the CRC is unknown
+    """
+    def __init__(self, decoder, crc=None):
+        if crc is not None and crc not in CRCS:
+            raise ValueError("Unknown CRC \"%s\"! Valid CRCs are: %s"%(crc, ", ".join(CRCS)))
+        self.decoder   = decoder
+        self.crc       = CRCS[crc] if crc else None
+        self.frames    = 0
+        self.crcerrors = 0
+
+
+
+    def Format(self, data):
+        """
+        Feeds a chunk of data into the decoder and formats all completed frames.
+
+        Args:
+            data (bytes): The received data
+
+        Returns:
+            A string with one line per completed frame. An empty string when no frame got completed.
+        """
+        frames = self.decoder.Feed(data)
+        if not frames:
+            return ""
+
+        now   = time.time()
+        stamp = time.strftime("%H:%M:%S", time.localtime(now)) + ".%03d"%(int(now * 1000) % 1000)
+        lines = []
+        for frame in frames:
+            status = ""
+            if self.crc:
+                size, byteorder, function = self.crc
+                if len(frame) < size or function(frame[:-size]) != int.from_bytes(frame[-size:], byteorder):
+                    status = " CRC error"
+                    self.crcerrors += 1
+            lines.append("[%s] %4d: %s%s\n"%(stamp, len(frame), frame.hex(" "), status))
+        self.frames += len(frames)
+        return "".join(lines)
+
+
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,222 @@
+# STERM, a serial communication terminal with server capabilities        #
+# Copyright (C) 2013-2023  Ralf Stemmer (ralf.stemmer@gmx.net)           #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
+
+import time
+from sterm.terminal import LINEBREAK
+from sterm.stats    import Statistics
+
+
+# Length of the measurement window in seconds
+WINDOW = 0.25
+
+# Fraction of the wall time spent in rendering that counts as overload
+OVERLOAD = 0.5
+
+# Rendering resumes when the output rate drops below this fraction of the measured render throughput
+# for RESUMEWINDOWS windows in a row
+RESUMELOAD    = 0.5
+RESUMEWINDOWS = 2
+
+# Seconds between two summaries while output gets skipped
+SNAPSHOTINTERVAL = 1.0
+
+# Number of characters kept of the skipped output of each source, and the number of lines shown of it
+TAILSIZE  = 4096
+TAILLINES = 5
+
+# Resets colors and other attributes (SGR), because skipping can cut an ANSI escape sequence in half
+RESET = "\033[0m"
+
+
+class RenderGovernor(object):
+    """
+    This class sits between the receive loop and ``Terminal.Write`` and protects the terminal from output floods.
+
+    It measures how much of the wall time gets spent in rendering (``Terminal.Write`` and ``Terminal.Flush``,
+    which block while the terminal emulator is behind) and, while the terminal is the bottleneck,
+    the render throughput in characters per second.
+    When more than ``OVERLOAD`` of a measurement window (``WINDOW``) got spent in rendering,
+    the output gets skipped instead of rendered.
+    While skipping, a summary like ``[sterm: … 1.2 M characters skipped …]`` followed by the last ``TAILLINES`` lines
+    of the skipped output gets rendered every ``SNAPSHOTINTERVAL`` seconds.
+    When the output rate stays below ``RESUMELOAD`` of the measured render throughput for ``RESUMEWINDOWS`` windows,
+    a last summary gets rendered and full rendering resumes.
+    Skipping starts and ends at arbitrary positions, even inside ANSI escape sequences.
+    So the attributes of the terminal get reset in front of each notice and behind each tail,
+    and the tail starts behind its first line break.
+
+    Only the rendering gets skipped.
+    The log file, the listeners (like the scrollback buffer and triggers) and the network clients
+    still get all data, because they get served by ``UART.Receive`` before the data reaches the governor.
+    Because the receive loop spends little time in rendering while skipping,
+    it does not hold the lock of the terminal for long, so the echo of interactive input stays responsive.
+
+    It has the output methods of the ``Terminal`` class that are used by the receive loop
+    (``Write``, ``Flush`` and ``FlushTimeout``), so it can be used in place of the terminal.
+    ``FlushTimeout`` includes the time until the next summary is due, so ``Flush`` must be called on timeout.
+
+    The number of overloads, the skipped characters and the current state get tracked in ``stats``.
+
+    Args:
+        term: Instance of the ``Terminal`` class.
+    """
+    def __init__(self, term):
+        self.term       = term
+        self.skipping   = False
+        self.capacity   = None  # Measured render throughput in characters per second of render time
+        self.calm       = 0     # Number of windows in a row with an output rate below the resume threshold
+        self.skipped    = {}    # Number of skipped characters and the tail of the skipped output of each prefix
+        self.snapshot   = 0.0   # Time of the next summary
+
+        self.windowstart = time.monotonic()
+        self.received    = 0    # Characters passed to Write in the current window
+        self.rendered    = 0    # Characters rendered in the current window
+        self.rendertime  = 0.0  # Seconds spent in rendering in the current window
+
+        self.stats = Statistics("governor")
+        self.stats.AddGauge("skipping", lambda: int(self.skipping))
+
+
+
+    def Write(self, string, prefix=None):
+        """
+        Renders the string by ``Terminal.Write``, or skips it while the terminal is overloaded.
+
+        Args:
+            string (str): The string to write
+            prefix (str): (Optional) Prefix for each line of the string, see ``Terminal.Write``
+
+        Returns:
+            *Nothing*
+        """
+        self.received += len(string)
+        if self.skipping:
+            count, tail = self.skipped.get(prefix, (0, ""))
+            self.skipped[prefix] = (count + len(string), (tail + string[-TAILSIZE:])[-TAILSIZE:])
+            self.stats.Count("skipped_chars", len(string))
+        else:
+            start = time.perf_counter()
+            self.term.Write(string, prefix)
+            self.rendertime += time.perf_counter() - start
+            self.rendered   += len(string)
+        self.__Update()
+        return
+
+
+
+    def Flush(self):
+        """
+        Writes all buffered output to *stdout* and renders the summary of the skipped output when it is due.
+
+        Returns:
+            *Nothing*
+        """
+        start = time.perf_counter()
+        self.term.Flush()
+        self.rendertime += time.perf_counter() - start
+        self.__Update()
+        return
+
+
+
+    def FlushTimeout(self):
+        """
+        Returns:
+            The time in seconds until ``Flush`` must be called, or ``None`` if there is nothing to do.
+            See ``Terminal.FlushTimeout``.
+        """
+        timeout = self.term.FlushTimeout()
+        if self.skipping:
+            due = max(0, min(self.snapshot, self.windowstart + WINDOW) - time.monotonic())
+            timeout = due if timeout is None else min(timeout, due)
+        return timeout
+
+
+
+    def __Update(self):
+        """
+        Renders the summary when it is due and evaluates the measurement window when it is over.
+        """
+        now = time.monotonic()
+        if self.skipping and now >= self.snapshot:
+            self.__Summary()
+            self.snapshot = now + SNAPSHOTINTERVAL
+
+        elapsed = now - self.windowstart
+        if elapsed < WINDOW:
+            return
+
+        load = self.rendertime / elapsed
+        rate = self.received / elapsed
+
+        # The throughput is only meaningful when the terminal was the bottleneck.
+        # Otherwise rendering just fills buffers and looks much faster than the terminal is.
+        if load > OVERLOAD and self.rendered:
+            throughput    = self.rendered / self.rendertime
+            self.capacity = throughput if self.capacity is None else (self.capacity + throughput) / 2
+
+        if not self.skipping and load > OVERLOAD:
+            self.skipping = True
+            self.calm     = 0
+            self.snapshot = now + SNAPSHOTINTERVAL
+            self.stats.Count("overloads")
+            self.__Notice("[sterm: output is too fast for the terminal, skipping it (the log file gets everything)]")
+        elif self.skipping:
+            if self.capacity is None or rate < self.capacity * RESUMELOAD:
+                self.calm += 1
+            else:
+                self.calm = 0
+            if self.calm >= RESUMEWINDOWS:
+                self.__Summary()
+                self.skipping = False
+
+        self.windowstart = now
+        self.received    = 0
+        self.rendered    = 0
+        self.rendertime  = 0.0
+        return
+
+
+
+    def __Summary(self):
+        """
+        Renders the number of skipped characters and the last lines of the skipped output of each source.
+        """
+        for prefix, (count, tail) in self.skipped.items():
+            # The formatted output gets counted, so these are characters, not received bytes
+            if count >= 1000*1000:
+                size = "%.1f M characters"%(count / (1000*1000))
+            elif count >= 1000:
+                size = "%.1f k characters"%(count / 1000)
+            else:
+                size = "%d characters"%(count)
+            self.__Notice("[sterm: … %s skipped …]"%(size), prefix)
+            lines = LINEBREAK.split(tail.rstrip("\r\n"))[1:]  # The first line may start inside an escape sequence
+            if lines:
+                self.term.Write("\n".join(lines[-TAILLINES:]) + RESET + "\n", prefix)
+        self.skipped = {}
+        self.term.Flush()
+        return
+
+
+
+    def __Notice(self, message, prefix=None):
+        self.term.Write(RESET + ("" if self.term.linestart else "\n") + "\033[1m" + message + RESET + "\n", prefix)
+        return
+
+
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,178 @@
+# STERM, a serial communication terminal with server capabilities        #
+# Copyright (C) 2013-2023  Ralf Stemmer (ralf.stemmer@gmx.net)           #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
+
+import os
+import ctypes
+import struct
+from errno import ENOENT
+
+
+# inotify flags and event masks (see inotify(7))
+IN_NONBLOCK    = 0o4000
+IN_CLOEXEC     = 0o2000000
+IN_ATTRIB      = 0x00000004
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_DELETE      = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF   = 0x00000800
+IN_ONLYDIR     = 0x01000000
+
+# Events that can make the device node appear or become accessible.
+# IN_ATTRIB is needed because udev sets the permissions of a new node after it got created.
+WATCHMASK = IN_CREATE | IN_MOVED_TO | IN_ATTRIB | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+
+# Header of an inotify event: watch descriptor, mask, cookie and length of the name
+EVENTHEADER = struct.Struct("iIII")
+
+
+class DeviceWatcher(object):
+    """
+    This class waits for a device node (like ``/dev/ttyUSB0``) to appear, without polling.
+
+    The directory of the device gets watched with *inotify*.
+    When that directory does not exist (like ``/dev/serial/by-id`` while no adapter is plugged in),
+    the nearest existing parent directory gets watched and the watch moves down as the directories get created.
+
+    An instance can be registered at a selector (it has a ``fileno`` method).
+    When it becomes readable, ``Read`` must be called.
+
+    .. code-block::
+
+        watcher = DeviceWatcher("/dev/ttyUSB0")
+        while not watcher.Read():
+            select.select([watcher], [], [])
+        watcher.Close()
+        uart.Reconnect()
+
+    Args:
+        devpath (str): Path to the device node
+
+    Raises:
+        OSError: When inotify is not available (it is only supported on Linux) or the directory cannot be watched
+    """
+    def __init__(self, devpath):
+        self.devpath   = os.path.abspath(devpath)
+        self.directory = None
+        self.watch     = None
+
+        try:
+            self.libc = ctypes.CDLL(None, use_errno=True)
+            self.libc.inotify_init1
+        except (OSError, AttributeError):
+            raise OSError("inotify is not available on this system")
+
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+        try:
+            self.__Arm()
+        except OSError:
+            os.close(self.fd)
+            raise
+
+
+
+    def fileno(self):
+        """
+        Returns:
+            The file descriptor of the inotify instance. It becomes readable when the watched directory changed.
+        """
+        return self.fd
+
+
+
+    def Present(self):
+        """
+        Returns:
+            ``True`` when the device node exists
+        """
+        return os.path.exists(self.devpath)
+
+
+
+    def Read(self):
+        """
+        This method consumes all pending events and follows created or removed directories on the path of the device.
+        It does not block.
+
+        Returns:
+            ``True`` when the device node exists
+        """
+        rearm = False
+        while True:
+            try:
+                data = os.read(self.fd, 4096)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                watch, mask, cookie, length = EVENTHEADER.unpack_from(data, offset)
+                offset += EVENTHEADER.size + length
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    self.directory = None   # The watch is gone, the directory must be watched again
+                if mask & (IN_CREATE | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF):
+                    rearm = True
+
+        if rearm:
+            self.__Arm()
+        return self.Present()
+
+
+
+    def Close(self):
+        """
+        Stops watching and closes the file descriptor.
+
+        Returns:
+            *Nothing*
+        """
+        os.close(self.fd)
+        return
+
+
+
+    def __Arm(self):
+        """
+        Watches the directory of the device node, or its nearest existing parent directory.
+        """
+        while True:
+            directory = os.path.dirname(self.devpath)
+            while not os.path.isdir(directory):
+                directory = os.path.dirname(directory)
+            if directory == self.directory:
+                return
+
+            if self.watch is not None:
+                self.libc.inotify_rm_watch(self.fd, self.watch) # Fails when the directory got removed, that is fine
+                self.watch = None
+            watch = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCHMASK)
+            if watch >= 0:
+                break
+            errno = ctypes.get_errno()
+            if errno != ENOENT:
+                raise OSError(errno, os.strerror(errno), directory)
+            # The directory got removed in the meantime, try its parent
+
+        self.watch     = watch
+        self.directory = directory
+        return
+
+
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
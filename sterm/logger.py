@@ -0,0 +1,335 @@
+# STERM, a serial communication terminal                                 #
+# Copyright (C) 2013-2023  Ralf Stemmer (ralf.stemmer@gmx.net)           #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
+
+import os
+import time
+import queue
+import importlib
+from threading   import Thread, Lock
+from sterm.stats import Statistics
+
+
+# Mapping the compression names (--logcompress) to the module providing an open function for compressed files.
+# The modules get imported when the first file gets compressed. The name is also used as file extension.
+COMPRESSORS = {}
+COMPRESSORS["gz"] = "gzip"
+COMPRESSORS["xz"] = "lzma"
+
+# Maximum number of queued chunks that get written with one write call
+BATCHSIZE = 256
+
+# Default maximum number of bytes waiting in the queue of the writer thread
+QUEUESIZE = 16*1024*1024
+
+
+class LogWriter(object):
+    """
+    This class writes data into a log file from a separate thread.
+
+    The ``Write`` method only puts the data into a queue and never blocks.
+    A writer thread takes all queued chunks at once and writes them with a single write call.
+    So a slow disk or a stalled network file system does not delay reading from the UART device.
+    The queue is bounded by the number of queued bytes (``queuesize``), so its memory usage is bounded
+    independent of the size of the chunks.
+    When the queue is full, the chunk gets dropped and counted in ``dropped`` and ``droppedbytes``.
+    The highest number of queued chunks and bytes gets tracked in ``highwater`` and ``highwaterbytes``.
+    How long chunks wait in the queue and how long writing a batch takes gets tracked in ``stats``.
+
+    Strings get UTF-8 encoded by the writer thread (with ``errors="surrogateescape"``),
+    bytes get written unchanged.
+    The file gets opened in *append mode*. Old data will not be overwritten.
+
+    Derived classes can change the file format by overwriting the methods ``Encode``, ``OpenSegment`` and ``CloseSegment``.
+    They are called by the writer thread.
+
+    The log file can be rotated when it reaches a maximum size (``maxsize``) or age (``interval``).
+    The age gets checked even when no data arrives, so a segment of an idle line gets rotated in time as well.
+    Segments without any data do not get rotated.
+    The rotated file gets renamed to ``logpath.YYYYmmdd-HHMMSS`` and a new file gets opened at ``logpath``.
+    When ``compression`` is ``"gz"`` or ``"xz"``, the rotated file gets compressed by a further thread,
+    so that writing new data continues while the old segment gets compressed.
+    When compressing fails, the uncompressed file is kept and the error gets recorded in ``compresserrors``.
+
+    Args:
+        path (str): Path to the log file
+        maxsize (int): (Optional) Rotate the log file when it becomes larger than ``maxsize`` bytes
+        interval (float): (Optional) Rotate the log file after ``interval`` seconds
+        compression (str): (Optional) Compress rotated log files. Can be ``"gz"`` or ``"xz"``
+        queuesize (int): Maximum number of bytes (characters for strings) waiting to be written.
+            Default is ``QUEUESIZE``
+
+    Raises:
+        ValueError: When the compression is unknown
+        IOError: In case there is some trouble opening the log file
+    """
+    def __init__(self, path, *, maxsize=None, interval=None, compression=None, queuesize=QUEUESIZE):
+        if compression is not None and compression not in COMPRESSORS:
+            raise ValueError("Unknown log compression \"%s\"! Valid compressions are: %s"%(compression, ", ".join(COMPRESSORS)))
+
+        self.path           = path
+        self.maxsize        = maxsize
+        self.interval       = interval
+        self.compression    = compression
+        self.queuesize      = queuesize
+
+        self.dropped        = 0   # Number of chunks that got dropped
+        self.droppedbytes   = 0   # Number of bytes (or characters) that got dropped
+        self.highwater      = 0   # Maximum number of chunks that were waiting in the queue
+        self.highwaterbytes = 0   # Maximum number of bytes (or characters) that were waiting in the queue
+        self.queued         = 0   # Number of bytes (or characters) waiting in the queue
+        self.queuelock      = Lock()    # Protects queued and the dropped counters, they get changed by both threads
+        self.error          = None
+        self.compresserrors = []  # (path, exception) of each rotated file that could not be compressed
+
+        self.stats          = Statistics("log", {"path": path})
+        self.stats.AddGauge("backlog_chunks",   self.Backlog)
+        self.stats.AddGauge("highwater_chunks", lambda: self.highwater)
+        self.stats.AddGauge("backlog_bytes",    lambda: self.queued)
+        self.stats.AddGauge("highwater_bytes",  lambda: self.highwaterbytes)
+        self.stats.AddGauge("dropped_chunks",   lambda: self.dropped)
+        self.stats.AddGauge("dropped_bytes",    lambda: self.droppedbytes)
+
+        self.queue          = queue.Queue()
+        self.compressors    = []
+        self.__Open()
+
+        self.thread = Thread(target=self.__Run, name="LogWriter", daemon=True)
+        self.thread.start()
+
+
+
+    def __Open(self):
+        self.file      = open(self.path, "ab")
+        self.filesize  = self.file.tell()
+        self.opentime  = time.monotonic()
+        self.written   = 0  # Number of bytes of data written into this segment, without headers
+        try:
+            self.OpenSegment()
+        except Exception:
+            self.file.close()
+            raise
+
+
+
+    def OpenSegment(self):
+        """
+        This method gets called after a log file got opened.
+        The file object is ``self.file`` and its current size ``self.filesize``.
+        A derived class can write a file header here (and must update ``self.filesize``).
+
+        Returns:
+            *Nothing*
+        """
+        return
+
+
+
+    def CloseSegment(self, rotatedpath):
+        """
+        This method gets called after the log file got closed.
+
+        Args:
+            rotatedpath (str): The new path of the file when it got rotated, otherwise ``None``
+
+        Returns:
+            *Nothing*
+        """
+        return
+
+
+
+    def Encode(self, timestamp, data, offset):
+        """
+        This method translates one chunk of data into the bytes that get written into the log file.
+        Strings get UTF-8 encoded, bytes stay as they are.
+
+        Args:
+            timestamp (int): Time when ``Write`` got called (``time.monotonic_ns()``)
+            data (str, bytes): Data given to ``Write``
+            offset (int): Position in the log file where the encoded data will be written to
+
+        Returns:
+            The data to write as ``bytes``
+        """
+        if type(data) is str:
+            return data.encode("utf-8", "surrogateescape")
+        return data
+
+
+
+    def Write(self, data):
+        """
+        Puts data into the queue of the writer thread.
+        This method never blocks.
+
+        Args:
+            data (str, bytes, memoryview): Data to write into the log file. A memoryview gets copied.
+
+        Returns:
+            ``True`` when the data got queued, ``False`` when it got dropped because the queue is full
+            or writing into the log file failed before.
+        """
+        if type(data) is memoryview:
+            data = data.tobytes()   # The memory may get reused before the writer thread gets to it
+
+        with self.queuelock:
+            if self.error is None and self.queued + len(data) <= self.queuesize:
+                self.queued += len(data)
+                self.queue.put_nowait((time.monotonic_ns(), data))
+                self.highwater      = max(self.highwater,      self.queue.qsize())
+                self.highwaterbytes = max(self.highwaterbytes, self.queued)
+                return True
+
+            self.dropped      += 1
+            self.droppedbytes += len(data)
+        return False
+
+
+
+    def Backlog(self):
+        """
+        Returns:
+            The number of chunks that are waiting to be written
+        """
+        return self.queue.qsize()
+
+
+
+    def Close(self):
+        """
+        Writes all queued data, stops the writer thread and closes the log file.
+        This method blocks until all data is written and all rotated files are compressed.
+
+        Returns:
+            *Nothing*
+        """
+        self.queue.put(None)
+        self.thread.join()
+        for compressor in self.compressors:
+            compressor.join()
+        return
+
+
+
+    def __Run(self):
+        running = True
+        while running:
+            # Wake up when the segment gets too old, even when there is no data
+            timeout = None
+            if self.interval and self.error is None:
+                timeout = max(0, self.opentime + self.interval - time.monotonic())
+
+            batch = []
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+                while len(batch) < BATCHSIZE:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            if None in batch:
+                batch   = batch[:batch.index(None)]
+                running = False
+            with self.queuelock:
+                self.queued -= sum(len(data) for timestamp, data in batch)
+
+            if self.error is None:
+                try:
+                    self.__WriteBatch(batch)
+                    if self.interval and time.monotonic() - self.opentime >= self.interval:
+                        if self.written:
+                            self.__Rotate()
+                        else:
+                            self.opentime = time.monotonic()    # Nothing to rotate, start a new interval
+                except OSError as e:
+                    self.error = e
+
+            if self.error is not None:
+                with self.queuelock:
+                    self.dropped      += len(batch)
+                    self.droppedbytes += sum(len(data) for timestamp, data in batch)
+
+        self.file.close()
+        self.CloseSegment(None)
+
+
+
+    def __WriteBatch(self, batch):
+        if not batch:
+            return
+
+        chunks = []
+        offset = self.filesize
+        for timestamp, data in batch:
+            chunk   = self.Encode(timestamp, data, offset)
+            offset += len(chunk)
+            chunks.append(chunk)
+
+        start = time.monotonic_ns()
+        self.file.write(b"".join(chunks))
+        self.file.flush()
+        end   = time.monotonic_ns()
+        self.stats.Observe("queue_delay_ns", end - batch[0][0])
+        self.stats.Observe("write_ns",       end - start)
+        self.stats.Count("written_bytes",    offset - self.filesize)
+        self.written += offset - self.filesize
+        self.filesize = offset
+
+        if self.maxsize and self.filesize >= self.maxsize:
+            self.__Rotate()
+
+
+
+    def __Rotate(self):
+        self.file.close()
+
+        rotatedpath = "%s.%s"%(self.path, time.strftime("%Y%m%d-%H%M%S"))
+        number      = 1
+        while os.path.exists(rotatedpath) or os.path.exists(rotatedpath + "." + str(self.compression)):
+            rotatedpath = "%s.%s-%d"%(self.path, time.strftime("%Y%m%d-%H%M%S"), number)
+            number += 1
+        os.rename(self.path, rotatedpath)
+        self.CloseSegment(rotatedpath)
+
+        if self.compression:
+            compressor = Thread(target=self.__Compress, args=(rotatedpath,), name="LogCompressor")
+            compressor.start()
+            self.compressors = [thread for thread in self.compressors if thread.is_alive()]
+            self.compressors.append(compressor)
+
+        self.__Open()
+
+
+
+    def __Compress(self, path):
+        import shutil
+        compressedpath = path + "." + self.compression
+        try:
+            openfile = importlib.import_module(COMPRESSORS[self.compression]).open
+            with open(path, "rb") as source, openfile(compressedpath, "wb") as destination:
+                shutil.copyfileobj(source, destination, 1024*1024)
+            os.remove(path)
+        except Exception as e:  # OSError, or an error of the compression module (like lzma.LZMAError)
+            # Keep the uncompressed file, a traceback of this thread would end up in the terminal
+            self.compresserrors.append((path, e))
+            try:
+                os.remove(compressedpath)
+            except OSError:
+                pass
+
+
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,128 @@
+# STERM, a serial communication terminal with server capabilities        #
+# Copyright (C) 2013-2023  Ralf Stemmer (ralf.stemmer@gmx.net)           #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
+
+# The sterm-log command reads capture files written with "sterm --logformat capture".
+
+import sys
+import codecs
+import argparse
+import datetime
+from sterm.capture import CaptureReader
+
+
+cli = argparse.ArgumentParser(
+    description="Print or search a capture file written by sterm --logformat capture.")
+cli.add_argument(      "--from",        dest="start",       metavar="time", type=str, action="store",
+    help="Start at the given time: HH:MM[:SS], an ISO date and time (YYYY-mm-ddTHH:MM:SS) or +seconds since the start of the capture.")
+cli.add_argument(      "--to",          dest="end",         metavar="time", type=str, action="store",
+    help="Stop at the given time. Same formats as --from.")
+cli.add_argument("-s", "--search",      metavar="pattern",  type=str, action="store",
+    help="Print time and file offset of each occurrence of the pattern instead of the data. Escape sequences like \\n and \\x00 can be used.")
+cli.add_argument("-t", "--timestamps",  default=False,                action="store_true",
+    help="Print the time in front of each received chunk.")
+cli.add_argument("capture",             type=str, action="store",
+    help="Path to the capture file.")
+
+
+
+def ParseTime(string, capture):
+    """
+    This function translates a time given by the user into a timestamp of the capture.
+
+    The following formats are supported:
+
+        * ``"HH:MM"`` or ``"HH:MM:SS"``: Time at the day the capture started.
+          When this time is before the start of the capture, the next day is meant.
+        * ``"YYYY-mm-ddTHH:MM:SS"``: Date and time in ISO format
+        * ``"+SECONDS"``: Seconds since the start of the capture
+
+    Args:
+        string (str): The time given by the user
+        capture (CaptureReader): The capture the time refers to
+
+    Returns:
+        The timestamp in nanoseconds since the start of the capture
+
+    Raises:
+        ValueError: When the time has an invalid format
+    """
+    if string.startswith("+"):
+        return int(float(string[1:]) * 1e9)
+
+    start = datetime.datetime.fromtimestamp(capture.starttime)
+    if "T" in string or "-" in string:
+        moment = datetime.datetime.fromisoformat(string)
+    else:
+        moment = datetime.datetime.combine(start.date(), datetime.time.fromisoformat(string))
+        if moment < start.replace(microsecond=0):
+            moment += datetime.timedelta(days=1)
+    return capture.Timestamp(moment.timestamp())
+
+
+
+def FormatTime(capture, timestamp):
+    """
+    Returns:
+        The local time of a record as string with microseconds
+    """
+    moment = datetime.datetime.fromtimestamp(capture.WallTime(timestamp))
+    return moment.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+
+def main():
+    args = cli.parse_args()
+
+    try:
+        capture = CaptureReader(args.capture)
+    except Exception as e:
+        print("Opening capture %s failed with exception \"%s\""%(args.capture, str(e)), file=sys.stderr)
+        exit(1)
+
+    try:
+        start = ParseTime(args.start, capture) if args.start else None
+        end   = ParseTime(args.end,   capture) if args.end   else None
+    except ValueError as e:
+        print("Invalid time: %s"%(str(e)), file=sys.stderr)
+        capture.Close()
+        exit(1)
+
+    output = sys.stdout.buffer
+    try:
+        if args.search:
+            pattern = codecs.escape_decode(args.search.encode("utf-8"))[0]
+            for timestamp, offset in capture.Search(pattern, start, end):
+                output.write(("%s  %d\n"%(FormatTime(capture, timestamp), offset)).encode("utf-8"))
+        else:
+            for timestamp, offset, data in capture.Records(start, end):
+                if args.timestamps:
+                    output.write(("\n[%s] "%(FormatTime(capture, timestamp))).encode("utf-8"))
+                output.write(data)
+        output.flush()
+    except BrokenPipeError:
+        pass # Output got piped into a program like head that does not need more data
+    except ValueError as e:
+        print("Invalid search pattern: %s"%(str(e)), file=sys.stderr)
+        exit(1)
+    finally:
+        capture.Close()
+
+
+
+if __name__ == '__main__':
+    main()
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
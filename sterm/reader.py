@@ -0,0 +1,244 @@
+# STERM, a serial communication terminal with server capabilities        #
+# Copyright (C) 2013-2023  Ralf Stemmer (ralf.stemmer@gmx.net)           #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
+
+import os
+import select
+import signal
+
+
+# Layout of the header in front of the ring buffer: 64 bit counters, each written by only one of the processes
+HEAD       = 0  # Number of bytes written into the ring (reader process)
+TAIL       = 1  # Number of bytes consumed from the ring (main process)
+DROPPED    = 2  # Number of bytes discarded because the ring was full (reader process)
+OVERFLOWS  = 3  # Number of reads that got discarded because the ring was full (reader process)
+CLOSED     = 4  # 1 when the device got lost and the reader process ended (reader process)
+HEADERSIZE = 64
+
+# Number of bytes read at once while the ring is full
+DISCARDSIZE = 64*1024
+
+
+class ReaderProcess(object):
+    """
+    This class moves reading a UART device into a separate process.
+    The only job of that process is to drain the device into a ring buffer in shared memory
+    (``multiprocessing.shared_memory``), so that it never waits for rendering, logging or the GIL of the main process.
+    Each read goes with one ``readv`` system call directly into the free part of the ring.
+
+    The main process consumes the data with ``ReadInto``.
+    The reader process notifies it by a pipe, so ``fileno`` can be registered at a selector.
+    The ring has exactly one producer and one consumer.
+    Each position counter gets written by only one side, so there are no locks.
+
+    When the main process does not consume fast enough and the ring is full,
+    the reader process keeps on draining the device and discards the data.
+    The discarded bytes get counted (``Dropped``), so an overflow is never silent.
+
+    The process gets started with the *spawn* method.
+    The file descriptors of the device and the pipe get passed to it over a Unix socket.
+    As for all programs that use *spawn*, the main module must not start processes when it gets imported
+    (use ``if __name__ == "__main__":``).
+
+    Args:
+        fd (int): File descriptor of the opened UART device (non-blocking)
+        size (int): Size of the ring buffer in bytes
+
+    Raises:
+        ValueError: When the size is not positive
+        OSError: When the shared memory or the process cannot be created
+    """
+    def __init__(self, fd, size):
+        if size <= 0:
+            raise ValueError("Size of the receive ring buffer must be positive!")
+
+        import multiprocessing
+        from multiprocessing import reduction, shared_memory
+
+        self.size   = size
+        self.memory = shared_memory.SharedMemory(create=True, size=HEADERSIZE + size)
+        self.header = self.memory.buf[:HEADERSIZE].cast("Q")
+        self.ring   = self.memory.buf[HEADERSIZE:HEADERSIZE+size]
+        for index in range(len(self.header)):
+            self.header[index] = 0
+
+        self.notifyread, self.notifywrite = os.pipe2(os.O_NONBLOCK | os.O_CLOEXEC)
+
+        context = multiprocessing.get_context("spawn")
+        self.connection, connection = context.Pipe()
+        self.process = context.Process(target=RunReader, args=(connection, self.memory.name, size),
+            name="sterm-reader", daemon=True)
+        try:
+            self.process.start()
+            connection.close()
+            reduction.send_handle(self.connection, fd, self.process.pid)
+            reduction.send_handle(self.connection, self.notifywrite, self.process.pid)
+        except:
+            self.Stop()
+            raise
+
+
+
+    def fileno(self):
+        """
+        Returns:
+            The file descriptor that becomes readable when new data is in the ring buffer or the device got lost
+        """
+        return self.notifyread
+
+
+
+    def ReadInto(self, buffer):
+        """
+        Moves the data from the ring buffer into ``buffer``.
+        At most ``len(buffer)`` bytes get moved.
+        When more data is available or the device got lost, the file descriptor stays readable.
+
+        Args:
+            buffer: A writable buffer (like ``memoryview``)
+
+        Returns:
+            The number of bytes moved into ``buffer``. ``0`` when there is no data (yet),
+            ``None`` when there is no data and the device got lost.
+        """
+        try:
+            os.read(self.notifyread, 4096)
+        except BlockingIOError:
+            pass
+
+        closed    = self.header[CLOSED] # Read before HEAD, so that no data written before closing gets missed
+        head      = self.header[HEAD]
+        tail      = self.header[TAIL]
+        available = head - tail
+        if not available:
+            return None if closed else 0
+
+        length = min(available, len(buffer))
+        start  = tail % self.size
+        first  = min(length, self.size - start)
+        buffer[:first] = self.ring[start:start+first]
+        if length > first:
+            buffer[first:length] = self.ring[:length-first]
+        self.header[TAIL] = tail + length
+
+        # Stay readable when there is more data, or to report the lost device by the next call
+        if length < available or closed:
+            try:
+                os.write(self.notifywrite, b"\0")
+            except BlockingIOError:
+                pass # Pipe is full, so it is readable anyway
+        return length
+
+
+
+    def Dropped(self):
+        """
+        Returns:
+            A tuple of the number of bytes and the number of reads that got discarded because the ring buffer was full
+        """
+        return self.header[DROPPED], self.header[OVERFLOWS]
+
+
+
+    def Stop(self):
+        """
+        Stops the reader process and releases the shared memory.
+
+        Returns:
+            *Nothing*
+        """
+        self.connection.close() # The reader process ends when the connection gets closed
+        if self.process.pid is not None:
+            self.process.join(1)
+            if self.process.is_alive():
+                self.process.terminate()
+                self.process.join()
+
+        self.header.release()
+        self.ring.release()
+        self.memory.close()
+        self.memory.unlink()
+        os.close(self.notifyread)
+        os.close(self.notifywrite)
+        return
+
+
+
+def RunReader(connection, name, size):
+    """
+    Main function of the reader process (see ``ReaderProcess``).
+    Returns when the device got lost or the connection to the main process got closed.
+    """
+    from multiprocessing import reduction, shared_memory
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # Ctrl-C is handled by the main process
+
+    fd       = reduction.recv_handle(connection)
+    notifyfd = reduction.recv_handle(connection)
+    memory   = shared_memory.SharedMemory(name)
+    header   = memory.buf[:HEADERSIZE].cast("Q")
+    ring     = memory.buf[HEADERSIZE:HEADERSIZE+size]
+    discard  = bytearray(DISCARDSIZE)
+    buffers  = []
+
+    poll = select.poll()
+    poll.register(fd, select.POLLIN)
+    poll.register(connection.fileno(), select.POLLIN)
+    try:
+        while True:
+            events = poll.poll()
+            if any(eventfd == connection.fileno() for eventfd, mask in events):
+                return
+
+            head = header[HEAD]
+            free = size - (head - header[TAIL])
+            if free:
+                start   = head % size
+                first   = min(free, size - start)
+                buffers = [ring[start:start+first]]
+                if free > first:
+                    buffers.append(ring[:free-first])
+            else:
+                buffers = [discard]
+
+            try:
+                length = os.readv(fd, buffers)
+            except BlockingIOError:
+                continue
+            except OSError:
+                length = 0
+
+            if not length:
+                header[CLOSED] = 1
+            elif free:
+                header[HEAD] = head + length
+            else:
+                header[DROPPED]   += length
+                header[OVERFLOWS] += 1
+
+            try:
+                os.write(notifyfd, b"\0")
+            except BlockingIOError:
+                pass # Pipe is full, so the main process gets woken up anyway
+            if not length:
+                return
+    finally:
+        del buffers
+        header.release()
+        ring.release()
+        memory.close()
+
+
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,175 @@
+# STERM, a serial communication terminal with server capabilities        #
+# Copyright (C) 2013-2023  Ralf Stemmer (ralf.stemmer@gmx.net)           #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
+
+import os
+import tty
+import time
+import fcntl
+import struct
+import select
+import termios
+from threading     import Thread, Event
+from sterm.capture import CaptureReader
+
+
+# Size of the chunks read from log files that are not in the capture format
+CHUNKSIZE = 4096
+
+
+class Replay(object):
+    """
+    This class plays a recorded log file back through a pseudo terminal.
+    The slave side of the pseudo terminal (``devpath``) can be opened by the ``UART`` class like a real device,
+    so the replayed data runs through the same receive and render path as live data.
+
+    Capture files (see ``sterm.capture``) get replayed with their original timing, divided by ``speed``.
+    With ``speed`` 0 the data gets replayed as fast as the receiver reads it.
+    Other log files have no timing information and are always replayed as fast as possible in chunks of 4 KiB.
+
+    The capture file gets memory mapped and only one record is held in memory at a time,
+    so the size of the log file does not matter.
+    Data written to the device (user input) gets discarded.
+
+    When all data is replayed and got read by the receiver, the master side gets closed.
+    For the receiver, this looks like a device that got lost.
+
+    Args:
+        path (str): Path to the log file
+        speed (float): Replay speed relative to the original timing. Default is 1.0 (real time)
+
+    Raises:
+        ValueError: When the speed is negative
+        OSError: When the log file cannot be opened or no pseudo terminal is available
+    """
+    def __init__(self, path, speed=1.0):
+        if speed < 0:
+            raise ValueError("Replay speed must not be negative!")
+
+        self.path    = path
+        self.speed   = speed
+        self.capture = None
+        self.file    = None
+        try:
+            self.capture = CaptureReader(path)
+        except ValueError:
+            self.file = open(path, "rb")
+
+        self.masterfd, self.slavefd = os.openpty()
+        tty.setraw(self.masterfd)
+        os.set_blocking(self.masterfd, False)
+        self.devpath = os.ttyname(self.slavefd)
+
+        self.stop   = Event()
+        self.thread = Thread(target=self.__Run, name="Replay", daemon=True)
+
+
+
+    def Start(self):
+        """
+        Starts the thread that writes the recorded data into the pseudo terminal.
+
+        Returns:
+            *Nothing*
+        """
+        self.thread.start()
+        return
+
+
+
+    def Stop(self):
+        """
+        Stops replaying and closes the pseudo terminal and the log file.
+
+        Returns:
+            *Nothing*
+        """
+        self.stop.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        if self.masterfd is not None:
+            os.close(self.masterfd)
+            self.masterfd = None
+        os.close(self.slavefd)
+
+        if self.capture:
+            self.capture.Close()
+        if self.file:
+            self.file.close()
+        return
+
+
+
+    def __Chunks(self):
+        if self.capture:
+            for timestamp, offset, data in self.capture.Records():
+                yield timestamp, data
+        else:
+            while True:
+                data = self.file.read(CHUNKSIZE)
+                if not data:
+                    break
+                yield None, data
+
+
+
+    def __Run(self):
+        starttime = None    # (monotonic time, timestamp) of the first record
+        for timestamp, data in self.__Chunks():
+            if self.speed and timestamp is not None:
+                if starttime is None:
+                    starttime = (time.monotonic(), timestamp)
+                delay = starttime[0] + (timestamp - starttime[1]) / 1e9 / self.speed - time.monotonic()
+                if delay > 0 and self.stop.wait(delay):
+                    return
+
+            if not self.__Send(data):
+                return
+
+        # Wait until the receiver read all data, then hang up
+        while self.__Pending() > 0:
+            if self.stop.wait(0.01):
+                return
+        os.close(self.masterfd)
+        self.masterfd = None
+
+
+
+    def __Send(self, data):
+        data = memoryview(data)
+        while data:
+            if self.stop.is_set():
+                return False
+
+            readable, writable, _ = select.select([self.masterfd], [self.masterfd], [], 0.1)
+            try:
+                if readable:
+                    os.read(self.masterfd, 65536) # Discard user input
+                if writable:
+                    written = os.write(self.masterfd, data)
+                    data    = data[written:]
+            except BlockingIOError:
+                pass
+        return True
+
+
+
+    def __Pending(self):
+        pending = fcntl.ioctl(self.slavefd, termios.TIOCINQ, struct.pack("i", 0))
+        return struct.unpack("i", pending)[0]
+
+
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,238 @@
+# STERM, a serial communication terminal with server capabilities        #
+# Copyright (C) 2013-2023  Ralf Stemmer (ralf.stemmer@gmx.net)           #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
+
+import re
+import collections
+from threading import Lock
+
+
+# Number of bytes on each side of the wrap-around point that get searched for regular expressions
+REGEXWINDOW = 4096
+
+# Maximum number of bytes searched for the context lines of a match
+CONTEXTBYTES = 1024
+
+
+class Scrollback(object):
+    """
+    This class keeps the last ``size`` received bytes in a ring buffer.
+    The buffer gets allocated once and never grows or gets reallocated.
+    Each chunk gets copied into the buffer with at most two slice assignments.
+
+    An instance can be registered as listener of a UART device:
+
+    .. code-block::
+
+        scrollback = Scrollback(64*1024*1024)
+        uart.AddListener(scrollback.Write)
+
+    Positions are counted in bytes since the start of the stream (``total`` is the position of the next byte).
+    Only the positions from ``total - size`` on are still available.
+
+    The buffer gets searched in place, without decoding or copying it.
+    A literal pattern is found even if it spans the wrap-around point of the ring.
+    Regular expressions only match across that point when the match is within ``REGEXWINDOW`` bytes of it.
+    The search runs without holding the lock, so a long search does not block ``Write`` (and so the receive path).
+    Matches in data that got overwritten while searching get discarded.
+
+    Args:
+        size (int): Size of the ring buffer in bytes
+
+    Raises:
+        ValueError: When the size is not positive
+    """
+    def __init__(self, size):
+        if size <= 0:
+            raise ValueError("Size of the scrollback buffer must be positive!")
+
+        self.size   = size
+        self.buffer = bytearray(size)
+        self.total  = 0
+        self.lock   = Lock()
+
+
+
+    def Write(self, data):
+        """
+        Appends data to the ring buffer.
+        When the buffer is full, the oldest data gets overwritten.
+
+        Args:
+            data (bytes): The received data
+
+        Returns:
+            *Nothing*
+        """
+        length = len(data)
+        with self.lock:
+            start = self.total % self.size
+            if start + length <= self.size:
+                self.buffer[start:start+length] = data
+            else:
+                view  = memoryview(data)[-self.size:]
+                start = (self.total + length - len(view)) % self.size
+                first = min(len(view), self.size - start)
+                self.buffer[start:start+first] = view[:first]
+                self.buffer[0:len(view)-first] = view[first:]
+            self.total += length
+        return
+
+
+
+    def Read(self, start, end):
+        """
+        Copies a part of the stream out of the ring buffer.
+        Positions that are not available anymore (or not yet) get skipped.
+
+        Args:
+            start (int): Position of the first byte
+            end (int): Position behind the last byte
+
+        Returns:
+            The data as ``bytes``
+        """
+        with self.lock:
+            return self.__Read(start, end)
+
+
+
+    def Find(self, pattern, *, regex=False, limit=10):
+        """
+        This method searches the ring buffer backwards, starting with the newest data.
+
+        Args:
+            pattern (bytes): The bytes or the regular expression to search for
+            regex (bool): Interpret ``pattern`` as regular expression (``re`` syntax). Default is ``False``
+            limit (int): Maximum number of matches to return. Default is 10
+
+        Returns:
+            A list of ``(position, length)`` tuples of the matches, the newest match first
+
+        Raises:
+            re.error: When ``pattern`` is not a valid regular expression
+        """
+        if regex:
+            expression = re.compile(pattern)
+        elif not pattern:
+            return []
+
+        with self.lock:
+            total    = self.total
+            segments = self.__Segments()
+
+        matches = []
+        for offset, start, end in segments:
+            if regex:
+                found = self.__FindRegex(expression, self.buffer, start, end, limit - len(matches))
+            else:
+                found = self.__FindLiteral(pattern, self.buffer, start, end, limit - len(matches))
+            matches += [(offset + position - start, length) for position, length in found]
+            if len(matches) >= limit:
+                break
+
+            # Matches that span the wrap-around point in front of the segment
+            if start == 0 and total > self.size:
+                window   = REGEXWINDOW if regex else len(pattern) - 1
+                boundary = offset
+                with self.lock:
+                    begin = max(boundary - window, self.total - self.size)
+                    data  = self.__Read(begin, min(boundary + window, total))
+                if regex:
+                    found = self.__FindRegex(expression, data, 0, len(data), None)
+                else:
+                    found = self.__FindLiteral(pattern, data, 0, len(data), None)
+                found    = [(begin + position, length) for position, length in found
+                            if begin + position < boundary < begin + position + length]
+                matches += found[:limit - len(matches)]
+
+        # The oldest data may have been overwritten while searching
+        with self.lock:
+            oldest = self.total - self.size
+        return [(position, length) for position, length in matches if position >= oldest]
+
+
+
+    def Context(self, position, length, lines=2):
+        """
+        Returns a match with some lines of context around it.
+
+        Args:
+            position (int): Position of the match
+            length (int): Length of the match in bytes
+            lines (int): Number of lines before and after the line of the match. Default is 2
+
+        Returns:
+            A tuple of the data in front of the match, the match and the data behind the match as ``bytes``
+        """
+        with self.lock:
+            before = self.__Read(position - CONTEXTBYTES, position)
+            match  = self.__Read(position, position + length)
+            after  = self.__Read(position + length, position + length + CONTEXTBYTES)
+        before = b"\n".join(before.split(b"\n")[-(lines+1):])
+        after  = b"\n".join(after.split(b"\n")[:lines+1])
+        return before, match, after
+
+
+
+    def __Segments(self):
+        """
+        Returns the stored parts of the buffer as ``(position, start, end)`` tuples, the newest part first.
+        """
+        if self.total <= self.size:
+            return [(0, 0, self.total)]
+        head = self.total % self.size
+        if head == 0:
+            return [(self.total - self.size, 0, self.size)]
+        return [(self.total - head, 0, head), (self.total - self.size, head, self.size)]
+
+
+
+    def __Read(self, start, end):
+        start = max(start, self.total - self.size, 0)
+        end   = min(end, self.total)
+        if start >= end:
+            return b""
+        first = start % self.size
+        last  = first + (end - start)
+        if last <= self.size:
+            return bytes(self.buffer[first:last])
+        return bytes(self.buffer[first:]) + bytes(self.buffer[:last - self.size])
+
+
+
+    @staticmethod
+    def __FindLiteral(pattern, data, start, end, limit):
+        found = []
+        while limit is None or len(found) < limit:
+            position = data.rfind(pattern, start, end)
+            if position < 0:
+                break
+            found.append((position, len(pattern)))
+            end = position + len(pattern) - 1
+        return found
+
+
+
+    @staticmethod
+    def __FindRegex(expression, data, start, end, limit):
+        found = collections.deque(maxlen=limit)
+        for match in expression.finditer(data, start, end):
+            found.append((match.start(), match.end() - match.start()))
+        return list(reversed(found))
+
+
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
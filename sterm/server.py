@@ -0,0 +1,222 @@
+# STERM, a serial communication terminal with server capabilities        #
+# Copyright (C) 2013-2023  Ralf Stemmer (ralf.stemmer@gmx.net)           #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
+
+import socket
+import selectors
+from sterm.transmitter import Transmitter
+
+
+class Client(object):
+    """
+    Connection to one network client of the ``Server``.
+
+    Args:
+        sock (socket): The connected socket
+        address (tuple): Address of the client
+    """
+    def __init__(self, sock, address):
+        self.socket   = sock
+        self.address  = address
+        self.buffer   = bytearray()  # Data that could not be send yet
+        self.callback = None         # Data of the selector key
+
+
+
+class Server(object):
+    """
+    This class makes a UART device accessible for network clients via TCP.
+
+    All data received from the UART device gets send raw (not interpreted by the UART mode) to all connected clients.
+    Each client has its own send buffer that is limited to ``buffersize`` bytes.
+    When a client is too slow to receive the data and its buffer overflows, the client gets disconnected.
+    So a slow client never blocks receiving data from the UART device or sending data to the other clients.
+
+    Data received from clients gets transmitted to the UART device by a ``sterm.transmitter.Transmitter``,
+    so a transmission that is paced or stopped by flow control does not block the receiver loop.
+    Only one client can write at a time:
+    The first client that sends data becomes the writer.
+    Data of all other clients gets discarded until the writer disconnects.
+    When ``readonly`` is ``True``, data of all clients gets discarded.
+
+    The server does not have its own thread.
+    Its sockets get registered at the selector of the receiver loop by calling ``Register``.
+    The data of each registered key is a callback that must be called with the event mask when the key is ready.
+
+    Args:
+        address (tuple): Host and port to listen on
+        uart: Instance of the ``UART`` class.
+        readonly (bool): Discard all data send by clients. Default is ``False``
+        buffersize (int): Maximum number of bytes buffered for each client. Default is 1 MiB
+
+    Raises:
+        OSError: When the server socket cannot be created
+    """
+    def __init__(self, address, uart, *, readonly=False, buffersize=1024*1024):
+        self.uart       = uart
+        self.readonly   = readonly
+        self.buffersize = buffersize
+        self.clients    = {}
+        self.writer     = None
+        self.selector   = None
+
+        self.socket = socket.create_server(address)
+        self.socket.setblocking(False)
+        self.address = self.socket.getsockname()
+
+        self.transmitter = Transmitter(uart)
+        self.uart.AddListener(self.Send)
+
+
+
+    def Register(self, selector):
+        """
+        Registers the server socket at a selector.
+        The sockets of new clients get registered at the same selector.
+
+        Args:
+            selector: A selector of the ``selectors`` module
+
+        Returns:
+            *Nothing*
+        """
+        self.selector = selector
+        self.selector.register(self.socket, selectors.EVENT_READ, self.__Accept)
+        return
+
+
+
+    def Close(self):
+        """
+        Disconnects all clients and closes the server socket.
+
+        Returns:
+            *Nothing*
+        """
+        self.uart.RemoveListener(self.Send)
+        for client in list(self.clients.values()):
+            self.__Disconnect(client)
+        self.__Unregister(self.socket)
+        self.socket.close()
+        self.transmitter.Close()
+        return
+
+
+
+    def Send(self, data):
+        """
+        Sends data to all connected clients.
+        Data that cannot be send immediately gets buffered and send when the client is ready.
+
+        Args:
+            data (bytes): The data to send
+
+        Returns:
+            *Nothing*
+        """
+        for client in list(self.clients.values()):
+            if client.buffer:
+                client.buffer += data
+            else:
+                try:
+                    sent = client.socket.send(data)
+                except BlockingIOError:
+                    sent = 0
+                except OSError:
+                    self.__Disconnect(client)
+                    continue
+
+                if sent < len(data):
+                    client.buffer += data[sent:]
+                    self.selector.modify(client.socket, selectors.EVENT_READ | selectors.EVENT_WRITE, client.callback)
+
+            if len(client.buffer) > self.buffersize:
+                self.__Disconnect(client)
+        return
+
+
+
+    def __Accept(self, mask):
+        try:
+            sock, address = self.socket.accept()
+        except BlockingIOError:
+            return
+
+        sock.setblocking(False)
+        client = Client(sock, address)
+        client.callback = lambda mask: self.__HandleClient(client, mask)
+        self.clients[sock] = client
+        self.selector.register(sock, selectors.EVENT_READ, client.callback)
+
+
+
+    def __Disconnect(self, client):
+        # A client can get disconnected by Send while its events are still pending
+        if self.clients.pop(client.socket, None) is None:
+            return
+        if client is self.writer:
+            self.writer = None
+        self.__Unregister(client.socket)
+        client.socket.close()
+
+
+
+    def __Unregister(self, sock):
+        try:
+            self.selector.unregister(sock)
+        except (AttributeError, KeyError):
+            pass # Not registered or the selector was already closed
+
+
+
+    def __HandleClient(self, client, mask):
+        if client.socket not in self.clients:
+            return  # Got disconnected while this event was pending
+
+        if mask & selectors.EVENT_WRITE:
+            try:
+                sent = client.socket.send(client.buffer)
+                del client.buffer[:sent]
+            except BlockingIOError:
+                pass
+            except OSError:
+                self.__Disconnect(client)
+                return
+
+            if not client.buffer:
+                self.selector.modify(client.socket, selectors.EVENT_READ, client.callback)
+
+        if mask & selectors.EVENT_READ:
+            try:
+                data = client.socket.recv(65536)
+            except BlockingIOError:
+                return
+            except OSError:
+                data = b""
+
+            if not data:
+                self.__Disconnect(client)
+                return
+
+            if self.readonly:
+                return
+            if self.writer is None:
+                self.writer = client
+            if self.writer is client:
+                self.transmitter.Transmit(data)
+
+
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
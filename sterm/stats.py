@@ -0,0 +1,333 @@
+# STERM, a serial communication terminal with server capabilities        #
+# Copyright (C) 2013-2023  Ralf Stemmer (ralf.stemmer@gmx.net)           #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
+
+import os
+import time
+from threading import Thread, Event
+
+
+# Number of buckets of a histogram. Bucket i counts the values with i significant bits.
+BUCKETS = 64
+
+
+class Histogram(object):
+    """
+    This class counts values in logarithmic buckets (powers of two).
+    Adding a value costs one ``int.bit_length`` call and one list update,
+    so it can be used in hot paths.
+
+    Bucket ``i`` counts all values ``v`` with ``v.bit_length() == i``, so values from ``2**(i-1)`` to ``2**i - 1``.
+    Percentiles are reported as the upper bound of the bucket they fall into.
+    """
+    def __init__(self):
+        self.buckets = [0] * BUCKETS
+        self.count   = 0
+        self.total   = 0
+        self.maximum = 0
+
+
+
+    def Add(self, value):
+        """
+        Args:
+            value (int): A non-negative value like a size in bytes or a duration in nanoseconds
+
+        Returns:
+            *Nothing*
+        """
+        self.buckets[min(value.bit_length(), BUCKETS-1)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.maximum:
+            self.maximum = value
+        return
+
+
+
+    def Percentile(self, percent):
+        """
+        Args:
+            percent (float): The percentile to return (like ``99``)
+
+        Returns:
+            The upper bound of the bucket the percentile falls into, or ``0`` when the histogram is empty
+        """
+        rank = self.count * percent / 100
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return min((1 << bucket) - 1, self.maximum)
+        return 0
+
+
+
+class Statistics(object):
+    """
+    This class collects named counters and histograms of one component (like a UART device or the terminal).
+    The values can be read with ``Snapshot`` and rendered with ``FormatText``, ``FormatJSON`` or ``FormatOpenMetrics``.
+
+    Counting is done without locks.
+    Updates from different threads to the same counter can get lost in rare cases,
+    which is acceptable for statistics and keeps the overhead in the hot paths low.
+
+    Counter names should contain the unit (like ``rx_bytes`` or ``write_ns``).
+
+    Args:
+        name (str): Name of the component
+        labels (dict): (Optional) Labels that identify the component, like ``{"device": "/dev/ttyUSB0"}``
+    """
+    def __init__(self, name, labels=None):
+        self.name       = name
+        self.labels     = labels or {}
+        self.counters   = {}
+        self.histograms = {}
+        self.gauges     = {}
+
+
+
+    def Count(self, name, value=1):
+        """
+        Increments a counter.
+
+        Args:
+            name (str): Name of the counter
+            value (int): Value to add. Default is 1
+
+        Returns:
+            *Nothing*
+        """
+        self.counters[name] = self.counters.get(name, 0) + value
+        return
+
+
+
+    def Observe(self, name, value):
+        """
+        Adds a value to a histogram.
+
+        Args:
+            name (str): Name of the histogram
+            value (int): Value to add
+
+        Returns:
+            *Nothing*
+        """
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.Add(value)
+        return
+
+
+
+    def AddGauge(self, name, function):
+        """
+        Adds a value that gets read only when a snapshot is taken, like the length of a queue.
+        So there is no overhead in the hot path for values that are already tracked somewhere else.
+
+        Args:
+            name (str): Name of the gauge
+            function: A function without arguments that returns the current value
+
+        Returns:
+            *Nothing*
+        """
+        self.gauges[name] = function
+        return
+
+
+
+    def Snapshot(self):
+        """
+        Returns:
+            A dictionary with the name, labels, counters, gauges and a summary of each histogram
+        """
+        histograms = {}
+        for name, histogram in list(self.histograms.items()):
+            histograms[name] = {
+                "count":   histogram.count,
+                "sum":     histogram.total,
+                "max":     histogram.maximum,
+                "p50":     histogram.Percentile(50),
+                "p99":     histogram.Percentile(99),
+                "buckets": list(histogram.buckets),
+                }
+        return {
+            "name":       self.name,
+            "labels":     dict(self.labels),
+            "counters":   dict(self.counters),
+            "gauges":     {name: function() for name, function in self.gauges.items()},
+            "histograms": histograms,
+            }
+
+
+
+def FormatText(statistics):
+    """
+    Renders statistics for the terminal.
+
+    Args:
+        statistics: List of ``Statistics`` objects
+
+    Returns:
+        A string with one line per counter and histogram
+    """
+    lines = []
+    for stats in statistics:
+        snapshot = stats.Snapshot()
+        labels   = " ".join(snapshot["labels"].values())
+        lines.append("%s %s"%(snapshot["name"], labels) if labels else snapshot["name"])
+        for name, value in sorted(list(snapshot["counters"].items()) + list(snapshot["gauges"].items())):
+            lines.append("    %-24s %d"%(name, value))
+        for name, histogram in sorted(snapshot["histograms"].items()):
+            mean = histogram["sum"] // histogram["count"] if histogram["count"] else 0
+            lines.append("    %-24s n=%d mean=%d p50<=%d p99<=%d max=%d"%(
+                name, histogram["count"], mean, histogram["p50"], histogram["p99"], histogram["max"]))
+    return "\n".join(lines) + "\n"
+
+
+
+def FormatJSON(statistics):
+    """
+    Args:
+        statistics: List of ``Statistics`` objects
+
+    Returns:
+        A JSON document with the time and the snapshots of all statistics
+    """
+    import json
+    report = {
+        "time":       time.time(),
+        "statistics": [stats.Snapshot() for stats in statistics],
+        }
+    return json.dumps(report, indent=2) + "\n"
+
+
+
+def FormatOpenMetrics(statistics):
+    """
+    Renders statistics in the OpenMetrics text format.
+    Counters become ``sterm_<component>_<name>_total``, gauges ``sterm_<component>_<name>``,
+    histograms become ``sterm_<component>_<name>`` with cumulative buckets.
+
+    Args:
+        statistics: List of ``Statistics`` objects
+
+    Returns:
+        The OpenMetrics text, terminated by ``# EOF``
+    """
+    families = {}   # Metric name → (type, list of lines)
+    def Add(name, metrictype, suffix, labels, value):
+        labels = ",".join("%s=\"%s\""%(key, str(label).replace("\\", "\\\\").replace("\"", "\\\"")) for key, label in labels.items())
+        if labels:
+            labels = "{" + labels + "}"
+        families.setdefault(name, (metrictype, []))[1].append("%s%s%s %s"%(name, suffix, labels, value))
+
+    for stats in statistics:
+        snapshot = stats.Snapshot()
+        labels   = snapshot["labels"]
+        prefix   = "sterm_%s_"%(snapshot["name"])
+
+        for name, value in snapshot["counters"].items():
+            Add(prefix + name, "counter", "_total", labels, value)
+
+        for name, value in snapshot["gauges"].items():
+            Add(prefix + name, "gauge", "", labels, value)
+
+        for name, histogram in snapshot["histograms"].items():
+            cumulative = 0
+            for bucket, count in enumerate(histogram["buckets"]):
+                cumulative += count
+                if count:
+                    Add(prefix + name, "histogram", "_bucket", dict(labels, le=str((1 << bucket) - 1)), cumulative)
+            Add(prefix + name, "histogram", "_bucket", dict(labels, le="+Inf"), histogram["count"])
+            Add(prefix + name, "histogram", "_count",  labels, histogram["count"])
+            Add(prefix + name, "histogram", "_sum",    labels, histogram["sum"])
+
+    lines = []
+    for name, (metrictype, samples) in families.items():
+        lines.append("# TYPE %s %s"%(name, metrictype))
+        lines += samples
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+
+class StatsWriter(object):
+    """
+    This class writes statistics periodically into a file from a separate thread.
+    When the file name ends with ``.prom``, the OpenMetrics format is used, otherwise JSON.
+    The file gets replaced atomically, so a reader never sees a partially written file.
+
+    Args:
+        path (str): Path to the statistics file
+        statistics: List of ``Statistics`` objects
+        interval (float): Seconds between two updates of the file. Default is 10
+    """
+    def __init__(self, path, statistics, interval=10):
+        self.path       = path
+        self.statistics = statistics
+        self.interval   = interval
+        self.format     = FormatOpenMetrics if path.endswith(".prom") else FormatJSON
+        self.stop       = Event()
+        self.thread     = Thread(target=self.__Run, name="StatsWriter", daemon=True)
+        self.thread.start()
+
+
+
+    def Write(self):
+        """
+        Writes the current statistics into the file.
+
+        Returns:
+            *Nothing*
+
+        Raises:
+            OSError: When writing the file fails
+        """
+        temppath = self.path + ".tmp"
+        with open(temppath, "w") as statsfile:
+            statsfile.write(self.format(self.statistics))
+        os.replace(temppath, self.path)
+        return
+
+
+
+    def Close(self):
+        """
+        Stops the thread and writes the statistics a last time.
+
+        Returns:
+            *Nothing*
+        """
+        self.stop.set()
+        self.thread.join()
+        self.Write()
+        return
+
+
+
+    def __Run(self):
+        while not self.stop.wait(self.interval):
+            try:
+                self.Write()
+            except OSError:
+                pass # Try again next interval
+
+
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
@@ -14,7 +14,25 @@
 # You should have received a copy of the GNU General Public License      #
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
 
+import os
+import re
 import sys
+import time
+import codecs
+import select
+from threading   import Lock
+from sterm.stats import Statistics
+
+
+# All kind of line breaks: "\r\n", "\r" or "\n".
+# "\r\r" counts as one line break, the way sterm always rendered it.
+LINEBREAK = re.compile("\r\r|\r\n|\r|\n")
+
+# Minimum time between two writes to stdout (60 frames per second)
+FRAMETIME = 1/60
+
+# Maximum number of bytes read from stdin at once
+INPUTSIZE = 4096
 
 
 class Terminal(object):
@@ -29,6 +47,15 @@ class Terminal(object):
     Otherwise entering a character will be invisible when not echoed by the connected device.
     When the ``escape`` character is entered, ``"␛"`` gets printed to *stdout*.
 
+    Input gets read in batches of everything that is available (up to ``INPUTSIZE`` bytes).
+    Characters that were read but not yet requested stay in an input buffer.
+
+    Output gets collected in a buffer and written to *stdout* at most once per frame (``FRAMETIME``, 1/60 s).
+    The owner of the terminal must call ``Flush`` when no more output is expected for a while.
+    ``FlushTimeout`` tells how long to wait at most before calling ``Flush``.
+
+    The time spent in ``Write`` and the number and size of writes to *stdout* get tracked in ``stats``.
+
     Args:
         echo (bool): Enable or disable printing the character that got pressed by the user on the keyboard. Default is ``True``
         escape (str): A special character used for escape sequences. Default is ``"\033"``
@@ -50,6 +77,77 @@ class Terminal(object):
         self.escape  = escape
         self.stdinfd = sys.stdin.fileno()
 
+        self.input   = ""   # Read but not yet requested input
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+        sys.stdout.flush()  # Output gets written directly to the binary buffer from now on
+        self.output    = sys.stdout.buffer
+        self.buffer    = bytearray()
+        self.lock      = Lock()
+        self.lastflush = 0.0
+        self.lastcr    = False  # True when the last written string ended with "\r"
+        self.linestart = True   # True when the cursor is at the beginning of a line
+        self.source    = None   # Prefix of the last tagged write
+        self.stats     = Statistics("terminal")
+
+
+
+    def ReadInput(self):
+        r"""
+        This method returns all input that is available, but at least one character.
+        If there is no input, the method blocks until the user enters something.
+        All available data is read from *stdin* with a single read call, so pasted text gets returned at once.
+
+        The returned input does not get echoed.
+
+        Returns:
+            A string with one or more characters.
+        """
+        while not self.input:
+            data = os.read(self.stdinfd, INPUTSIZE)
+            if not data:
+                raise EOFError("stdin got closed")
+            self.input = self.decoder.decode(data)
+
+        string     = self.input
+        self.input = ""
+        return string
+
+
+
+    def PollInput(self):
+        r"""
+        This method returns the input that is available without waiting for the user.
+
+        Returns:
+            A string with the available input, or an empty string when there is none.
+        """
+        readable, _, _ = select.select([self.stdinfd], [], [], 0)
+        if readable:
+            data = os.read(self.stdinfd, INPUTSIZE)
+            if data:
+                self.input += self.decoder.decode(data)
+
+        string     = self.input
+        self.input = ""
+        return string
+
+
+
+    def Unread(self, string):
+        r"""
+        This method puts input back so that it gets returned by the next read.
+        This is useful when only a part of the string returned by ``ReadInput`` got processed.
+
+        Args:
+            string (str): Input to put back in front of the input buffer
+
+        Returns:
+            *Nothing*
+        """
+        self.input = string + self.input
+        return
+
 
 
     def ReadLine(self):
@@ -100,17 +198,20 @@ class Terminal(object):
         if type(echo) is not bool:
             raise TypeError("echo argument must be a boolean or None.")
 
-        char = sys.stdin.read(1)
+        string = self.ReadInput()
+        char   = string[0]
+        self.Unread(string[1:])
         if echo:
             if char == self.escape:
                 self.Write("␛") # Print ESC Unicode character then user hits escape key
             else:
                 self.Write(char)
+            self.Flush()
         return char
 
 
 
-    def Write(self, string):
+    def Write(self, string, prefix=None):
         r"""
         This method handles the output and adopts the line ending to the terminal configuration
 
@@ -118,6 +219,21 @@ class Terminal(object):
         When an input of an enter (only ``\r``) shall be echoed, an additional ``\n`` needs to be written.
 
         This method takes care that there is always ``\r\n``, independent if only ``\r`` or ``\n`` is used as line break in the ``string`` argument.
+        All line breaks get replaced in one pass.
+        A ``\r\n`` sequence that is split over two calls of this method is handled as one line break.
+
+        The string gets UTF-8 encoded (with ``errors="surrogateescape"``) and appended to the output buffer.
+        The buffer gets written to *stdout* when the last write is at least one frame ago.
+        Otherwise the data stays in the buffer until the next call of ``Write`` or ``Flush``.
+
+        When output of several sources gets written to the terminal, each source can be tagged by a ``prefix``.
+        Then each line of that source starts with the prefix.
+        When the previous tagged write came from a different source and ended in the middle of a line,
+        a line break gets inserted first.
+
+        Args:
+            string (str): The string to write
+            prefix (str): (Optional) Prefix for each line of the string
 
         Returns:
             *Nothing*
@@ -128,17 +244,78 @@ class Terminal(object):
         if type(string) is not str:
             raise TypeError("Argument for Terminal.Write must be a string! Actual type was %s.", str(type(string)))
 
-        # In the raw input mode (no echo), the output also expects an explicit \r
-        # This is because of the changed, none-default settings of the TTY
-        # Here I take care that the \r\n sequence is correct
-        string = string.replace("\n", "\r\n").replace("\r\r", "\r")
-        string = string.replace("\r", "\r\n").replace("\n\n", "\n")
+        start = time.perf_counter_ns()
+        with self.lock:
+            if prefix is not None and prefix != self.source:
+                if not self.linestart:
+                    self.buffer += b"\r\n"
+                    self.linestart = True
+                self.source = prefix
+                self.lastcr = False
+
+            # In the raw input mode (no echo), the output also expects an explicit \r
+            # This is because of the changed, none-default settings of the TTY
+            # Here I take care that the \r\n sequence is correct
+            if self.lastcr and string[:1] == "\n":
+                string = string[1:]
+            if not string:
+                return
+            self.lastcr = string[-1] == "\r"
+
+            if prefix is None:
+                string = LINEBREAK.sub("\r\n", string)
+            else:
+                string = LINEBREAK.sub("\r\n" + prefix.replace("\\", "\\\\"), string)
+                if self.linestart:
+                    string = prefix + string
+                if string.endswith("\r\n" + prefix):
+                    string = string[:-len(prefix)]
+            self.linestart = string[-1] == "\n"
+            self.buffer   += string.encode("utf-8", "surrogateescape")
+
+            if time.monotonic() - self.lastflush >= FRAMETIME:
+                self.__Flush()
+        self.stats.Observe("write_ns", time.perf_counter_ns() - start)
+        return
+
+
+
+    def Flush(self):
+        """
+        This method writes all buffered output to *stdout*.
 
-        sys.stdout.write(string)
-        sys.stdout.flush()
+        Returns:
+            *Nothing*
+        """
+        with self.lock:
+            self.__Flush()
         return
 
 
 
-# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+    def FlushTimeout(self):
+        """
+        This method returns how long the caller can wait until ``Flush`` must be called
+        to keep the frame rate.
 
+        Returns:
+            The time in seconds until the next frame, ``0`` if the frame is already due,
+            or ``None`` if there is no buffered output.
+        """
+        if not self.buffer:
+            return None
+        return max(0, self.lastflush + FRAMETIME - time.monotonic())
+
+
+
+    def __Flush(self):
+        if self.buffer:
+            self.stats.Observe("flush_bytes", len(self.buffer))
+            self.output.write(self.buffer)
+            self.output.flush()
+            self.buffer.clear()
+        self.lastflush = time.monotonic()
+
+
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
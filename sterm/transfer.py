@@ -0,0 +1,334 @@
+# STERM, a serial communication terminal with server capabilities        #
+# Copyright (C) 2013-2023  Ralf Stemmer (ralf.stemmer@gmx.net)           #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
+
+import os
+import time
+import binascii
+from threading import Condition
+
+
+# Number of bytes read from the file and transmitted at once by FileTransfer.Send
+CHUNKSIZE = 4096
+
+# Control bytes of the XMODEM and YMODEM protocols
+SOH = 0x01  # Start of a 128 byte block
+STX = 0x02  # Start of a 1024 byte block
+EOT = 0x04  # End of the file
+ACK = 0x06
+NAK = 0x15  # Block rejected, or start request of a receiver that wants checksums
+CAN = 0x18  # Cancel
+CRC = 0x43  # "C": Start request of a receiver that wants CRC-16
+PADDING = 0x1A
+
+# Seconds to wait for the receiver to start the transfer, and for the reply to a block
+STARTTIMEOUT = 60
+REPLYTIMEOUT = 10
+
+# Number of times a block gets transmitted before the transfer fails
+RETRIES = 10
+
+
+class FileTransfer(object):
+    """
+    This class transmits a file to a UART device.
+
+    ``Send`` streams the file as it is, in chunks of ``CHUNKSIZE`` bytes.
+    Each chunk gets transmitted with one ``UART.Transmit`` call,
+    so the pacing (``txpace``) and flow control (``rtscts``, ``xonxoff``) settings of the device get honored.
+    The line delay (``txlinedelay``) does not get applied, because the file is binary data, not lines.
+    While flow control stops the transmission, the ``cancel`` callback keeps getting called.
+    ``SendXMODEM`` and ``SendYMODEM`` implement the sender side of these protocols, as used by many bootloaders.
+
+    The protocols need the replies of the device.
+    They get collected by a listener (``UART.AddListener``) while a transfer is running.
+    So the data of the device must be received by another thread, like the receiver thread of *sterm*.
+    Receiving and rendering keeps running during the transfer.
+
+    After each chunk or block, the ``progress`` callback gets called with this object as argument.
+    ``sent``, ``size`` and ``Throughput`` can be used to show the state of the transfer.
+    The ``cancel`` callback gets called as well. When it returns ``True``, the transfer gets aborted.
+
+    .. code-block::
+
+        transfer = FileTransfer(uart, "firmware.bin", progress=lambda t: print(t.sent, t.Throughput()))
+        transfer.SendXMODEM(blocksize=1024)
+
+    Args:
+        uart: Instance of the ``UART`` class.
+        path (str): Path to the file to transmit
+        progress: (Optional) A callable that gets called with this object after each chunk or block
+        cancel: (Optional) A callable without arguments that returns ``True`` when the transfer shall be aborted
+
+    Raises:
+        OSError: When the file cannot be opened
+    """
+    def __init__(self, uart, path, *, progress=None, cancel=None):
+        self.uart     = uart
+        self.path     = path
+        self.progress = progress
+        self.cancel   = cancel
+        self.size     = os.path.getsize(path)
+        self.sent     = 0
+        self.starttime = time.monotonic()
+
+        self.replies   = bytearray()
+        self.condition = Condition()
+
+
+
+    def Throughput(self):
+        """
+        Returns:
+            The average number of bytes per second since the transfer started
+        """
+        duration = time.monotonic() - self.starttime
+        return self.sent / duration if duration > 0 else 0.0
+
+
+
+    def Send(self, chunksize=CHUNKSIZE):
+        """
+        Streams the file to the device without any protocol.
+
+        Args:
+            chunksize (int): Number of bytes transmitted at once. Default is ``CHUNKSIZE``
+
+        Returns:
+            *Nothing*
+
+        Raises:
+            ConnectionAbortedError: When the transfer got cancelled
+        """
+        self.starttime = time.monotonic()
+        with open(self.path, "rb") as source:
+            while True:
+                self.__CheckCancel()
+                data = source.read(chunksize)
+                if not data:
+                    break
+                self.__Transmit(data)
+                self.__Progress(len(data))
+        return
+
+
+
+    def SendXMODEM(self, blocksize=128):
+        """
+        Transmits the file with the XMODEM protocol.
+        The receiver selects between CRC-16 (start request ``"C"``) and 8 bit checksums (start request NAK).
+        With ``blocksize`` 1024 (XMODEM-1K), 1024 byte blocks get used when the receiver requested CRC-16.
+        The last block gets padded with ``0x1A``.
+
+        Args:
+            blocksize (int): 128 (XMODEM) or 1024 (XMODEM-1K). Default is 128
+
+        Returns:
+            *Nothing*
+
+        Raises:
+            ValueError: When the block size is not 128 or 1024
+            TimeoutError: When the receiver does not start the transfer or stops replying
+            ConnectionAbortedError: When the receiver or the user cancelled the transfer
+            ConnectionError: When a block got rejected too often
+        """
+        if blocksize not in (128, 1024):
+            raise ValueError("XMODEM block size must be 128 or 1024!")
+
+        self.uart.AddListener(self.__Collect)
+        try:
+            crc = self.__WaitForStart(clear=True)
+            if not crc:
+                blocksize = 128 # XMODEM-1K requires CRC-16
+            self.starttime = time.monotonic()
+            self.__SendFile(blocksize, crc)
+        finally:
+            self.uart.RemoveListener(self.__Collect)
+        return
+
+
+
+    def SendYMODEM(self):
+        """
+        Transmits the file with the YMODEM protocol (batch mode with one file).
+        The header block contains the name, size and modification time of the file.
+        Data gets transmitted in 1024 byte blocks with CRC-16.
+        After the file, an empty header block ends the batch.
+
+        Returns:
+            *Nothing*
+
+        Raises:
+            TimeoutError: When the receiver does not start the transfer or stops replying
+            ConnectionAbortedError: When the receiver or the user cancelled the transfer
+            ConnectionError: When a block got rejected too often or the receiver does not support CRC-16
+        """
+        header  = os.path.basename(self.path).encode("utf-8") + b"\0"
+        header += ("%d %o"%(self.size, int(os.path.getmtime(self.path)))).encode("ascii")
+
+        self.uart.AddListener(self.__Collect)
+        try:
+            if not self.__WaitForStart(clear=True):
+                raise ConnectionError("The receiver does not support CRC-16, which is required by YMODEM")
+            self.__SendBlock(0, header, 128 if len(header) <= 128 else 1024, True, padding=0)
+
+            self.__WaitForStart()
+            self.starttime = time.monotonic()
+            self.__SendFile(1024, True)
+
+            # End of the batch
+            self.__WaitForStart()
+            self.__SendBlock(0, b"", 128, True, padding=0)
+        finally:
+            self.uart.RemoveListener(self.__Collect)
+        return
+
+
+
+    def __SendFile(self, blocksize, crc):
+        number = 1
+        with open(self.path, "rb") as source:
+            while True:
+                data = source.read(blocksize)
+                if not data:
+                    break
+                self.__SendBlock(number & 0xFF, data, blocksize, crc)
+                self.__Progress(len(data))
+                number += 1
+
+        for attempt in range(RETRIES):
+            self.__Transmit(bytes([EOT]))
+            if self.__WaitForReply() == ACK:
+                return
+        raise ConnectionError("End of transmission was not acknowledged")
+
+
+
+    def __SendBlock(self, number, data, blocksize, crc, padding=PADDING):
+        data  = data.ljust(blocksize, bytes([padding]))
+        block = bytes([SOH if blocksize == 128 else STX, number, 0xFF - number]) + data
+        if crc:
+            block += binascii.crc_hqx(data, 0).to_bytes(2, "big")
+        else:
+            block += bytes([sum(data) & 0xFF])
+
+        for attempt in range(RETRIES):
+            self.__CheckCancel(notify=True)
+            self.__Transmit(block)
+            if self.__WaitForReply() == ACK:
+                return
+        raise ConnectionError("Block %d got rejected %d times"%(number, RETRIES))
+
+
+
+    def __WaitForStart(self, clear=False):
+        """
+        Waits for the start request of the receiver.
+        With ``clear``, data that was received before (like boot messages) gets ignored.
+
+        Returns:
+            ``True`` when the receiver requested CRC-16, ``False`` for checksums
+        """
+        if clear:
+            with self.condition:
+                self.replies.clear()
+        while True:
+            reply = self.__Read(STARTTIMEOUT)
+            if reply is None:
+                raise TimeoutError("The receiver did not start the transfer within %d seconds"%(STARTTIMEOUT))
+            if reply in (CRC, NAK):
+                return reply == CRC
+            if reply == CAN:
+                raise ConnectionAbortedError("The receiver cancelled the transfer")
+
+
+
+    def __WaitForReply(self):
+        """
+        Waits for ACK or NAK. Other bytes get ignored.
+
+        Returns:
+            ``ACK``, ``NAK`` or ``None`` on timeout
+        """
+        while True:
+            reply = self.__Read(REPLYTIMEOUT)
+            if reply in (ACK, NAK, None):
+                return reply
+            if reply == CAN and self.__Read(1) == CAN:
+                raise ConnectionAbortedError("The receiver cancelled the transfer")
+
+
+
+    def __Read(self, timeout):
+        """
+        Returns the next byte received from the device, or ``None`` after ``timeout`` seconds.
+        """
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while not self.replies:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                # Wake up regularly to check if the user cancelled the transfer
+                self.condition.wait(min(remaining, 0.1))
+                self.__CheckCancel(notify=True)
+            reply = self.replies[0]
+            del self.replies[0]
+            return reply
+
+
+
+    def __Collect(self, data):
+        with self.condition:
+            self.replies += data
+            self.condition.notify()
+
+
+
+    def __CheckCancel(self, notify=False):
+        """
+        Raises ``ConnectionAbortedError`` when the ``cancel`` callback returns ``True``.
+        With ``notify``, the receiver gets told by CAN bytes.
+        """
+        if self.cancel and self.cancel():
+            if notify:
+                try:
+                    # Only when the device accepts it right away, flow control may have stopped the transmission
+                    self.uart.Transmit(bytes([CAN, CAN, CAN]), linedelay=False, cancel=lambda: True)
+                except ConnectionAbortedError:
+                    pass
+            raise ConnectionAbortedError("Transfer cancelled")
+
+
+
+    def __Transmit(self, data):
+        """
+        Transmits data without line delay. The transfer can be cancelled while flow control stops the transmission.
+        Raises ``ConnectionError`` when the device got lost, instead of letting ``UART.Transmit`` discard the data.
+        """
+        if not self.uart.Connected():
+            raise ConnectionError("Connection to device %s lost"%(self.uart.devpath))
+        self.uart.Transmit(data, linedelay=False, cancel=self.cancel)
+
+
+
+    def __Progress(self, length):
+        self.sent += length
+        if self.progress:
+            self.progress(self)
+
+
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
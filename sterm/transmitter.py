@@ -0,0 +1,130 @@
+# STERM, a serial communication terminal with server capabilities        #
+# Copyright (C) 2013-2023  Ralf Stemmer (ralf.stemmer@gmx.net)           #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
+
+import queue
+from threading import Thread, Lock
+
+
+# Default maximum number of bytes waiting in the queue of the transmitter thread
+QUEUESIZE = 1024*1024
+
+
+class Transmitter(object):
+    """
+    This class transmits data to a UART device from a separate thread.
+
+    Code on the receive path (listeners and selector callbacks, like trigger actions or the data of network clients)
+    must not block, but ``UART.Transmit`` can block for any length of time
+    when the transmission is paced (``txpace``, ``txlinedelay``) or stopped by flow control.
+    ``Transmit`` and ``Call`` only put the data or the call into a queue and never block.
+    The thread executes them in order.
+
+    The queued data is bounded by ``queuesize`` bytes.
+    When the queue is full, the data gets discarded and counted as ``tx_queue_dropped_bytes`` in ``UART.stats``.
+    Errors (like a device that got lost during the transmission) get counted as ``tx_errors``,
+    the data or call that failed gets discarded.
+
+    Args:
+        uart: Instance of the ``UART`` class.
+        queuesize (int): Maximum number of bytes waiting to be transmitted. Default is ``QUEUESIZE``
+    """
+    def __init__(self, uart, queuesize=QUEUESIZE):
+        self.uart      = uart
+        self.queuesize = queuesize
+        self.queued    = 0      # Number of bytes waiting in the queue
+        self.lock      = Lock() # Protects queued
+        self.queue     = queue.Queue()
+        self.closing   = False
+
+        self.thread = Thread(target=self.__Run, name="Transmitter", daemon=True)
+        self.thread.start()
+
+
+
+    def Transmit(self, data):
+        """
+        Queues data for ``UART.Transmit``. This method never blocks.
+
+        Args:
+            data (str, bytes): The data to transmit
+
+        Returns:
+            ``True`` when the data got queued, ``False`` when it got discarded because the queue is full
+        """
+        with self.lock:
+            if self.closing or self.queued + len(data) > self.queuesize:
+                self.uart.stats.Count("tx_queue_dropped_bytes", len(data))
+                return False
+            self.queued += len(data)
+        self.queue.put((data, None, ()))
+        return True
+
+
+
+    def Call(self, function, *args):
+        """
+        Queues a call that shall not be executed on the receive path (like starting a process).
+        The call gets executed by the thread in order with the queued data.
+
+        Args:
+            function: A callable
+            args: The arguments for ``function``
+
+        Returns:
+            *Nothing*
+        """
+        self.queue.put((b"", function, args))
+        return
+
+
+
+    def Close(self):
+        """
+        Stops the thread. Queued data gets discarded and a transmission that got stopped by flow control gets aborted.
+
+        Returns:
+            *Nothing*
+        """
+        with self.lock:
+            self.closing = True
+        self.queue.put(None)
+        self.thread.join()
+        return
+
+
+
+    def __Run(self):
+        while True:
+            item = self.queue.get()
+            if item is None or self.closing:
+                return
+
+            data, function, args = item
+            try:
+                if function is None:
+                    self.uart.Transmit(data, cancel=lambda: self.closing)
+                else:
+                    function(*args)
+            except OSError:
+                if not self.closing:
+                    self.uart.stats.Count("tx_errors")
+            finally:
+                with self.lock:
+                    self.queued -= len(data)
+
+
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
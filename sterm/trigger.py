@@ -0,0 +1,267 @@
+# STERM, a serial communication terminal with server capabilities        #
+# Copyright (C) 2013-2023  Ralf Stemmer (ralf.stemmer@gmx.net)           #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
+
+import os
+import re
+import time
+import codecs
+import collections
+
+
+# Syntax of a trigger definition (--trigger): PATTERN=ACTION
+TRIGGERSYNTAX = re.compile(r"^(.+?)=(highlight|mark|send:.*|exec:.*)$", re.DOTALL)
+
+
+class Automaton(object):
+    """
+    This class searches for many byte patterns at once (Aho-Corasick algorithm).
+    All patterns get compiled into one deterministic automaton with a complete transition table,
+    so each byte costs one table lookup, independent of the number of patterns.
+
+    The state of the automaton gets passed into and returned by ``Scan``,
+    so matches that span two or more chunks are found.
+
+    While the automaton is in its initial state, bytes that cannot start any pattern
+    get skipped by one ``re.search`` call for a character class of all first bytes.
+    So for most data, the scan runs in C and not byte by byte in Python.
+
+    Args:
+        patterns (list): List of byte patterns
+
+    Raises:
+        ValueError: When a pattern is empty or there are no patterns at all
+    """
+    def __init__(self, patterns):
+        if not patterns:
+            raise ValueError("No patterns given!")
+        if not all(patterns):
+            raise ValueError("Patterns must not be empty!")
+
+        self.patterns = list(patterns)
+
+        # Build the trie
+        transitions = [{}]
+        outputs     = [[]]
+        for index, pattern in enumerate(self.patterns):
+            state = 0
+            for byte in pattern:
+                if byte not in transitions[state]:
+                    transitions.append({})
+                    outputs.append([])
+                    transitions[state][byte] = len(transitions) - 1
+                state = transitions[state][byte]
+            outputs[state].append(index)
+
+        # Resolve the failure links into a complete transition table (breadth first)
+        self.table    = [None] * len(transitions)
+        self.table[0] = [transitions[0].get(byte, 0) for byte in range(256)]
+        failure = [0] * len(transitions)
+        queue   = collections.deque(transitions[0].values())
+        while queue:
+            state = queue.popleft()
+            outputs[state] += outputs[failure[state]]
+            row = list(self.table[failure[state]])
+            for byte, nextstate in transitions[state].items():
+                failure[nextstate] = self.table[failure[state]][byte]
+                row[byte] = nextstate
+                queue.append(nextstate)
+            self.table[state] = row
+
+        self.outputs = [tuple(output) for output in outputs]
+        firstbytes   = bytes(sorted(set(pattern[0] for pattern in self.patterns)))
+        self.first   = re.compile(b"[" + b"".join(re.escape(bytes([byte])) for byte in firstbytes) + b"]")
+
+
+
+    def Scan(self, data, state=0):
+        """
+        Scans a chunk of data.
+
+        Args:
+            data (bytes): The data to scan
+            state (int): State returned by the previous call of this method. ``0`` at the start of the stream.
+
+        Returns:
+            A tuple of the list of matches and the new state.
+            Each match is a tuple of the index of the pattern and the offset in ``data`` behind the last byte of the match.
+            For a match that started in a previous chunk, only the end is inside ``data``.
+        """
+        table   = self.table
+        outputs = self.outputs
+        matches = []
+        position = 0
+        length   = len(data)
+        while position < length:
+            if state == 0:
+                found = self.first.search(data, position)
+                if found is None:
+                    break
+                position = found.start()
+
+            state     = table[state][data[position]]
+            position += 1
+            if outputs[state]:
+                for index in outputs[state]:
+                    matches.append((index, position))
+        return matches, state
+
+
+
+def ParseTrigger(definition):
+    r"""
+    This function splits a trigger definition ``PATTERN=ACTION`` into its parts.
+    Escape sequences like ``\n``, ``\r`` or ``\x00`` in the pattern and in the argument of an action get decoded.
+
+    The following actions are supported:
+
+        * ``highlight``: Print a highlighted notice and ring the bell
+        * ``mark``: Write a marker into the log file, in front of the chunk that completed the pattern.
+          Capture log files only contain received data, so no markers get written into them
+        * ``send:TEXT``: Transmit ``TEXT`` to the device
+        * ``exec:COMMAND``: Run ``COMMAND`` in a shell, without waiting for it
+
+    Args:
+        definition (str): The trigger definition
+
+    Returns:
+        A tuple of the pattern (``bytes``), the action (``str``) and the argument of the action (``bytes`` or ``None``)
+
+    Raises:
+        ValueError: When the definition is invalid
+    """
+    match = TRIGGERSYNTAX.match(definition)
+    if match is None:
+        raise ValueError("Invalid trigger \"%s\"! Expected PATTERN=highlight, PATTERN=mark, PATTERN=send:TEXT or PATTERN=exec:COMMAND"%(definition))
+
+    pattern = codecs.escape_decode(match.group(1).encode("utf-8"))[0]
+    action, _, argument = match.group(2).partition(":")
+    if action in ("send", "exec"):
+        argument = codecs.escape_decode(argument.encode("utf-8"))[0]
+    else:
+        argument = None
+    return pattern, action, argument
+
+
+
+class Triggers(object):
+    """
+    This class executes actions when patterns appear in the data received from a UART device.
+    The ``Scan`` method must be registered as listener of the device (``UART.AddListener``),
+    then each received byte gets scanned exactly once, also when a pattern is split over two chunks.
+    See ``Automaton`` for details.
+
+    The ``mark`` action gets executed immediately.
+    The actions ``send`` and ``exec`` can block (paced transmission, flow control, starting a process),
+    so they get queued to a ``sterm.transmitter.Transmitter`` thread and do not stall the receive path.
+    ``Close`` stops that thread.
+    The notices of the ``highlight`` action get collected and must be fetched by ``Notices``
+    after the received data got written to the terminal, so that they appear behind the matching data.
+
+    Args:
+        uart: Instance of the ``UART`` class.
+        triggers (list): List of tuples returned by ``ParseTrigger``
+
+    Raises:
+        ValueError: When a pattern is empty
+    """
+    def __init__(self, uart, triggers):
+        self.uart      = uart
+        self.triggers  = list(triggers)
+        self.automaton = Automaton([pattern for pattern, action, argument in self.triggers])
+        self.state     = 0
+        self.notices   = []
+        self.processes = []
+
+        self.transmitter = None
+        if any(action in ("send", "exec") for pattern, action, argument in self.triggers):
+            from sterm.transmitter import Transmitter
+            self.transmitter = Transmitter(uart)
+
+
+
+    def Scan(self, data):
+        """
+        Scans received data and executes the actions of all matching triggers.
+
+        Args:
+            data (bytes): The received data
+
+        Returns:
+            *Nothing*
+        """
+        matches, self.state = self.automaton.Scan(data, self.state)
+        for index, end in matches:
+            self.__Fire(*self.triggers[index])
+        return
+
+
+
+    def Notices(self):
+        """
+        Returns and clears the notices of triggers with the ``highlight`` action.
+
+        Returns:
+            A string with one highlighted line per notice, or an empty string
+        """
+        notices      = "".join(self.notices)
+        self.notices = []
+        return notices
+
+
+
+    def Close(self):
+        """
+        Stops the thread that executes the ``send`` and ``exec`` actions.
+        Actions that did not get executed yet get discarded.
+
+        Returns:
+            *Nothing*
+        """
+        if self.transmitter:
+            self.transmitter.Close()
+        return
+
+
+
+    def __Fire(self, pattern, action, argument):
+        name = pattern.decode("utf-8", "backslashreplace")
+        if action == "highlight":
+            self.notices.append("\033[1;7m[sterm: trigger \"%s\"]\033[0m\a\n"%(name))
+
+        elif action == "mark":
+            # A marker in a capture log file would be indistinguishable from received data
+            if self.uart.logfile and self.uart.logformat != "capture":
+                self.uart.logfile.Write("\n[sterm: trigger \"%s\" at %s]\n"%(name, time.strftime("%Y-%m-%d %H:%M:%S")))
+
+        elif action == "send":
+            self.transmitter.Transmit(argument)
+
+        elif action == "exec":
+            self.transmitter.Call(self.__Execute, name, argument)
+
+
+
+    def __Execute(self, name, command):
+        import subprocess
+        # Reap finished commands, so that they do not stay as zombies
+        self.processes = [process for process in self.processes if process.poll() is None]
+        environment = dict(os.environ, STERM_TRIGGER=name, STERM_DEVICE=self.uart.devpath)
+        self.processes.append(subprocess.Popen(command, shell=True, env=environment,
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+
+
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
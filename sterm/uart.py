@@ -14,35 +14,50 @@
 # You should have received a copy of the GNU General Public License      #
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
 
+import os
 import sys
-import binascii
+import time
+import select
 from enum import Enum
-from serial import *
+from threading import Lock
+from sterm.formatter import TextFormatter, HexFormatter, HexdumpFormatter
+# sterm.framing, sterm.logger, sterm.capture and sterm.stats get imported where they are used,
+# so that importing this module stays fast
 
 
 
 class UARTMode(Enum):
     BINARY  = 1
     TEXT    = 2
+    HEXDUMP = 3
+    FRAMES  = 4
 
 # Mapping the format-string (--format) to the pyserial-parameters.
 # This is just a subset of possible parameters. See pyserial-docs to extend these maps.
+# The values are the ones of the pyserial constants (like serial.EIGHTBITS),
+# so that pyserial does not need to be imported before a device gets opened.
 BYTESIZEMAP = {}
-BYTESIZEMAP["5"] = FIVEBITS
-BYTESIZEMAP["6"] = SIXBITS
-BYTESIZEMAP["7"] = SEVENBITS
-BYTESIZEMAP["8"] = EIGHTBITS
+BYTESIZEMAP["5"] = 5    # FIVEBITS
+BYTESIZEMAP["6"] = 6    # SIXBITS
+BYTESIZEMAP["7"] = 7    # SEVENBITS
+BYTESIZEMAP["8"] = 8    # EIGHTBITS
 PARITYMAP = {}
-PARITYMAP["N"] = PARITY_NONE
-PARITYMAP["E"] = PARITY_EVEN
-PARITYMAP["O"] = PARITY_ODD
+PARITYMAP["N"] = "N"    # PARITY_NONE
+PARITYMAP["E"] = "E"    # PARITY_EVEN
+PARITYMAP["O"] = "O"    # PARITY_ODD
 STOPBITMAP = {}
-STOPBITMAP["1"] = STOPBITS_ONE
-STOPBITMAP["2"] = STOPBITS_TWO
+STOPBITMAP["1"] = 1     # STOPBITS_ONE
+STOPBITMAP["2"] = 2     # STOPBITS_TWO
+
+# Size of the preallocated receive buffer. This is the maximum number of bytes returned by one receive call.
+RXBUFFERSIZE = 64*1024
+
+# Default maximum length of a line returned by UART.IterLines. Longer lines get split.
+MAXLINELENGTH = 64*1024
+
+# Seconds between two calls of the cancel callback of UART.Transmit while the device does not accept data
+WRITEPOLL = 0.1
 
-# TODO:
-# Automatic disconnect
-# Support with-environment
 # TODO: support path-type for devpath and logpath
 # TODO: logfile currently only stores received information, not entered data
 
@@ -55,29 +70,102 @@ class UART(object):
     This class manages the connection to a UART device.
 
     When creating an object, the connection gets automatically established.
+    Used in a ``with`` statement, the connection gets closed at the end of the block.
 
     Whenever an exception occurs, it gets passed through.
     This class does not do any output to *stdout* or *stderr*.
 
+    Received data can be streamed by iterating over an instance, which returns the data interpreted
+    the same way ``Receive`` does, or with the generators ``IterChunks``, ``IterLines`` and ``IterBytes``
+    that return raw data.
+    They wait for data inside ``select`` and keep only bounded buffers, so they can run for days with flat memory use.
+
+    .. code-block::
+
+        with UART("/dev/ttyUSB0", 115200, "8N1") as uart:
+            for line in uart.IterLines():
+                if b"ERROR" in line:
+                    print(line.decode("utf-8", "replace"), end="")
+
     Args:
         devpath (str): Path to the UART device (like ``"/dev/ttyUSB0"``)
         baudrate (int): Baud rate used for the data transfer
         dataformat (str): The three-letter format string of defining the type of data. (like ``"8N1"``)
-        uartmode (UARTMode): Definition if the methods work in *binary mode* or *text mode* (UTF-8)
+        uartmode (UARTMode): Definition if the methods work in *binary mode*, *hexdump mode*, *frame mode* or *text mode* (UTF-8)
         logpath (str): Write all received data into the given log file
+        logmaxsize (int): Rotate the log file when it becomes larger than the given number of bytes
+        loginterval (float): Rotate the log file after the given number of seconds
+        logcompression (str): Compress rotated log files (``"gz"`` or ``"xz"``)
+        logformat (str): Format of the log file: ``"plain"`` (default) or ``"capture"``.
+            The *capture* format stores the raw received chunks with timestamps, see ``sterm.capture.CaptureWriter``.
+        decodeerrors (str): How to handle invalid UTF-8 data in *text mode*: ``"replace"``, ``"escape"`` or ``"passthrough"``.
+            See ``sterm.formatter.TextFormatter`` for details.
+        txpace (float): Limit the transmission rate to the given number of bytes per millisecond
+        txlinedelay (float): Wait the given number of seconds after transmitting a line break
+        framing (str): Framing of the received data in *frame mode*, see ``sterm.framing.ParseFraming``. Default is ``"slip"``
+        framecrc (str): (Optional) CRC at the end of each frame in *frame mode*, see ``sterm.framing.CRCS``
+        rtscts (bool): Enable hardware flow control (RTS/CTS). Transmitting pauses while the device deasserts CTS
+        xonxoff (bool): Enable software flow control (XON/XOFF)
+        readersize (int): (Optional) Read the device in a separate process into a shared memory ring buffer
+            of the given number of bytes, see ``sterm.reader.ReaderProcess``.
+            Then reading the device does not get delayed by slow rendering or logging.
 
     Raises:
-        ValueError: When the format string is not following the specified scheme
+        ValueError: When the format string is not following the specified scheme,
+            the UARTMode is not supported, the decode error policy, the log format, the framing or the CRC is unknown
     """
-    def __init__(self, devpath, baudrate, dataformat, *, uartmode=UARTMode.TEXT, logpath=None):
+    def __init__(self, devpath, baudrate, dataformat, *, uartmode=UARTMode.TEXT, logpath=None, logmaxsize=None, loginterval=None, logcompression=None, logformat="plain", decodeerrors="escape", txpace=None, txlinedelay=None, framing="slip", framecrc=None, rtscts=False, xonxoff=False, readersize=None):
         self.devpath    = devpath
         self.baudrate   = baudrate
         self.uartmode   = uartmode
         self.logpath    = logpath
+        self.logmaxsize     = logmaxsize
+        self.loginterval    = loginterval
+        self.logcompression = logcompression
+        self.logformat      = logformat
+        self.txpace         = txpace
+        self.txlinedelay    = txlinedelay
+        self.rtscts         = rtscts
+        self.xonxoff        = xonxoff
+        self.readersize     = readersize
 
         # Set some defaults - will be updated by calling __Connect
         self.logfile    = None
         self.uart       = None
+        self.txlock     = Lock()    # Protects the handle while writing, Hangup can get called by another thread
+        self.reader     = None
+        self.dropped    = (0, 0)   # Overflows of the ring buffers of previous connections (see Dropped)
+        self.listeners  = []
+
+        from sterm.stats import Statistics
+        self.stats      = Statistics("uart", {"device": devpath})
+        self.stats.AddGauge("connected", lambda: int(self.Connected()))
+        self.readbuffer = memoryview(bytearray(RXBUFFERSIZE))
+
+        # Select how received data gets rendered
+        if uartmode == UARTMode.TEXT:
+            self.formatter = TextFormatter(decodeerrors)
+        elif uartmode == UARTMode.BINARY:
+            self.formatter = HexFormatter()
+        elif uartmode == UARTMode.HEXDUMP:
+            self.formatter = HexdumpFormatter()
+        elif uartmode == UARTMode.FRAMES:
+            from sterm.framing import FrameFormatter, ParseFraming
+            self.formatter = FrameFormatter(ParseFraming(framing), framecrc)
+        else:
+            raise ValueError("Unknown/Unsupported UARMode!")
+        if uartmode == UARTMode.TEXT:
+            self.stats.AddGauge("rx_invalid_bytes", lambda: self.formatter.invalidbytes)
+        if uartmode == UARTMode.FRAMES:
+            self.stats.AddGauge("rx_frames",            lambda: self.formatter.frames)
+            self.stats.AddGauge("rx_frame_errors",      lambda: self.formatter.decoder.errors)
+            self.stats.AddGauge("rx_frame_crc_errors",  lambda: self.formatter.crcerrors)
+        if readersize:
+            self.stats.AddGauge("rx_ring_dropped_bytes", lambda: self.Dropped()[0])
+            self.stats.AddGauge("rx_ring_overflows",     lambda: self.Dropped()[1])
+
+        if logformat not in ("plain", "capture"):
+            raise ValueError("Unknown log format \"%s\"! Valid formats are: plain, capture"%(logformat))
 
         # Translate format-string
         try:
@@ -95,8 +183,9 @@ class UART(object):
         This method opens a connection to a UART device.
 
         If logging is enabled, the log files gets opened as well.
-        In *binary mode* the files gets opened to append binary data (``"ab"``), otherwise
-        it is opened to append text data (``"at"``).
+        The log file gets written by a ``sterm.logger.LogWriter`` in a separate thread,
+        so that writing the log file never blocks receiving data.
+        When the log file cannot be opened, the device gets closed again.
 
         In case an expection raises, an error message gets printed to *stderr* and then the
         exception gets raised again.
@@ -107,27 +196,117 @@ class UART(object):
         Raises:
             SerialException: In case the device can not be found or can not be configured.
             ValueError: When the UART configuration is out of valid range
+            ValueError: When the log compression is unknown
+            ValueError: When the log format is *capture* and the log file exists but is not a capture file
             IOError: In case there is some trouble opening the log file
         """
         # Open remote terminal device
+        self.__Open()
+
+        # open log file
+        if type(self.logpath) is str:
+            if self.logformat == "capture":
+                from sterm.capture import CaptureWriter as writer
+            else:
+                from sterm.logger  import LogWriter     as writer
+            try:
+                self.logfile = writer(self.logpath,
+                    maxsize     = self.logmaxsize,
+                    interval    = self.loginterval,
+                    compression = self.logcompression)
+            except Exception:
+                self.Hangup()   # Do not leave the device open when the log file cannot be used
+                raise
+        return
+
+
+
+    def __Open(self):
+        from serial import Serial   # Imported on first use, so that importing this module stays fast
         self.uart = Serial(
             port    = self.devpath,
             baudrate= self.baudrate,
             bytesize= self.bytesize,
             parity  = self.parity,
             stopbits= self.stopbits,
+            rtscts  = self.rtscts,
+            xonxoff = self.xonxoff,
             timeout = 0.1,
             interCharTimeout=None
         )
 
-        # open log file
-        if type(self.logpath) is str:
-            if self.uartmode == UARTMode.BINARY:
-                filemode = "ab" # append to binary file
-            else:
-                filemode = "at" # append to text file
+        if self.readersize:
+            from sterm.reader import ReaderProcess
+            try:
+                self.reader = ReaderProcess(self.uart.fileno(), self.readersize)
+            except:
+                self.uart.close()
+                self.uart = None
+                raise
+        return
+
+
+
+    def Connected(self):
+        """
+        Returns:
+            ``True`` when the device is open, ``False`` when it got lost (see ``Hangup``) or disconnected
+        """
+        return self.uart is not None
+
+
+
+    def Hangup(self):
+        """
+        This method closes the handle of a device that got lost (like an unplugged USB-serial adapter),
+        so that it can be reopened by ``Reconnect``.
+        Closing the handle early matters: as long as it is open, the kernel keeps the old device node
+        and a reconnected adapter would get a new name (like ``/dev/ttyUSB1``).
 
-            self.logfile = open(self.logpath, filemode)
+        The log file, the listeners, the statistics and the state of the UART mode are kept.
+        Until the device got reconnected, transmitted data gets discarded and counted as ``tx_discarded_bytes``.
+        This method can be called while another thread is inside ``Transmit``.
+        Then that transmission gets aborted with a ``ConnectionError``.
+
+        Returns:
+            *Nothing*
+        """
+        if self.reader:
+            dropped      = self.reader.Dropped()
+            self.dropped = (self.dropped[0] + dropped[0], self.dropped[1] + dropped[1])
+            self.reader.Stop()
+            self.reader = None
+
+        with self.txlock:
+            uart, self.uart = self.uart, None
+        if uart is not None:
+            try:
+                uart.close()
+            except OSError:
+                pass # The device is gone anyway
+        return
+
+
+
+    def Reconnect(self):
+        """
+        This method opens the device again with the same settings, after it got lost.
+        An open handle gets closed first (see ``Hangup``).
+        The log file keeps on being written and the listeners stay registered.
+        The file descriptor of the device changes, so the device must be registered again at selectors.
+
+        Reconnects get counted as ``reconnects`` in ``UART.stats``.
+
+        Returns:
+            *Nothing*
+
+        Raises:
+            SerialException: In case the device can not be opened (yet), like when it does not exist
+                or the permissions are not set up yet.
+        """
+        self.Hangup()
+        self.__Open()
+        self.stats.Count("reconnects")
         return
 
 
@@ -136,23 +315,241 @@ class UART(object):
         """
         This method closes the connection to the UART device.
         If a logging is enabled, the log files gets closed as well.
+        Incomplete UTF-8 characters that are still hold back by the decoder get written into the log file.
+        This method blocks until all queued log data is written.
 
         Returns:
             *Nothing*
         """
-        self.uart.close()
+        self.Hangup()
         if self.logfile:
-            self.logfile.close()
+            if self.uartmode == UARTMode.TEXT and self.logformat == "plain":
+                self.logfile.Write(self.formatter.Flush())
+            self.logfile.Close()
+        return
+
+
+
+    def __enter__(self):
+        return self
+
+
+
+    def __exit__(self, exctype, exception, traceback):
+        self.Disconnect()
+        return False
+
+
+
+    def __iter__(self):
+        """
+        Iterating over an instance returns the received data as strings, interpreted like ``Receive`` does.
+        The iteration blocks until data arrives and ends when the device got lost.
+        """
+        return self.__Chunks(None, self.Receive)
+
+
+
+    def IterChunks(self, timeout=None):
+        """
+        This generator returns the raw received data, one ``bytes`` object for each read (see ``ReceiveInto``).
+        It blocks until data arrives.
+        The iteration ends when the device got lost or when no data arrived for ``timeout`` seconds.
+
+        Args:
+            timeout (float): (Optional) End the iteration after the given number of seconds without data.
+                ``None`` waits forever.
+
+        Returns:
+            A generator of ``bytes`` objects of at most ``RXBUFFERSIZE`` bytes
+        """
+        for data in self.__Chunks(timeout, self.ReceiveInto):
+            yield bytes(data)
+
+
+
+    def IterLines(self, separator=b"\n", maxlength=MAXLINELENGTH, timeout=None):
+        """
+        This generator returns the raw received data line by line.
+        Each line includes its separator.
+        Only newly received data gets searched for the separator.
+        Lines longer than ``maxlength`` bytes get split, so the internal buffer never grows beyond that size
+        plus one read.
+        When the iteration ends (like ``IterChunks``), an incomplete last line gets returned as it is.
+
+        Args:
+            separator (bytes): The sequence of bytes that ends a line. Default is ``b"\n"``
+            maxlength (int): Maximum length of a line in bytes. Default is ``MAXLINELENGTH``
+            timeout (float): (Optional) End the iteration after the given number of seconds without data.
+
+        Returns:
+            A generator of ``bytes`` objects
+
+        Raises:
+            ValueError: When the separator is empty or ``maxlength`` is not positive
+        """
+        if not separator:
+            raise ValueError("Line separator must not be empty!")
+        if maxlength <= 0:
+            raise ValueError("Maximum line length must be positive!")
+        return self.__Lines(separator, maxlength, timeout)
+
+
+
+    def __Lines(self, separator, maxlength, timeout):
+        buffer = bytearray()
+        for data in self.__Chunks(timeout, self.ReceiveInto):
+            scanned = max(0, len(buffer) - len(separator) + 1)
+            buffer += data
+
+            start = 0
+            while True:
+                index = buffer.find(separator, max(start, scanned))
+                if index < 0:
+                    break
+                end = index + len(separator)
+                yield bytes(buffer[start:end])
+                start = end
+            while len(buffer) - start > maxlength:
+                yield bytes(buffer[start:start+maxlength])
+                start += maxlength
+            del buffer[:start]
+
+        if buffer:
+            yield bytes(buffer)
+
+
+
+    def IterBytes(self, size, timeout=None):
+        """
+        This generator returns the raw received data in blocks of ``size`` bytes.
+        When the iteration ends (like ``IterChunks``), the remaining data gets returned as a shorter block.
+
+        Args:
+            size (int): Number of bytes of each block
+            timeout (float): (Optional) End the iteration after the given number of seconds without data.
+
+        Returns:
+            A generator of ``bytes`` objects
+
+        Raises:
+            ValueError: When the size is not positive
+        """
+        if size <= 0:
+            raise ValueError("Block size must be positive!")
+        return self.__Blocks(size, timeout)
+
+
+
+    def __Blocks(self, size, timeout):
+        buffer = bytearray()
+        for data in self.__Chunks(timeout, self.ReceiveInto):
+            buffer += data
+            end = len(buffer) - len(buffer) % size
+            for offset in range(0, end, size):
+                yield bytes(buffer[offset:offset+size])
+            del buffer[:end]
+
+        if buffer:
+            yield bytes(buffer)
+
+
+
+    def __Chunks(self, timeout, receive):
+        """
+        Waits for data and returns the results of ``receive`` until the device got lost or ``timeout`` is over.
+        """
+        while True:
+            readable, _, _ = select.select([self], [], [], timeout)
+            if not readable:
+                return
+            data = receive()
+            if data is None:
+                return  # Readable but no data: the device got lost
+            if data:
+                yield data
+
+
+
+    def AddListener(self, callback):
+        """
+        This method adds a function that gets called with the raw received data
+        whenever new data was received.
+        The data is a ``memoryview`` of the receive buffer that gets reused by the next read.
+        So a listener that keeps the data beyond the call must copy it (like ``bytes(data)``).
+        The listeners get called before the data gets interpreted by the UART mode.
+        They must not block because they are called on the receive path.
+        Listeners stay registered when the device gets reconnected (see ``Reconnect``).
+
+        Args:
+            callback: A callable that takes one argument
+
+        Returns:
+            *Nothing*
+        """
+        self.listeners.append(callback)
         return
 
 
 
+    def RemoveListener(self, callback):
+        """
+        This method removes a function that was added by ``AddListener``.
+
+        Args:
+            callback: The callable to remove
+
+        Returns:
+            *Nothing*
+        """
+        self.listeners.remove(callback)
+        return
+
+
+
+    def Dropped(self):
+        """
+        This method returns how much received data got lost because the ring buffer of the reader process was full
+        (see the ``readersize`` argument of the constructor).
+        The data was read from the device, so it did not overflow the buffers of the operating system,
+        but it never reached the receive methods, the listeners or the log file.
+
+        Returns:
+            A tuple of the number of lost bytes and the number of reads they got lost by. ``(0, 0)`` without reader process.
+        """
+        if self.reader is None:
+            return self.dropped
+        dropped = self.reader.Dropped()
+        return self.dropped[0] + dropped[0], self.dropped[1] + dropped[1]
+
+
+
+    def fileno(self):
+        """
+        This method returns the file descriptor of the UART device.
+        It allows to pass an instance of this class directly to ``select`` or the ``selectors`` module,
+        so that a caller can wait for incoming data instead of polling.
+        With a reader process, this is the file descriptor that signals new data in its ring buffer.
+
+        Returns:
+            The file descriptor (``int``) of the opened UART device
+
+        Raises:
+            AttributeError: When the device is not connected (see ``Hangup``)
+        """
+        if self.reader:
+            return self.reader.fileno()
+        return self.uart.fileno()
+
+
+
     def Receive(self):
         """
         This function reads all data from the serial input buffer that is available.
         The read data then gets interpreted and returned.
         The function is non-blocking since it only gets the data that is in the device's buffers,
         but it does not wait for new data.
+        The data gets read by ``ReceiveInto``, so there is no copy of the raw data except the one made by decoding it.
 
         The way the data is interpreted depends on the UART mode set in the constructor.
 
@@ -160,65 +557,187 @@ class UART(object):
         space separated and a space at the end of the byte stream.
         So when receiving the two bytes ``23``, ``42`` the output is ``0x23 0x42 ``.
 
+        In *hexdump mode* (``UARTMode.HEXDUMP``) the received bytes get printed like ``hexdump -C`` does,
+        with offsets and an ASCII column.
+        See ``sterm.formatter.HexdumpFormatter`` for details.
+
+        In *frame mode* (``UARTMode.FRAMES``) the received data gets split into frames (like SLIP or COBS frames)
+        and each complete frame gets printed as one line with a timestamp.
+        Frames that are split between two reads get completed with the next call of this method.
+        See ``sterm.framing.FrameFormatter`` for details.
+
         In *UTF-8 mode* (``UARTMode.TEXT``) the received data gets interpreted as UTF-8 encoded Unicode string.
-        When an UnicodeDecodeError-Exception occurs, the raw data gets printed between ``[]``.
+        Characters that are split between two reads get completed with the next call of this method.
+        Invalid bytes get handled as defined by the ``decodeerrors`` argument of the constructor.
+        By default each invalid byte gets printed as ``[0xNN]``.
 
         Is logging enabled, then all received data gets written into the log file.
-        In *binary mode* the data gets stored binary, otherwise it gets stored UTF-8 encoded.
+        In *binary mode* and *hexdump mode* the data gets stored binary, otherwise it gets stored UTF-8 encoded.
+        In *frame mode*, the formatted frames get stored, one line per frame.
+        With the *capture* log format, the raw received data gets stored in all modes.
         Also ANSI-Escape-Sequences will be stored in the file.
         The file gets opened in *append mode*. Old data will not be overwritten.
+        All functions added by ``AddListener`` get called with the raw received data.
+
+        Writing the log file is done by a separate thread.
+        If that thread cannot keep up, data gets dropped from the log file (not from the returned string)
+        and counted by the ``LogWriter`` in ``UART.logfile``.
+
+        The number of received bytes and chunks, the chunk sizes and reads without data
+        get counted in ``UART.stats`` (see ``sterm.stats.Statistics``).
+
+        With a reader process (``readersize``), the data gets taken from its ring buffer.
+        Then an empty string gets returned when there was a wake up without new data.
+
+        An empty string does not mean that the device got lost.
+        It also gets returned when the received data is not complete yet,
+        like the first byte of a multibyte character or a part of a frame.
+        Only ``None`` signals a lost device.
 
         Returns:
-            A string of received data or ``None`` when no data is available.
+            A string of received data (may be empty) or ``None`` when the device got lost.
+        """
+        data = self.__Read()
+        if data is None:
+            return None
+        if not data:
+            return ""
 
-        Raises:
-            ValueError: When UARTMode is not supported / invalid
+        string = self.formatter.Format(data)
+
+        if self.logfile:
+            if self.uartmode in (UARTMode.TEXT, UARTMode.FRAMES) and self.logformat == "plain":
+                self.logfile.Write(string)
+            else:
+                self.logfile.Write(data)
+
+        return string
+
+
+
+    def ReceiveRaw(self):
         """
+        This method reads all data from the serial input buffer that is available, like ``Receive``,
+        but returns the raw bytes without interpreting them by the UART mode.
+        This is a copying wrapper around ``ReceiveInto``.
 
-        # Read all available data from the serial input buffer
-        try:
-            data = self.uart.read(self.uart.in_waiting)
-        except:
+        Returns:
+            The received data as ``bytes`` or ``None`` when no data is available.
+        """
+        data = self.ReceiveInto()
+        if data is None:
             return None
+        return bytes(data)
 
 
-        if self.uartmode == UARTMode.TEXT:
-            try:
-                string = data.decode("utf-8")
-            except UnicodeDecodeError:
-                string = "[" + str(data) + "]"
 
-        elif self.uartmode == UARTMode.BINARY:
-            string = binascii.hexlify(data).decode("utf-8")
-            string = " ".join(["0x"+string[i:i+2] for i in range(0, len(string), 2)]) + " "
+    def ReceiveInto(self, buffer=None):
+        """
+        This method reads all data from the serial input buffer that is available into a preallocated buffer.
+        The data gets read with one ``readv`` system call directly into the buffer,
+        without creating a new ``bytes`` object for each chunk.
+        It is not interpreted by the UART mode.
+        There is no decoding, no formatting and no line ending handling, so this is the cheapest way
+        to get the data when it does not get displayed on a terminal (like when *sterm* is part of a pipe).
 
-        else:
-            raise ValueError("Unknown/Unsupported UARMode!")
+        At most ``len(buffer)`` bytes get read at once.
+        When more data is available, the device stays readable and the rest gets read by the next call.
 
+        Logging, listeners and statistics work like in ``Receive``,
+        except that the log file always gets the raw received data.
+        The listeners get a ``memoryview`` of the buffer.
 
-        if self.logfile:
-            if self.uartmode == UARTMode.TEXT:
-                self.logfile.write(string)
-            else:
-                self.logfile.write(data)
+        Args:
+            buffer: (Optional) A writable buffer (like ``bytearray`` or ``memoryview``) to read the data into.
+                By default an internal buffer of ``RXBUFFERSIZE`` bytes gets reused.
 
-        return string
+        Returns:
+            A ``memoryview`` of the part of the buffer that got filled, or ``None`` when no data is available.
+            The ``memoryview`` is empty when there was a wake up without new data.
+            The content is only valid until the next call of a receive method that uses the same buffer.
+        """
+        data = self.__Read(buffer)
+        if data and self.logfile:
+            self.logfile.Write(data)
+        return data
 
 
 
-    def Transmit(self, string):
+    def __Read(self, buffer=None):
+        """
+        Reads all available data into ``buffer`` (default is ``readbuffer``),
+        counts it in the statistics and passes it to the listeners.
+
+        Returns:
+            A ``memoryview`` of the received data, an empty ``memoryview`` when the data that caused the wake up
+            was already taken, or ``None`` when no data is available (device lost).
+        """
+        view = self.readbuffer if buffer is None else memoryview(buffer)
+        if self.reader:
+            size = self.reader.ReadInto(view)
+            if size == 0:
+                return view[:0] # The data that caused the wake up was already taken by a previous call
+        else:
+            uart = self.uart
+            if uart is None:
+                return None # The device got closed (see Hangup)
+            try:
+                # The device is opened in non-blocking mode, so this does not wait for data
+                size = os.readv(uart.fileno(), [view])
+            except BlockingIOError:
+                return view[:0] # Spurious wake up, or a previous call already took the data
+            except OSError:
+                size = 0        # The device got lost
+
+        if not size:
+            self.stats.Count("rx_empty_reads")
+            return None
+        data = view[:size]
+
+        self.stats.Count("rx_chunks")
+        self.stats.Count("rx_bytes", len(data))
+        self.stats.Observe("rx_chunk_bytes", len(data))
+
+        for listener in self.listeners:
+            listener(data)
+        return data
+
+
+
+    def Transmit(self, string, *, linedelay=True, cancel=None):
         """
         This method transmit data to the UART device.
         The behavior of this method is independent from the UARTMode.
         Is the string argument of type ``str``, then it gets encoded as UTF-8 byte stream, otherwise
         the raw data gets transmitted.
 
+        By default, all data gets written with one write call.
+        To protect slow devices, the transmission can be paced by the ``txpace`` and ``txlinedelay`` arguments
+        of the constructor.
+        Then this method blocks until all data is transmitted.
+        Binary data (like a file transfer) should be transmitted with ``linedelay=False``,
+        otherwise it gets split at each ``0x0A`` and ``0x0D`` byte.
+
+        With flow control (``rtscts``, ``xonxoff``), the device can stop accepting data for any length of time.
+        This method does not block inside the write call, it waits for the device in steps of ``WRITEPOLL`` seconds.
+        A ``cancel`` callback gets called after each step, and after each pacing or line delay.
+        When it returns ``True``, the transmission gets aborted.
+
+        While the device is lost (see ``Hangup``), the data gets discarded.
+        When the device gets lost during a transmission, the transmission gets aborted.
+
         Args:
             string (str, bytes): String with data to transmit
+            linedelay (bool): (Optional) Apply the ``txlinedelay``. Default is ``True``
+            cancel: (Optional) A callable without arguments that returns ``True`` when the transmission shall be aborted
 
         Raises:
             TypeError: When ``string`` is not of type str or bytes.
             UnicodeError: When ``str.encode("utf-8")`` fails encoding the string (only if ``type(string) == str``)
+            ConnectionAbortedError: When the ``cancel`` callback returned ``True``.
+                A part of the data may have been transmitted.
+            ConnectionError: When the device got lost (``Hangup``) during the transmission.
+            OSError: When writing to the device failed.
         """
         if type(string) is str:
             data = string.encode("utf-8")
@@ -229,9 +748,275 @@ class UART(object):
         else:
             raise TypeError("UART.Transmit argument must be of type str or bytes!")
 
-        self.uart.write(data)
+        if self.uart is None:
+            self.stats.Count("tx_discarded_bytes", len(data))
+            return None
+
+        self.stats.Count("tx_writes")
+        self.stats.Count("tx_bytes", len(data))
+
+        if self.txlinedelay and linedelay:
+            for index, line in enumerate(data.splitlines(keepends=True)):
+                if index and cancel and cancel():
+                    raise ConnectionAbortedError("Transmission cancelled")
+                self.__Write(line, cancel)
+                if line[-1:] in (b"\r", b"\n"):
+                    time.sleep(self.txlinedelay)
+        else:
+            self.__Write(data, cancel)
         return None
 
 
-# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
 
+    def __Write(self, data, cancel):
+        if not self.txpace:
+            self.__WriteBlock(data, cancel)
+            return
+
+        # Write blocks of 10 ms worth of data
+        blocksize = max(1, int(self.txpace * 10))
+        for offset in range(0, len(data), blocksize):
+            if offset and cancel and cancel():
+                raise ConnectionAbortedError("Transmission cancelled")
+            block = data[offset:offset+blocksize]
+            self.__WriteBlock(block, cancel)
+            time.sleep(len(block) / (self.txpace * 1000))
+        return
+
+
+
+    def __WriteBlock(self, data, cancel):
+        """
+        Writes all data without blocking inside the write call.
+        The handle only gets used while holding ``txlock``, so that ``Hangup`` cannot close it meanwhile,
+        and the lock gets released at least every ``WRITEPOLL`` seconds.
+        ``cancel`` gets called while the device does not accept data.
+        """
+        view = memoryview(data)
+        while view:
+            with self.txlock:
+                if self.uart is None:
+                    raise ConnectionError("Connection to device %s lost"%(self.devpath))
+                _, writable, _ = select.select([], [self.uart], [], WRITEPOLL)
+                if writable:
+                    try:
+                        view = view[os.write(self.uart.fileno(), view):]
+                    except BlockingIOError:
+                        pass
+                    continue
+            if cancel and cancel():
+                raise ConnectionAbortedError("Transmission cancelled")
+        return
+
+
+
+
+class AsyncUART(UART):
+    """
+    This class manages the connection to a UART device for the use with ``asyncio``.
+    It has the same arguments and the same connection handling as the ``UART`` class.
+    The file descriptor of the device gets registered at the running event loop
+    only while a coroutine waits for data (``loop.add_reader``) or for transmitting data (``loop.add_writer``).
+    So one thread can serve many UART devices.
+    ``asyncio`` gets imported by the coroutines, so that importing this module does not load it.
+
+    Raw data can be read by ``Read`` and ``ReadUntil``.
+    Iterating over an instance with ``async for`` returns the received data interpreted
+    the same way ``UART.Receive`` does, depending on the UART mode.
+
+    Is logging enabled, all received data gets written raw into the log file,
+    independent of the UART mode.
+
+    .. code-block::
+
+        async with AsyncUART("/dev/ttyUSB0", 115200, "8N1") as uart:
+            await uart.Write("reboot\r\n")
+            await uart.ReadUntil(b"login: ")
+            async for string in uart:
+                print(string, end="")
+
+    Args:
+        See ``UART``
+
+    Raises:
+        See ``UART``
+    """
+    def __init__(self, devpath, baudrate, dataformat, **kwargs):
+        if kwargs.get("readersize"):
+            raise ValueError("AsyncUART does not support a reader process!")
+        super().__init__(devpath, baudrate, dataformat, **kwargs)
+        self.rxbuffer = bytearray()
+        self.eof      = False
+
+
+
+    async def __aenter__(self):
+        return self
+
+
+
+    async def __aexit__(self, exctype, exception, traceback):
+        self.Disconnect()
+        return False
+
+
+
+    def __aiter__(self):
+        return self
+
+
+
+    async def __anext__(self):
+        if not self.rxbuffer:
+            await self.__Fill()
+        if not self.rxbuffer:
+            raise StopAsyncIteration
+
+        data = bytes(self.rxbuffer)
+        self.rxbuffer.clear()
+        return self.formatter.Format(data)
+
+
+
+    async def __WaitFor(self, register, unregister):
+        import asyncio
+        loop   = asyncio.get_running_loop()
+        future = loop.create_future()
+        fd     = self.fileno()
+
+        def Ready():
+            if not future.done():
+                future.set_result(None)
+
+        register(fd, Ready)
+        try:
+            await future
+        finally:
+            unregister(fd)
+
+
+
+    async def __Fill(self):
+        """
+        Waits until data is available and appends all of it to the receive buffer.
+        When the device got lost, the ``eof`` attribute gets set to ``True`` and nothing gets appended.
+        """
+        if self.eof:
+            return
+
+        import asyncio
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                data = os.read(self.fileno(), 65536)
+                break
+            except BlockingIOError:
+                await self.__WaitFor(loop.add_reader, loop.remove_reader)
+            except OSError:
+                data = b""
+                break
+
+        if not data:
+            self.eof = True
+            return
+
+        self.stats.Count("rx_chunks")
+        self.stats.Count("rx_bytes", len(data))
+        self.stats.Observe("rx_chunk_bytes", len(data))
+
+        self.rxbuffer += data
+        for listener in self.listeners:
+            listener(data)
+        if self.logfile:
+            self.logfile.Write(data)
+
+
+
+    async def Read(self, size=-1):
+        """
+        This method returns received raw data.
+        If no data is available, it waits until new data arrives.
+
+        Args:
+            size (int): Maximum number of bytes to return. ``-1`` returns all available data.
+
+        Returns:
+            Received data as ``bytes``. An empty ``bytes`` object if the device got lost.
+        """
+        if not self.rxbuffer:
+            await self.__Fill()
+
+        if size < 0:
+            size = len(self.rxbuffer)
+        data = bytes(self.rxbuffer[:size])
+        del self.rxbuffer[:size]
+        return data
+
+
+
+    async def ReadUntil(self, separator=b"\n"):
+        """
+        This method reads raw data until the ``separator`` was received.
+        Only the newly received data gets searched for the separator.
+
+        Args:
+            separator (bytes): The sequence of bytes to wait for
+
+        Returns:
+            Received data as ``bytes``, including the separator.
+
+        Raises:
+            asyncio.IncompleteReadError: When the device got lost before the separator was received.
+                The ``partial`` attribute contains the data received so far.
+        """
+        start = 0
+        while True:
+            index = self.rxbuffer.find(separator, start)
+            if index >= 0:
+                end  = index + len(separator)
+                data = bytes(self.rxbuffer[:end])
+                del self.rxbuffer[:end]
+                return data
+
+            start = max(0, len(self.rxbuffer) - len(separator) + 1)
+            await self.__Fill()
+            if self.eof:
+                import asyncio
+                data = bytes(self.rxbuffer)
+                self.rxbuffer.clear()
+                raise asyncio.IncompleteReadError(data, None)
+
+
+
+    async def Write(self, string):
+        """
+        This method transmits data to the UART device.
+        It waits until all data is written into the devices output buffer.
+        The ``txpace`` and ``txlinedelay`` arguments get ignored.
+
+        Args:
+            string (str, bytes): String with data to transmit
+
+        Raises:
+            TypeError: When ``string`` is not of type str or bytes.
+            UnicodeError: When ``str.encode("utf-8")`` fails encoding the string (only if ``type(string) == str``)
+        """
+        if type(string) is str:
+            data = string.encode("utf-8")
+        elif type(string) is bytes:
+            data = string
+        else:
+            raise TypeError("AsyncUART.Write argument must be of type str or bytes!")
+
+        import asyncio
+        loop = asyncio.get_running_loop()
+        view = memoryview(data)
+        while view:
+            try:
+                view = view[os.write(self.fileno(), view):]
+            except BlockingIOError:
+                await self.__WaitFor(loop.add_writer, loop.remove_writer)
+        return None
+
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
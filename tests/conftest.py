@@ -0,0 +1,60 @@
+# STERM, a serial communication terminal with server capabilities        #
+# Copyright (C) 2013-2023  Ralf Stemmer (ralf.stemmer@gmx.net)           #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
+
+
+import os
+import tty
+import select
+import pytest
+
+
+
+@pytest.fixture
+def device():
+    """
+    A pseudo terminal that stands in for a serial device.
+    The slave side gets opened by ``UART``, the test plays the device on the master side.
+
+    Yields:
+        Tuple of the path of the slave and the file descriptor of the master
+    """
+    master, slave = os.openpty()
+    tty.setraw(master)
+    path = os.ttyname(slave)
+    os.close(slave)
+    yield path, master
+    try:
+        os.close(master)
+    except OSError:
+        pass    # The test closed the device to simulate its loss
+
+
+
+def ReadAvailable(fd, size, timeout=5):
+    """
+    Reads from ``fd`` until ``size`` bytes arrived or nothing arrived for ``timeout`` seconds.
+    """
+    data = b""
+    while len(data) < size and select.select([fd], [], [], timeout)[0]:
+        chunk = os.read(fd, size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
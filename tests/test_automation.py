@@ -0,0 +1,104 @@
+# STERM, a serial communication terminal with server capabilities        #
+# Copyright (C) 2013-2023  Ralf Stemmer (ralf.stemmer@gmx.net)           #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
+
+
+import os
+import re
+import time
+import threading
+import pytest
+from sterm.uart       import UART
+from sterm.automation import Session
+from conftest         import ReadAvailable
+
+
+
+@pytest.fixture
+def session(device):
+    path, master = device
+    uart    = UART(path, 115200, "8N1")
+    session = Session(uart)
+    yield session, master
+    session.Close()
+    uart.Disconnect()
+
+
+
+def WriteLater(fd, chunks, delay=0.05):
+    def Write():
+        for chunk in chunks:
+            time.sleep(delay)
+            os.write(fd, chunk)
+    thread = threading.Thread(target=Write)
+    thread.start()
+    return thread
+
+
+
+def test_expect_pattern_split_over_reads(session):
+    session, master = session
+    WriteLater(master, [b"boot\r\nlog", b"in: "]).join()
+    assert session.Expect("login: ", timeout=5) == 0
+    assert session.before == b"boot\r\n"
+    assert session.match  == b"login: "
+
+
+
+def test_expect_earliest_match_wins_and_consumes(session):
+    session, master = session
+    os.write(master, b"error 42\r\n# ")
+    assert session.Expect(["# ", re.compile(rb"error (\d+)")], timeout=5) == 1
+    assert session.match.group(1) == b"42"
+    assert session.Expect(["error", "# "], timeout=5) == 1
+    assert session.before == b"\r\n"
+
+
+
+def test_expect_timeout(session):
+    session, master = session
+    os.write(master, b"nothing to see")
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        session.Expect("login: ", timeout=0.2)
+    assert time.monotonic() - start < 2
+
+
+
+def test_expect_lost_device(session):
+    session, master = session
+    os.close(master)
+    with pytest.raises(EOFError):
+        session.Expect("login: ", timeout=5)
+
+
+
+def test_expect_rejects_text_regex(session):
+    session, master = session
+    with pytest.raises(TypeError):
+        session.Expect(re.compile("text"), timeout=0)
+
+
+
+def test_send_line(session):
+    session, master = session
+    session.SendLine("root")
+    session.linebreak = b"\n"
+    session.SendLine(b"\x00")
+    assert ReadAvailable(master, 8) == b"root\r\n\x00\n"
+
+
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,122 @@
+# STERM, a serial communication terminal with server capabilities        #
+# Copyright (C) 2013-2023  Ralf Stemmer (ralf.stemmer@gmx.net)           #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
+
+
+import time
+import pytest
+from sterm.capture import CaptureWriter, CaptureReader
+
+
+
+def WriteCapture(path, chunks):
+    writer = CaptureWriter(path)
+    for chunk in chunks:
+        writer.Write(chunk)
+    writer.Close()
+    return
+
+
+
+def test_records_keep_chunks_and_order(tmp_path):
+    path   = str(tmp_path / "test.cap")
+    chunks = [b"first", "zweite Zeile\n", memoryview(bytearray(b"\x00\xff"))]
+    WriteCapture(path, chunks)
+
+    reader  = CaptureReader(path)
+    records = list(reader.Records())
+    assert [data for timestamp, offset, data in records] == [b"first", "zweite Zeile\n".encode("utf-8"), b"\x00\xff"]
+    timestamps = [timestamp for timestamp, offset, data in records]
+    assert timestamps == sorted(timestamps)
+    assert abs(reader.WallTime(timestamps[0]) - time.time()) < 60
+    reader.Close()
+
+
+
+def test_search_finds_matches_across_records(tmp_path):
+    path = str(tmp_path / "test.cap")
+    WriteCapture(path, [b"xxab", b"c", b"abcab", b"cx"])
+
+    reader  = CaptureReader(path)
+    offsets = [offset for timestamp, offset in reader.Search(b"abc")]
+    assert len(offsets) == 3
+    assert all(reader.map[offset:offset+1] == b"a" for offset in offsets)
+    assert list(reader.Search(b"")) == []
+    assert list(reader.Search(b"abcd")) == []
+    reader.Close()
+
+
+
+def test_seek_and_time_range(tmp_path):
+    path = str(tmp_path / "test.cap")
+    WriteCapture(path, [b"one", b"two", b"three"])
+
+    reader  = CaptureReader(path)
+    records = list(reader.Records())
+    start   = records[1][0]
+    assert list(reader.Records(start=start)) == [record for record in records if record[0] >= start]
+    assert list(reader.Records(end=start))   == [record for record in records if record[0] <  start]
+    assert reader.Seek(start) == records[[record[0] for record in records].index(start)][1]
+    timestamps = [timestamp for timestamp, offset, data in records]
+    assert reader.Seek(timestamps[-1] + 1) == len(reader.map)
+    reader.Close()
+
+
+
+def test_appending_keeps_start_time(tmp_path):
+    path = str(tmp_path / "test.cap")
+    WriteCapture(path, [b"before"])
+    starttime = CaptureReader(path).starttime
+    WriteCapture(path, [b"after"])
+
+    reader = CaptureReader(path)
+    assert reader.starttime == starttime
+    assert [data for _, _, data in reader.Records()] == [b"before", b"after"]
+    reader.Close()
+
+
+
+def test_incomplete_record_is_ignored(tmp_path):
+    path = str(tmp_path / "test.cap")
+    WriteCapture(path, [b"complete", b"incomplete"])
+    with open(path, "r+b") as capturefile:
+        capturefile.truncate(capturefile.seek(0, 2) - 3)
+
+    reader = CaptureReader(path)
+    assert [data for _, _, data in reader.Records()] == [b"complete"]
+    reader.Close()
+
+
+
+@pytest.mark.parametrize("content", [b"plain text log\n", b"ab"])
+def test_writer_rejects_other_files(tmp_path, content):
+    path = tmp_path / "test.log"
+    path.write_bytes(content)
+    with pytest.raises(ValueError):
+        CaptureWriter(str(path))
+    assert path.read_bytes() == content
+
+
+
+@pytest.mark.parametrize("content", [b"", b"plain text log\n"])
+def test_reader_rejects_other_files(tmp_path, content):
+    path = tmp_path / "test.log"
+    path.write_bytes(content)
+    with pytest.raises(ValueError):
+        CaptureReader(str(path))
+
+
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,137 @@
+# STERM, a serial communication terminal with server capabilities        #
+# Copyright (C) 2013-2023  Ralf Stemmer (ralf.stemmer@gmx.net)           #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
+
+
+import binascii
+import pytest
+from sterm.framing import SLIPDecoder, COBSDecoder, LengthDecoder, DelimiterDecoder
+from sterm.framing import ParseFraming, FrameFormatter, MAXFRAMESIZE
+
+
+
+def FeedBytewise(decoder, data):
+    frames = []
+    for index in range(len(data)):
+        frames += decoder.Feed(data[index:index+1])
+    return frames
+
+
+
+def test_slip_unescapes_frames():
+    decoder = SLIPDecoder()
+    assert decoder.Feed(b"\xc0ab\xdb\xdccd\xdb\xddef\xc0") == [b"ab\xc0cd\xdbef"]
+    assert decoder.errors == 0
+
+
+
+def test_slip_counts_invalid_escape_sequences():
+    decoder = SLIPDecoder()
+    assert decoder.Feed(b"a\xdbb\xc0ok\xc0") == [b"ok"]
+    assert decoder.errors == 1
+
+
+
+def test_slip_frames_split_over_chunks():
+    data = b"\xc0one\xdb\xdc\xc0two\xc0"
+    assert FeedBytewise(SLIPDecoder(), data) == SLIPDecoder().Feed(data) == [b"one\xc0", b"two"]
+
+
+
+def test_cobs_decodes_zero_bytes():
+    decoder = COBSDecoder()
+    assert decoder.Feed(b"\x03ab\x02c\x00") == [b"ab\x00c"]
+    assert decoder.Feed(b"\x01\x01\x00") == [b"\x00"]
+    assert decoder.Feed(b"\x05ab\x00") == []
+    assert decoder.errors == 1
+
+
+
+def test_cobs_block_of_254_bytes_has_no_zero():
+    payload = bytes(range(1, 255))
+    assert COBSDecoder().Feed(b"\xff" + payload + b"\x00") == [payload]
+
+
+
+def test_length_prefix_split_over_chunks():
+    decoder = LengthDecoder(2, "big")
+    data    = b"\x00\x03abc\x00\x00\x00\x01x"
+    assert FeedBytewise(decoder, data) == [b"abc", b"", b"x"]
+    assert LengthDecoder(1).Feed(b"\x02hi\x01") == [b"hi"]
+    assert LengthDecoder(4, "little").Feed(b"\x02\x00\x00\x00hi") == [b"hi"]
+
+
+
+def test_length_prefix_discards_oversized_frames():
+    decoder = LengthDecoder(4)
+    assert decoder.Feed((MAXFRAMESIZE + 1).to_bytes(4, "big") + b"data") == []
+    assert decoder.errors == 1
+    assert decoder.Feed(b"\x00\x00\x00\x02ok") == [b"ok"]
+
+
+
+def test_delimiter_across_chunk_boundary():
+    decoder = DelimiterDecoder(b"\r\n")
+    assert decoder.Feed(b"one\r") == []
+    assert decoder.Feed(b"\ntwo\r\n\r\n") == [b"one", b"two"]
+
+
+
+def test_delimiter_discards_oversized_frames():
+    decoder = DelimiterDecoder(b"\n")
+    assert decoder.Feed(b"x" * (MAXFRAMESIZE + 1)) == []
+    assert decoder.errors == 1
+    assert decoder.Feed(b"ok\n") == [b"ok"]
+
+
+
+@pytest.mark.parametrize("definition, decodertype", [
+    ("slip",            SLIPDecoder),
+    ("cobs",            COBSDecoder),
+    ("length",          LengthDecoder),
+    ("length:4:little", LengthDecoder),
+    ("delimiter:\\x00", DelimiterDecoder),
+    ])
+def test_parse_framing(definition, decodertype):
+    assert type(ParseFraming(definition)) is decodertype
+
+
+
+@pytest.mark.parametrize("definition", ["", "slip:1", "length:3", "length:2:middle", "delimiter:", "hdlc"])
+def test_parse_framing_rejects_invalid_definitions(definition):
+    with pytest.raises(ValueError):
+        ParseFraming(definition)
+
+
+
+def test_frame_formatter_checks_crc():
+    frame     = b"\x01\x02\x03"
+    crc       = binascii.crc_hqx(frame, 0xFFFF).to_bytes(2, "big")
+    formatter = FrameFormatter(SLIPDecoder(), "crc16")
+    lines     = formatter.Format(frame + crc + b"\xc0" + frame + b"\x00\x00\xc0").splitlines()
+    assert lines[0].endswith("   5: 01 02 03 " + crc.hex(" "))
+    assert lines[1].endswith("   5: 01 02 03 00 00 CRC error")
+    assert (formatter.frames, formatter.crcerrors) == (2, 1)
+    assert formatter.Format(b"\x01") == ""
+
+
+
+def test_frame_formatter_rejects_unknown_crc():
+    with pytest.raises(ValueError):
+        FrameFormatter(SLIPDecoder(), "crc8")
+
+
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
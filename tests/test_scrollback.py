@@ -0,0 +1,80 @@
+# STERM, a serial communication terminal with server capabilities        #
+# Copyright (C) 2013-2023  Ralf Stemmer (ralf.stemmer@gmx.net)           #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
+
+
+import re
+import pytest
+from sterm.scrollback import Scrollback
+
+
+
+def Filled(size, chunks):
+    scrollback = Scrollback(size)
+    for chunk in chunks:
+        scrollback.Write(chunk)
+    return scrollback
+
+
+
+def test_keeps_the_newest_data():
+    scrollback = Filled(8, [b"0123", b"4567", b"89"])
+    assert scrollback.total == 10
+    assert scrollback.Read(0, 10) == b"23456789"
+    assert scrollback.Read(5, 7)  == b"56"
+    assert Filled(8, [b"x", b"0123456789ab"]).Read(0, 13) == b"456789ab"
+
+
+
+def test_find_returns_newest_first():
+    scrollback = Filled(64, [b"ok 1\nerror\nok 2\nerror\n"])
+    assert scrollback.Find(b"error") == [(16, 5), (5, 5)]
+    assert scrollback.Find(b"error", limit=1) == [(16, 5)]
+    assert scrollback.Find(b"missing") == []
+    assert scrollback.Find(b"") == []
+
+
+
+def test_find_across_the_wrap_around_point():
+    scrollback = Filled(10, [b"abcdefgh", b"xyzNEE", b"DLE"])    # "NEEDLE" spans the end of the ring
+    assert scrollback.Read(0, scrollback.total) == b"hxyzNEEDLE"
+    assert scrollback.Find(b"NEEDLE") == [(11, 6)]
+    assert scrollback.Find(rb"N\w+E", regex=True) == [(11, 6)]
+
+
+
+def test_find_ignores_overwritten_data():
+    scrollback = Filled(8, [b"needle", b"12345678"])
+    assert scrollback.Find(b"needle") == []
+
+
+
+def test_context_lines():
+    scrollback = Filled(1024, [b"one\ntwo\nthree\nfour ERROR here\nfive\nsix\nseven\n"])
+    position, length = scrollback.Find(b"ERROR")[0]
+    before, match, after = scrollback.Context(position, length, lines=1)
+    assert (before, match, after) == (b"three\nfour ", b"ERROR", b" here\nfive")
+
+
+
+def test_invalid_regex_and_size():
+    with pytest.raises(ValueError):
+        Scrollback(0)
+    with pytest.raises(re.error):
+        Filled(16, [b"data"]).Find(b"(", regex=True)
+
+
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,162 @@
+# STERM, a serial communication terminal with server capabilities        #
+# Copyright (C) 2013-2023  Ralf Stemmer (ralf.stemmer@gmx.net)           #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
+
+
+import os
+import time
+import socket
+import selectors
+import threading
+import pytest
+from sterm.uart   import UART
+from sterm.server import Server
+from conftest     import ReadAvailable
+
+
+
+class Loop(object):
+    """
+    A receiver loop like the one of *sterm*, serving a UART device and a server from one selector.
+    """
+    def __init__(self, uart, server):
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(uart, selectors.EVENT_READ)
+        server.Register(self.selector)
+        self.uart    = uart
+        self.running = True
+        self.thread  = threading.Thread(target=self.Run)
+        self.thread.start()
+
+    def Run(self):
+        while self.running:
+            for key, mask in self.selector.select(0.05):
+                if callable(key.data):
+                    key.data(mask)
+                elif self.uart.Receive() is None:
+                    return
+
+    def Stop(self):
+        self.running = False
+        self.thread.join()
+
+
+
+@pytest.fixture
+def server(device, request):
+    path, master = device
+    options      = dict(getattr(request, "param", {}))
+    uart   = UART(path, 115200, "8N1", txpace=options.pop("txpace", None))
+    server = Server(("127.0.0.1", 0), uart, **options)
+    loop   = Loop(uart, server)
+    yield server, master, loop
+    loop.Stop()
+    server.Close()
+    uart.Disconnect()
+
+
+
+def Connect(server):
+    client = socket.create_connection(server.address, timeout=5)
+    # Wait until the receiver loop accepted the client
+    for attempt in range(100):
+        if any(entry.address == client.getsockname() for entry in list(server.clients.values())):
+            break
+        time.sleep(0.01)
+    return client
+
+
+
+def Receive(client, size):
+    data = b""
+    while len(data) < size:
+        chunk = client.recv(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+
+def test_device_data_reaches_all_clients(server):
+    server, master, loop = server
+    clients = [Connect(server), Connect(server)]
+    os.write(master, b"boot message\r\n")
+    for client in clients:
+        assert Receive(client, 14) == b"boot message\r\n"
+        client.close()
+
+
+
+def test_only_the_first_writer_reaches_the_device(server):
+    server, master, loop = server
+    first, second = Connect(server), Connect(server)
+    first.sendall(b"first")
+    assert ReadAvailable(master, 5) == b"first"
+    second.sendall(b"second")
+    first.sendall(b"again")
+    assert ReadAvailable(master, 5) == b"again"
+
+    first.close()
+    time.sleep(0.2)                     # The second client becomes writer after the first disconnected
+    second.sendall(b"now")
+    assert ReadAvailable(master, 3) == b"now"
+    second.close()
+
+
+
+@pytest.mark.parametrize("server", [{"readonly": True}], indirect=True)
+def test_readonly_discards_client_data(server):
+    server, master, loop = server
+    client = Connect(server)
+    client.sendall(b"ignored")
+    assert ReadAvailable(master, 7, timeout=0.3) == b""
+    client.close()
+
+
+
+@pytest.mark.parametrize("server", [{"txpace": 1}], indirect=True)
+def test_paced_transmission_does_not_block_receiving(server):
+    server, master, loop = server
+    client = Connect(server)
+    client.sendall(b"x" * 500)          # Takes 0.5 s at 1 byte per millisecond
+    time.sleep(0.05)
+
+    start = time.monotonic()
+    os.write(master, b"ping")
+    assert Receive(client, 4) == b"ping"
+    assert time.monotonic() - start < 0.25
+    assert ReadAvailable(master, 500) == b"x" * 500
+    client.close()
+
+
+
+@pytest.mark.parametrize("server", [{"buffersize": 1024}], indirect=True)
+def test_slow_client_gets_disconnected(server):
+    server, master, loop = server
+    slow = Connect(server)
+    loop.Stop()                         # Send gets called directly, not by the receiver loop
+
+    chunk = b"x" * 65536
+    for attempt in range(4096):
+        if not server.clients:
+            break
+        server.Send(chunk)
+    assert not server.clients
+    slow.close()
+
+
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
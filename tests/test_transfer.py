@@ -0,0 +1,185 @@
+# STERM, a serial communication terminal with server capabilities        #
+# Copyright (C) 2013-2023  Ralf Stemmer (ralf.stemmer@gmx.net)           #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
+
+
+import os
+import select
+import binascii
+import threading
+import pytest
+from sterm.uart     import UART
+from sterm.transfer import FileTransfer, SOH, STX, EOT, ACK, NAK, CAN, CRC
+from conftest       import ReadAvailable
+
+
+
+@pytest.fixture
+def uart(device):
+    """
+    A ``UART`` with a receiver thread, like the one of *sterm*, that passes the replies to the listeners.
+    """
+    path, master = device
+    uart    = UART(path, 115200, "8N1")
+    running = True
+    def Receive():
+        while running:
+            if select.select([uart], [], [], 0.05)[0] and uart.ReceiveInto() is None:
+                return
+    thread = threading.Thread(target=Receive)
+    thread.start()
+    yield uart, master
+    running = False
+    thread.join()
+    uart.Disconnect()
+
+
+
+def Receiver(master, *, crc=True, ymodem=False, rejects=0, request=None):
+    """
+    Plays an XMODEM or YMODEM receiver on the device side.
+    Like a real receiver, it repeats the start request (``request``, default depends on ``crc``)
+    until the first block arrives or ``stop`` gets set.
+    The first ``rejects`` data blocks get rejected once with NAK.
+
+    Returns:
+        A dictionary that gets filled with the received ``blocks`` (block number, data) by a thread,
+        the thread itself as ``thread`` and an event ``stop``
+    """
+    result = {"blocks": [], "stop": threading.Event()}
+    if request is None:
+        request = CRC if crc else NAK
+    def Run():
+        while not select.select([master], [], [], 0.1)[0]:
+            if result["stop"].is_set():
+                return
+            os.write(master, bytes([request]))
+        rejected = set()
+        batches  = 2 if ymodem else 1
+        while batches:
+            start = ReadAvailable(master, 1)
+            if start == bytes([EOT]):
+                os.write(master, bytes([ACK]))
+                if ymodem:
+                    os.write(master, bytes([CRC]))
+                else:
+                    batches = 0
+                continue
+
+            size   = 128 if start == bytes([SOH]) else 1024
+            block  = ReadAvailable(master, 2 + size + (2 if crc else 1))
+            number, inverse, data, check = block[0], block[1], block[2:2+size], block[2+size:]
+            assert number + inverse == 0xFF
+            if crc:
+                assert check == binascii.crc_hqx(data, 0).to_bytes(2, "big")
+            else:
+                assert check == bytes([sum(data) & 0xFF])
+
+            if number and number not in rejected and len(rejected) < rejects:
+                rejected.add(number)
+                os.write(master, bytes([NAK]))
+                continue
+            result["blocks"].append((number, data))
+            os.write(master, bytes([ACK]))
+            if ymodem and number == 0:
+                if data.strip(b"\0"):
+                    os.write(master, bytes([CRC]))  # Header of the file, the data follows
+                else:
+                    batches = 0                     # Empty header: end of the batch
+    result["thread"] = threading.Thread(target=Run, daemon=True)
+    result["thread"].start()
+    return result
+
+
+
+@pytest.fixture
+def firmware(tmp_path):
+    path = tmp_path / "firmware.bin"
+    path.write_bytes(bytes(range(256)) * 5 + b"end")
+    return str(path)
+
+
+
+def test_send_streams_the_file(uart, firmware):
+    uart, master = uart
+    progress     = []
+    transfer     = FileTransfer(uart, firmware, progress=lambda t: progress.append(t.sent))
+    transfer.Send(chunksize=1000)
+    assert ReadAvailable(master, transfer.size) == open(firmware, "rb").read()
+    assert progress == [1000, transfer.size]
+
+
+
+@pytest.mark.parametrize("crc, blocksize, rejects", [(True, 128, 0), (False, 128, 2), (True, 1024, 1), (False, 1024, 0)])
+def test_xmodem(uart, firmware, crc, blocksize, rejects):
+    uart, master = uart
+    receiver     = Receiver(master, crc=crc, rejects=rejects)
+    transfer     = FileTransfer(uart, firmware)
+    transfer.SendXMODEM(blocksize=blocksize)
+    receiver["thread"].join(5)
+
+    blocks = receiver["blocks"]
+    assert [number for number, data in blocks] == list(range(1, len(blocks) + 1))
+    assert len(blocks[0][1]) == (blocksize if crc else 128)     # XMODEM-1K needs CRC-16
+    data = b"".join(data for number, data in blocks)
+    assert data.rstrip(b"\x1a") == open(firmware, "rb").read()
+    assert transfer.sent == transfer.size
+
+
+
+def test_ymodem(uart, firmware):
+    uart, master = uart
+    receiver     = Receiver(master, ymodem=True)
+    FileTransfer(uart, firmware).SendYMODEM()
+    receiver["thread"].join(5)
+
+    blocks = receiver["blocks"]
+    name, _, info = blocks[0][1].partition(b"\0")
+    assert name == b"firmware.bin"
+    assert int(info.split(b" ")[0]) == os.path.getsize(firmware)
+    assert b"".join(data for number, data in blocks[1:-1]).rstrip(b"\x1a") == open(firmware, "rb").read()
+    assert blocks[-1] == (0, bytes(128))
+
+
+
+def test_receiver_cancels(uart, firmware):
+    uart, master = uart
+    receiver     = Receiver(master, request=CAN)
+    with pytest.raises(ConnectionAbortedError):
+        FileTransfer(uart, firmware).SendXMODEM()
+    receiver["stop"].set()
+    receiver["thread"].join(5)
+
+
+
+def test_user_cancels(uart, firmware):
+    uart, master = uart
+    cancelled    = threading.Event()
+    transfer     = FileTransfer(uart, firmware, cancel=cancelled.is_set)
+    threading.Timer(0.2, cancelled.set).start()
+    with pytest.raises(ConnectionAbortedError):
+        transfer.SendXMODEM()   # Waits for the start request until it gets cancelled
+    assert ReadAvailable(master, 1024, timeout=0.5).endswith(bytes([CAN, CAN, CAN]))
+
+
+
+def test_xmodem_rejects_block_size(uart, firmware):
+    uart, master = uart
+    with pytest.raises(ValueError):
+        FileTransfer(uart, firmware).SendXMODEM(blocksize=512)
+
+
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
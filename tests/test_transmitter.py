@@ -0,0 +1,72 @@
+# STERM, a serial communication terminal with server capabilities        #
+# Copyright (C) 2013-2023  Ralf Stemmer (ralf.stemmer@gmx.net)           #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
+
+
+import time
+import pytest
+from sterm.uart        import UART
+from sterm.transmitter import Transmitter
+from conftest          import ReadAvailable
+
+
+
+@pytest.fixture
+def uart(device):
+    path, master = device
+    uart = UART(path, 115200, "8N1", txpace=1)  # 1 byte per millisecond
+    yield uart, master
+    uart.Disconnect()
+
+
+
+def test_transmits_in_order_without_blocking(uart):
+    uart, master = uart
+    transmitter  = Transmitter(uart)
+    calls        = []
+    start = time.monotonic()
+    assert transmitter.Transmit(b"a" * 100)
+    transmitter.Call(calls.append, "called")
+    assert transmitter.Transmit("b" * 100)
+    assert time.monotonic() - start < 0.05
+    assert ReadAvailable(master, 200) == b"a" * 100 + b"b" * 100
+    assert calls == ["called"]
+    transmitter.Close()
+
+
+
+def test_full_queue_drops_data(uart):
+    uart, master = uart
+    transmitter  = Transmitter(uart, queuesize=100)
+    assert transmitter.Transmit(b"x" * 100)
+    assert not transmitter.Transmit(b"y")
+    assert ReadAvailable(master, 100) == b"x" * 100
+    transmitter.Close()
+
+
+
+def test_close_aborts_paced_transmission(uart):
+    uart, master = uart
+    transmitter  = Transmitter(uart)
+    transmitter.Transmit(b"x" * 5000)   # Takes 5 s at the given pace
+    time.sleep(0.1)
+    start = time.monotonic()
+    transmitter.Close()
+    assert time.monotonic() - start < 1
+    assert not transmitter.Transmit(b"late")
+
+
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
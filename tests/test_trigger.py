@@ -0,0 +1,121 @@
+# STERM, a serial communication terminal with server capabilities        #
+# Copyright (C) 2013-2023  Ralf Stemmer (ralf.stemmer@gmx.net)           #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
+
+
+import os
+import time
+import random
+import pytest
+from sterm.uart    import UART
+from sterm.trigger import Automaton, ParseTrigger, Triggers
+from conftest      import ReadAvailable
+
+
+
+def FindAll(patterns, data):
+    return sorted((index, position + len(pattern))
+        for index, pattern in enumerate(patterns)
+        for position in range(len(data)) if data.startswith(pattern, position))
+
+
+
+def test_automaton_finds_overlapping_patterns():
+    patterns = [b"he", b"she", b"his", b"hers"]
+    matches, state = Automaton(patterns).Scan(b"ushers")
+    assert sorted(matches) == [(0, 4), (1, 4), (3, 6)]
+
+
+
+def test_automaton_matches_across_chunks():
+    generator = random.Random(1)
+    patterns  = [bytes(generator.choice(b"abc") for _ in range(generator.randint(1, 4))) for _ in range(8)]
+    patterns  = list(dict.fromkeys(patterns))
+    data      = bytes(generator.choice(b"abcx") for _ in range(2000))
+    automaton = Automaton(patterns)
+
+    matches, state, offset = [], 0, 0
+    while offset < len(data):
+        size    = generator.randint(1, 7)
+        found, state = automaton.Scan(data[offset:offset+size], state)
+        matches += [(index, offset + end) for index, end in found]
+        offset += size
+    assert sorted(matches) == FindAll(patterns, data)
+
+
+
+@pytest.mark.parametrize("patterns", [[], [b"ok", b""]])
+def test_automaton_rejects_empty_patterns(patterns):
+    with pytest.raises(ValueError):
+        Automaton(patterns)
+
+
+
+def test_parse_trigger():
+    assert ParseTrigger("Kernel panic=highlight") == (b"Kernel panic", "highlight", None)
+    assert ParseTrigger("login:=send:root\\r")    == (b"login:", "send", b"root\r")
+    assert ParseTrigger("a=b=exec:echo a=b")      == (b"a=b", "exec", b"echo a=b")
+    with pytest.raises(ValueError):
+        ParseTrigger("pattern=beep")
+
+
+
+@pytest.fixture
+def uart(device):
+    path, master = device
+    uart = UART(path, 115200, "8N1", txpace=1)  # 1 byte per millisecond
+    yield uart, master
+    uart.Disconnect()
+
+
+
+def test_highlight_notices(uart):
+    uart, master = uart
+    triggers     = Triggers(uart, [ParseTrigger("panic=highlight")])
+    triggers.Scan(b"kernel pa")
+    assert triggers.Notices() == ""
+    triggers.Scan(b"nic")
+    assert "trigger \"panic\"" in triggers.Notices()
+    assert triggers.Notices() == ""
+    triggers.Close()
+
+
+
+def test_send_does_not_block_the_receive_path(uart):
+    uart, master = uart
+    triggers     = Triggers(uart, [ParseTrigger("login:=send:" + "x" * 200 + "\\r")])
+    start = time.monotonic()
+    triggers.Scan(b"login:")
+    assert time.monotonic() - start < 0.1         # Transmitting takes 0.2 s at the given pace
+    assert ReadAvailable(master, 201) == b"x" * 200 + b"\r"
+    triggers.Close()
+
+
+
+def test_exec_runs_command(uart, tmp_path):
+    uart, master = uart
+    path         = tmp_path / "fired"
+    triggers     = Triggers(uart, [ParseTrigger("ASSERT=exec:echo $STERM_TRIGGER >> %s"%(path))])
+    triggers.Scan(b"ASSERT failed")
+    for attempt in range(50):
+        if path.exists() and path.read_text():
+            break
+        time.sleep(0.1)
+    assert path.read_text() == "ASSERT\n"
+    triggers.Close()
+
+
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4